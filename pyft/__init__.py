@@ -1,31 +1,85 @@
 import os
-import importlib
+import threading
 
 from pyft.utils import get_cls_by_name
 from pyft.utils import ft_client_factory
+from pyft.cache import TTLCache
+from pyft.cache import QueryCache
 
 class App(object):
 
   settings = None
   loader = None
   client = None
+  metadata_cache = None
+  async_client = None
 
   def __init__(self, loader):
     super(App, self).__init__()
     self.loader = loader
     self.settings = loader.read_configuration()
+    # table schemas and names, shared by every FusionTable
+    self.metadata_cache = TTLCache(self.settings['PYFT_METADATA_TTL'])
     u = self.settings['PYFT_GOOGLE_USERNAME']
     p = self.settings['PYFT_GOOGLE_PASSWORD']
-    self.client = ft_client_factory(u, p)
-    import logging
-    logging.basicConfig(filename='/tmp/pyft.log', level=logging.DEBUG)
-    logging.debug('Beginning')
+    from pyft.client.authorization.tokencache import TokenCache
+    # no network I/O here, the client logs in on its first query
+    self.client = ft_client_factory(u, p, TokenCache(self.settings['PYFT_TOKEN_CACHE'],
+                                                     self.settings['PYFT_TOKEN_TTL']))
+    if self.settings['PYFT_QUERY_CACHE_SIZE']:
+      self.client.read_cache = QueryCache(self.settings['PYFT_QUERY_CACHE_SIZE'],
+                                          self.settings['PYFT_QUERY_CACHE_TTL'])
+    if self.settings['PYFT_LOG_FILE']:
+      import logging
+      handler = logging.FileHandler(self.settings['PYFT_LOG_FILE'])
+      handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+      logger = logging.getLogger('pyft')
+      logger.addHandler(handler)
+      logger.setLevel(self.settings['PYFT_LOG_LEVEL'])
+      logger.debug('Beginning')
+
+  def get_async_client(self):
+    "the AsyncFTClient for `client`, started on first use"
+    if self.async_client is None:
+      from pyft.client.asyncclient import AsyncFTClient
+      self.async_client = AsyncFTClient(self.client)
+    return self.async_client
 
 
 def get_app():
   loader_cls = get_cls_by_name(os.environ.get("PYFT_LOADER", "pyft.loader.Loader"))
   return App(loader_cls())
 
-# global app
-current_app = get_app()
+class LazyApp(object):
+  """
+  Stands in for the App until it is first used, so that importing pyft
+  neither reads the configuration nor builds a client. Getting or setting
+  any attribute creates the App with `factory` and passes through to it.
+  """
+
+  def __init__(self, factory):
+    object.__setattr__(self, '_factory', factory)
+    object.__setattr__(self, '_app', None)
+    object.__setattr__(self, '_lock', threading.Lock())
+
+  def _get_app(self):
+    if self._app is None:
+      with self._lock:
+        if self._app is None:
+          object.__setattr__(self, '_app', self._factory())
+    return self._app
+
+  def __getattr__(self, name):
+    return getattr(self._get_app(), name)
+
+  def __setattr__(self, name, value):
+    setattr(self._get_app(), name, value)
+
+  def __repr__(self):
+    if self._app is None:
+      return '<LazyApp: not loaded>'
+    return repr(self._app)
+
+# global app, created on first use
+current_app = LazyApp(get_app)
 
@@ -0,0 +1,115 @@
+import time
+import threading
+from collections import OrderedDict
+
+_missing = object()
+
+class TTLCache(object):
+  """
+  A thread-safe dictionary whose entries expire `ttl` seconds after they
+  are set. A `ttl` of None never expires entries, and 0 disables the cache.
+  With `maxsize` only that many entries are kept, the least recently used
+  being dropped first. Hits and misses are counted so callers can check
+  how often they end up going to the server.
+  """
+
+  def __init__(self, ttl=None, maxsize=None):
+    self.ttl = ttl
+    self.maxsize = maxsize
+    self._data = OrderedDict()
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is not None and entry[1] is not None and entry[1] < time.time():
+        del self._data[key]
+        entry = None
+      if entry is None:
+        self.misses += 1
+        return default
+      if self.maxsize is not None:
+        # mark as most recently used
+        del self._data[key]
+        self._data[key] = entry
+      self.hits += 1
+      return entry[0]
+
+  def set(self, key, value):
+    if self.ttl == 0:
+      return
+    expires = time.time() + self.ttl if self.ttl is not None else None
+    with self._lock:
+      self._data.pop(key, None)
+      self._data[key] = (value, expires)
+      if self.maxsize is not None and len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def get_or_set(self, key, func):
+    "return the cached value for `key`, calling `func` to fill it on a miss"
+    value = self.get(key, _missing)
+    if value is _missing:
+      value = func()
+      self.set(key, value)
+    return value
+
+  def invalidate(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def invalidate_matching(self, predicate):
+    "drop every entry for which predicate(key, value) is true"
+    with self._lock:
+      for key, (value, expires) in self._data.items():
+        if predicate(key, value):
+          del self._data[key]
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+class QueryCache(object):
+  """
+  Caches the results of read-only queries for `ttl` seconds, keyed by
+  their normalized SQL, keeping the `maxsize` most recently used. Each
+  result remembers the tables it read, and is dropped when a mutating
+  query touches one of them.
+  """
+
+  def __init__(self, maxsize=128, ttl=60):
+    self.results = TTLCache(ttl, maxsize)
+    # bumped on every invalidation, so a read that was in flight while a
+    # table changed doesn't store its stale result
+    self._generation = 0
+    self._lock = threading.Lock()
+
+  def generation(self):
+    return self._generation
+
+  def get(self, key):
+    entry = self.results.get(key)
+    return entry and entry[1]
+
+  def set(self, key, tables, result, generation):
+    "cache `result` unless something was invalidated since `generation`"
+    with self._lock:
+      if generation == self._generation:
+        self.results.set(key, (frozenset(tables), result))
+
+  def invalidate(self, tables=None):
+    "drop the results that read any of `tables`, or all of them for None"
+    with self._lock:
+      self._generation += 1
+      if tables is None:
+        self.results.clear()
+      else:
+        tables = frozenset(tables)
+        self.results.invalidate_matching(lambda key, entry: entry[0] & tables)
+
+  def stats(self):
+    return self.results.stats()
@@ -0,0 +1,103 @@
+import os
+import json
+import threading
+
+class Checkpoint(object):
+  """
+  An append-only journal of the batches of a bulk job the server has
+  acknowledged, so that an interrupted job can resume after the last of
+  them instead of sending everything again.
+
+  Every committed batch is written as one line holding the job's
+  position after the batch (e.g. a file offset or row count) and the row
+  ids it returned, and is synced to disk before the job goes on. A line
+  torn by a crash is ignored on loading. Batches that were in flight
+  when the job stopped are not in the journal and are sent again.
+
+  Batches sent concurrently may be acknowledged out of order, so each
+  line also holds the number of its batch, counted from 0. `position`
+  and `row_ids` only cover the batches up to the first one missing;
+  those acknowledged after it are kept in `ahead`, by number, until it
+  is committed, and a resumed job skips them.
+
+  `job` names what the journal belongs to, e.g. the file and table id of
+  an import; loading a journal written for a different job raises
+  ValueError. The journal is kept once the job is done, so running it
+  again sends nothing; `clear` starts over.
+  """
+
+  def __init__(self, path, job):
+    self.path = os.path.expanduser(path)
+    self.job = job
+    self._lock = threading.Lock()
+    self.load()
+
+  def load(self):
+    self.batches = 0
+    self.position = None
+    self.row_ids = []
+    # batch number -> (position, row ids) of the batches committed after
+    # one that is missing
+    self.ahead = {}
+    try:
+      f = open(self.path, 'rb')
+    except IOError:
+      return
+    with f:
+      data = f.read()
+    entries = []
+    good = 0
+    for line in data.split('\n'):
+      try:
+        entries.append(json.loads(line))
+      except ValueError:
+        # the last line, cut short by a crash
+        break
+      good += len(line) + 1
+    if entries and entries[0].get('job') != self.job:
+      raise ValueError('%s is the checkpoint of %r, not %r' % (self.path, entries[0].get('job'), self.job))
+    if good < len(data):
+      # drop the torn line, so the next commit starts on a line of its own
+      with open(self.path, 'r+b') as f:
+        f.truncate(good)
+    for entry in entries[1:]:
+      # row ids come back from the server as byte strings
+      self._add(entry.get('batch'), entry['position'],
+                [str(row_id) for row_id in entry['row_ids']])
+
+  def _add(self, batch, position, row_ids):
+    if batch is None:
+      batch = self.batches
+    self.ahead[batch] = (position, row_ids)
+    while self.batches in self.ahead:
+      self.position, row_ids = self.ahead.pop(self.batches)
+      self.row_ids += row_ids
+      self.batches += 1
+
+  def commit(self, row_ids, position, batch=None):
+    """ record an acknowledged batch and the position of the job after it;
+    `batch` is its number, by default the one after the last in order """
+    with self._lock:
+      if batch is None:
+        batch = self.batches
+      lines = []
+      if not os.path.exists(self.path) or not os.path.getsize(self.path):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+          os.makedirs(directory)
+        lines.append(json.dumps({'job': self.job}))
+      lines.append(json.dumps({'batch': batch, 'position': position, 'row_ids': list(row_ids)}))
+      with open(self.path, 'ab') as f:
+        f.write('\n'.join(lines) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+      self._add(batch, position, list(row_ids))
+
+  def clear(self):
+    with self._lock:
+      if os.path.exists(self.path):
+        os.remove(self.path)
+      self.batches = 0
+      self.position = None
+      self.row_ids = []
+      self.ahead = {}
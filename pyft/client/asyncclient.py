@@ -0,0 +1,636 @@
+#!/usr/bin/python
+
+""" Non-blocking Fusion Tables client.
+
+Queries are sent from a single event loop thread (asyncore) over a small
+set of persistent HTTP/1.1 connections, so any number of outstanding
+queries costs one thread rather than one thread each. Callers get a
+Future back straight away.
+"""
+
+import asyncore
+import errno
+import fcntl
+import heapq
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+import urllib2
+import urlparse
+from collections import deque
+from StringIO import StringIO
+
+from connectionpool import DEFAULT_MAXSIZE, DEFAULT_MAX_IDLE, DEFAULT_TIMEOUT
+from connectionpool import IDEMPOTENT_METHODS
+from sql import statements
+
+DEFAULT_RECV_SIZE = 65536
+# the longest the loop sleeps without checking for expired requests
+POLL_INTERVAL = 1.0
+
+SSL_WANT = (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE)
+
+
+class Future(object):
+  """ The result of a query that may not have finished yet.
+
+  Callbacks added with add_done_callback are run on the event loop
+  thread, or straight away if the future is already done.
+  """
+
+  def __init__(self):
+    self._done = threading.Event()
+    self._result = None
+    self._error = None
+    self._callbacks = []
+    self._lock = threading.Lock()
+
+  def done(self):
+    return self._done.is_set()
+
+  def result(self, timeout=None):
+    """ Wait for the result.
+
+    Raises the query's exception if it failed, or RuntimeError if it did
+    not finish within `timeout` seconds.
+    """
+    if not self._done.wait(timeout):
+      raise RuntimeError('the query did not finish in %s seconds' % timeout)
+    if self._error is not None:
+      raise self._error[0], self._error[1], self._error[2]
+    return self._result
+
+  def exception(self, timeout=None):
+    self._done.wait(timeout)
+    return self._error and self._error[1]
+
+  def add_done_callback(self, func):
+    with self._lock:
+      if not self._done.is_set():
+        self._callbacks.append(func)
+        return
+    func(self)
+
+  def set_result(self, result):
+    self._finish(result, None)
+
+  def set_exception(self, error, tb=None):
+    self._finish(None, (type(error), error, tb))
+
+  def _finish(self, result, error):
+    with self._lock:
+      if self._done.is_set():
+        return
+      self._result = result
+      self._error = error
+      self._done.set()
+      callbacks, self._callbacks = self._callbacks, []
+    for func in callbacks:
+      func(self)
+
+  def then(self, func):
+    """ A Future of func(result), failing if this one, or func, fails. """
+    future = Future()
+    def chain(done):
+      try:
+        future.set_result(func(done.result()))
+      except Exception, e:
+        future.set_exception(e, sys.exc_info()[2])
+    self.add_done_callback(chain)
+    return future
+
+
+def gather(futures):
+  """ A Future of the list of `futures`' results, in order. It fails as
+  soon as any of them does. """
+  futures = list(futures)
+  future = Future()
+  remaining = [len(futures)]
+  lock = threading.Lock()
+
+  def collect(done):
+    if done._error is not None:
+      future._finish(None, done._error)
+      return
+    with lock:
+      remaining[0] -= 1
+      finished = remaining[0] == 0
+    if finished:
+      future.set_result([f._result for f in futures])
+
+  if not futures:
+    future.set_result([])
+  for f in futures:
+    f.add_done_callback(collect)
+  return future
+
+
+_exhausted = object()
+
+def gather_bounded(submit, items, limit):
+  """ Like gather([submit(item) for item in items]), but `items` is only
+  consumed as the Futures finish, so at most `limit` are outstanding at
+  once and the items need not all be built up front. It fails as soon as
+  any of them does, without submitting any more. """
+  items = iter(items)
+  future = Future()
+  results = []
+  state = {'pending': 0, 'exhausted': False}
+  lock = threading.Lock()
+
+  def fill():
+    while True:
+      with lock:
+        if future.done() or state['exhausted'] or state['pending'] >= limit:
+          return
+        try:
+          item = next(items, _exhausted)
+        except Exception, e:
+          # e.g. a row that can't be rendered
+          future.set_exception(e, sys.exc_info()[2])
+          return
+        if item is _exhausted:
+          state['exhausted'] = True
+          finished = state['pending'] == 0
+        else:
+          index = len(results)
+          results.append(None)
+          state['pending'] += 1
+      if item is _exhausted:
+        if finished:
+          future.set_result(results)
+        return
+      try:
+        submitted = submit(item)
+      except Exception, e:
+        future.set_exception(e, sys.exc_info()[2])
+        return
+      submitted.add_done_callback(lambda done, index=index: collect(index, done))
+
+  def collect(index, done):
+    if done._error is not None:
+      future._finish(None, done._error)
+      return
+    with lock:
+      results[index] = done._result
+      state['pending'] -= 1
+      finished = state['exhausted'] and state['pending'] == 0
+    if finished:
+      future.set_result(results)
+    else:
+      fill()
+
+  fill()
+  return future
+
+
+class AsyncResponse(object):
+  """ The status, reason and (lowercased) headers of a response. """
+
+  def __init__(self, version, status, reason, headers):
+    self.version = version
+    self.status = status
+    self.reason = reason
+    self.headers = headers
+
+  def getheader(self, name, default=None):
+    return self.headers.get(name.lower(), default)
+
+  def will_close(self):
+    connection = self.getheader('connection', '').lower()
+    if self.version == 'HTTP/1.0':
+      return connection != 'keep-alive'
+    return connection == 'close'
+
+
+class Request(object):
+
+  def __init__(self, method, url, body, headers, future):
+    self.method = method
+    self.url = url
+    self.body = body
+    self.headers = headers or {}
+    self.future = future
+    parts = urlparse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    self.key = (parts.scheme, parts.hostname, port)
+    self.path = parts.path + ('?' + parts.query if parts.query else '')
+    self.retried = False
+
+  def encode(self):
+    host = self.key[1]
+    if self.key[2] not in (80, 443):
+      host = '%s:%d' % self.key[1:]
+    lines = ['%s %s HTTP/1.1' % (self.method, self.path or '/'), 'Host: ' + host,
+             'Accept-Encoding: identity']
+    body = self.body or ''
+    if body or self.method == 'POST':
+      lines.append('Content-Length: %d' % len(body))
+    lines += ['%s: %s' % item for item in self.headers.items()]
+    return '\r\n'.join(lines) + '\r\n\r\n' + body
+
+
+class HTTPChannel(asyncore.dispatcher):
+  """ One persistent connection, sending one request at a time. """
+
+  def __init__(self, client, key):
+    asyncore.dispatcher.__init__(self, map=client._map)
+    self.client = client
+    self.key = key
+    self.requests = 0
+    # whether any of the current request has been written
+    self.sent = False
+    self.last_used = time.time()
+    self.request = None
+    self.deadline = None
+    self.handshaking = False
+    self._reset()
+    self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+    self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.connect(key[1:])
+
+  def _reset(self):
+    self.out = ''
+    self.inbuf = ''
+    self.response = None
+    self.body = []
+    self.length = None
+    self.chunk_left = None
+
+  def start(self, request):
+    self._reset()
+    self.request = request
+    self.sent = False
+    self.out = request.encode()
+    self.deadline = time.time() + self.client.timeout
+
+  def handle_connect(self):
+    if self.key[0] == 'https':
+      # the context verifies the certificate and the host name, as
+      # httplib.HTTPSConnection does for the blocking clients
+      self.set_socket(self.client.ssl_context.wrap_socket(self.socket, server_hostname=self.key[1],
+                                                          do_handshake_on_connect=False),
+                      self.client._map)
+      self.handshaking = True
+      self._handshake()
+
+  def _handshake(self):
+    try:
+      self.socket.do_handshake()
+      self.handshaking = False
+    except ssl.SSLError, e:
+      if e.args[0] not in SSL_WANT:
+        raise
+
+  def readable(self):
+    return True
+
+  def writable(self):
+    return self.connecting or self.handshaking or bool(self.out)
+
+  def handle_write(self):
+    if self.handshaking:
+      return self._handshake()
+    try:
+      sent = self.send(self.out[:DEFAULT_RECV_SIZE])
+    except ssl.SSLError, e:
+      if e.args[0] in SSL_WANT:
+        return
+      raise
+    self.out = self.out[sent:]
+    self.sent = self.sent or sent > 0
+
+  def handle_read(self):
+    if self.handshaking:
+      return self._handshake()
+    while True:
+      try:
+        data = self.recv(DEFAULT_RECV_SIZE)
+      except ssl.SSLError, e:
+        if e.args[0] in SSL_WANT:
+          return
+        raise
+      if not data:
+        # recv has closed the connection
+        return
+      self._feed(data)
+      # ssl may hold decrypted data select() can't see
+      if not (self.key[0] == 'https' and self.connected and self.socket.pending()):
+        return
+
+  def _feed(self, data):
+    if self.request is None:
+      # nothing is expected on an idle connection
+      self.close()
+      return
+    self.inbuf += data
+    if self.response is None:
+      end = self.inbuf.find('\r\n\r\n')
+      if end < 0:
+        return
+      head, self.inbuf = self.inbuf[:end], self.inbuf[end + 4:]
+      lines = head.split('\r\n')
+      version, status, reason = (lines[0].split(' ', 2) + [''])[:3]
+      headers = {}
+      for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+      if status == '100':
+        return self._feed('')
+      self.response = AsyncResponse(version, int(status), reason, headers)
+      if 'content-length' in headers:
+        self.length = int(headers['content-length'])
+    if self._read_body():
+      self._finish(self.response.will_close())
+
+  def _read_body(self):
+    "move what has arrived of the body to self.body; True once complete"
+    if self.response.getheader('transfer-encoding', '').lower() == 'chunked':
+      return self._read_chunked()
+    self.body.append(self.inbuf)
+    self.inbuf = ''
+    if self.length is None:
+      # read until the server closes
+      return False
+    return sum(len(part) for part in self.body) >= self.length
+
+  def _read_chunked(self):
+    while True:
+      if self.chunk_left is None:
+        end = self.inbuf.find('\r\n')
+        if end < 0:
+          return False
+        self.chunk_left = int(self.inbuf[:end].split(';')[0], 16)
+        self.inbuf = self.inbuf[end + 2:]
+      if self.chunk_left == 0:
+        # the last chunk, then optional trailers and an empty line
+        if self.inbuf.startswith('\r\n'):
+          return True
+        return self.inbuf.find('\r\n\r\n') >= 0
+      if len(self.inbuf) < self.chunk_left + 2:
+        return False
+      self.body.append(self.inbuf[:self.chunk_left])
+      self.inbuf = self.inbuf[self.chunk_left + 2:]
+      self.chunk_left = None
+
+  def _finish(self, close):
+    request, response, body = self.request, self.response, ''.join(self.body)
+    self.request = None
+    self.deadline = None
+    self.requests += 1
+    self._reset()
+    if close:
+      self.close()
+    else:
+      self.client._release(self)
+
+    if response.status >= 400:
+      request.future.set_exception(urllib2.HTTPError(request.url, response.status,
+        response.reason, response.headers, StringIO(body)))
+    else:
+      request.future.set_result(body)
+
+  def fail(self, error, tb=None):
+    """ Close the connection, failing or retrying its request. """
+    request = self.request
+    self.request = None
+    self.close()
+    if request is None:
+      return
+    if self.requests and not self.inbuf and self.response is None and not request.retried and \
+        (not self.sent or request.method in IDEMPOTENT_METHODS):
+      # a reused connection the server had already closed. A request that
+      # went out may have been run though, so only those that can be run
+      # twice are resent, as ConnectionPool.urlopen does
+      request.retried = True
+      self.client._retry(request)
+    else:
+      request.future.set_exception(error, tb)
+
+  def handle_close(self):
+    if self.request is not None and self.response is not None and self.length is None \
+        and self.response.getheader('transfer-encoding', '').lower() != 'chunked':
+      self._finish(True)
+    else:
+      self.fail(socket.error(errno.ECONNRESET, 'connection closed'))
+
+  def handle_error(self):
+    error, tb = sys.exc_info()[1:]
+    self.fail(error, tb)
+
+  def close(self):
+    asyncore.dispatcher.close(self)
+    self.client._discard(self)
+
+
+class Waker(asyncore.file_dispatcher):
+  """ A pipe other threads write to, to wake the loop out of select(). """
+
+  def __init__(self, map):
+    read_fd, self.write_fd = os.pipe()
+    asyncore.file_dispatcher.__init__(self, read_fd, map=map)
+    os.close(read_fd)
+    flags = fcntl.fcntl(self.write_fd, fcntl.F_GETFL)
+    fcntl.fcntl(self.write_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+  def writable(self):
+    return False
+
+  def handle_read(self):
+    self.recv(DEFAULT_RECV_SIZE)
+
+  def wake(self):
+    try:
+      os.write(self.write_fd, 'x')
+    except OSError, e:
+      # the pipe is full, so the loop is awake anyway
+      if e.errno != errno.EAGAIN:
+        raise
+
+  def close(self):
+    asyncore.file_dispatcher.close(self)
+    os.close(self.write_fd)
+
+
+class AsyncFTClient(object):
+  """ Sends queries for a blocking FTClient from an event loop thread.
+
+  Requests are prepared (and signed) by `client`, so any FTClient works.
+  At most `max_connections` requests are in flight at once; the rest
+  wait their turn, and finished connections are kept open for reuse.
+
+  Args:
+    client: the ClientLoginFTClient or OAuthFTClient to prepare requests
+    max_connections: the most requests in flight at once
+    max_idle: seconds an unused connection is kept open
+    timeout: seconds before a request in flight is failed
+    ssl_context: the ssl.SSLContext for https connections, by default
+      one that verifies certificates against the system's CAs
+  """
+
+  def __init__(self, client, max_connections=DEFAULT_MAXSIZE,
+               max_idle=DEFAULT_MAX_IDLE, timeout=DEFAULT_TIMEOUT, ssl_context=None):
+    self.client = client
+    self.ssl_context = ssl_context or ssl.create_default_context()
+    self.max_connections = max_connections
+    self.max_idle = max_idle
+    self.timeout = timeout
+    self.connections = 0
+    self.reused = 0
+    self._map = {}
+    self._lock = threading.Lock()
+    self._submitted = deque()
+    self._delayed = []
+    self._ready = deque()
+    self._idle = {}
+    self._active = set()
+    self._seq = 0
+    self._closed = False
+    self._thread = None
+    self._waker = Waker(self._map)
+
+  def query(self, query, request_type=None, delay=0):
+    """ Send a query, `delay` seconds from now.
+
+    Like FTClient.query, a mutating query drops the cached reads it makes
+    stale when it is submitted and again once it has finished, and a
+    query rejected with a 401 by a client that logs in with a username is
+    sent once more after logging in again.
+
+    Returns:
+      a Future of the response body; it fails with urllib2.HTTPError on
+      an error status, as FTClient.query raises it
+    """
+    self.client.invalidate_cache(query)
+    mutating = self.client.read_cache is not None and not statements.is_read_only(query)
+    result = Future()
+
+    def send(delay, renewed):
+      token = getattr(self.client, 'auth_token', None)
+      future = self._submit(self.client.prepare_query(query, request_type), delay)
+      future.add_done_callback(lambda done: finish(done, token, renewed))
+
+    def finish(done, token, renewed):
+      error = done._error and done._error[1]
+      if not renewed and isinstance(error, urllib2.HTTPError) and error.code == 401 \
+          and getattr(self.client, 'username', None) is not None:
+        # the token expired or was revoked; log in off the loop thread
+        thread = threading.Thread(target=renew, args=(token,), name='AsyncFTClient login')
+        thread.daemon = True
+        thread.start()
+        return
+      if mutating:
+        # reads answered while this was in flight may have been cached
+        # from the table as it was before
+        self.client.invalidate_cache(query)
+      result._finish(done._result, done._error)
+
+    def renew(token):
+      try:
+        # unless another query has renewed it already
+        if self.client.auth_token == token:
+          self.client.authorize(renew=True)
+        send(0, True)
+      except Exception, e:
+        result.set_exception(e, sys.exc_info()[2])
+
+    send(delay, False)
+    return result
+
+  def _submit(self, request, delay):
+    method, url, body, headers = request
+    future = Future()
+    with self._lock:
+      if self._closed:
+        raise RuntimeError('the client is closed')
+      self._seq += 1
+      self._submitted.append((time.time() + delay, self._seq,
+                              Request(method, url, body, headers, future)))
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name='AsyncFTClient')
+        self._thread.daemon = True
+        self._thread.start()
+    self._waker.wake()
+    return future
+
+  def close(self):
+    """ Stop the loop, failing any queries not yet answered. """
+    with self._lock:
+      self._closed = True
+      thread = self._thread
+    self._waker.wake()
+    if thread is not None:
+      thread.join()
+    error = RuntimeError('the client was closed')
+    for channel in self._map.values():
+      if isinstance(channel, HTTPChannel):
+        channel.request, request = None, channel.request
+        channel.close()
+        if request is not None:
+          request.future.set_exception(error)
+    for request in list(self._ready) + [r for _, _, r in self._delayed + list(self._submitted)]:
+      request.future.set_exception(error)
+    self._waker.close()
+
+  def stats(self):
+    return {'connections': self.connections, 'reused': self.reused,
+            'active': len(self._active)}
+
+  def _run(self):
+    while not self._closed:
+      self._schedule()
+      self._expire()
+      timeout = POLL_INTERVAL
+      if self._delayed:
+        timeout = max(0, min(timeout, self._delayed[0][0] - time.time()))
+      asyncore.loop(timeout=timeout, map=self._map, count=1)
+
+  def _schedule(self):
+    with self._lock:
+      while self._submitted:
+        heapq.heappush(self._delayed, self._submitted.popleft())
+    now = time.time()
+    while self._delayed and self._delayed[0][0] <= now:
+      self._ready.append(heapq.heappop(self._delayed)[2])
+    while self._ready and len(self._active) < self.max_connections:
+      request = self._ready.popleft()
+      idle = self._idle.get(request.key)
+      if idle:
+        channel = idle.pop()
+        self.reused += 1
+      else:
+        channel = HTTPChannel(self, request.key)
+        self.connections += 1
+      self._active.add(channel)
+      channel.start(request)
+
+  def _expire(self):
+    now = time.time()
+    for channel in list(self._active):
+      if channel.deadline is not None and channel.deadline < now:
+        channel.request.retried = True
+        channel.fail(socket.timeout('timed out after %s seconds' % self.timeout))
+    for idle in self._idle.values():
+      for channel in [c for c in idle if c.last_used + self.max_idle < now]:
+        channel.close()
+
+  def _release(self, channel):
+    self._active.discard(channel)
+    channel.last_used = time.time()
+    idle = self._idle.setdefault(channel.key, [])
+    if len(idle) < self.max_connections:
+      idle.append(channel)
+    else:
+      channel.close()
+
+  def _discard(self, channel):
+    self._active.discard(channel)
+    idle = self._idle.get(channel.key, [])
+    if channel in idle:
+      idle.remove(channel)
+
+  def _retry(self, request):
+    self._ready.appendleft(request)
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+""" Token cache.
+
+Keeps ClientLogin tokens in a file shared by every process of the same
+user, so that short-lived processes reuse a token instead of logging in
+again each time they start.
+"""
+
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+# ClientLogin tokens are good for two weeks; renew them well before then
+DEFAULT_TOKEN_TTL = 86400
+
+
+class TokenCache(object):
+  """ Tokens by account, each expiring `ttl` seconds after it was stored.
+
+  Tokens are kept in memory and, if `path` is given, in that file, which
+  is only readable by its owner. The file is replaced atomically, so
+  processes sharing it never see a half written cache.
+
+  Args:
+    path: the cache file, or None to only keep tokens in memory
+    ttl: seconds a token is used for
+  """
+
+  def __init__(self, path=None, ttl=DEFAULT_TOKEN_TTL):
+    self.path = path and os.path.expanduser(path)
+    self.ttl = ttl
+    self._tokens = {}
+    self._lock = threading.Lock()
+
+  def _key(self, account):
+    # don't write account names to disk
+    return hashlib.sha1(account.encode('utf-8')).hexdigest()
+
+  def _load(self):
+    if self.path is None:
+      return self._tokens
+    try:
+      with open(self.path) as f:
+        return json.load(f)
+    except (IOError, ValueError):
+      return {}
+
+  def _save(self, tokens):
+    self._tokens = tokens
+    if self.path is None:
+      return
+    directory = os.path.dirname(self.path)
+    try:
+      os.makedirs(directory, 0700)
+    except OSError, e:
+      if e.errno != errno.EEXIST:
+        raise
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+      with os.fdopen(fd, 'w') as f:
+        json.dump(tokens, f)
+      os.rename(tmp_path, self.path)
+    except:
+      os.unlink(tmp_path)
+      raise
+
+  def get(self, account):
+    """ The unexpired token for `account`, or None. """
+    with self._lock:
+      entry = self._tokens.get(self._key(account))
+      if entry is None or entry['expires'] < time.time():
+        entry = self._load().get(self._key(account))
+      if entry is None or entry['expires'] < time.time():
+        return None
+      self._tokens[self._key(account)] = entry
+      return entry['token']
+
+  def set(self, account, token):
+    with self._lock:
+      tokens = self._load()
+      now = time.time()
+      # drop expired tokens while we're at it
+      tokens = dict((key, entry) for key, entry in tokens.items() if entry['expires'] >= now)
+      tokens[self._key(account)] = {'token': token, 'expires': now + self.ttl}
+      self._save(tokens)
+
+  def invalidate(self, account):
+    with self._lock:
+      tokens = self._load()
+      if tokens.pop(self._key(account), None) is not None:
+        self._save(tokens)
+      self._tokens.pop(self._key(account), None)
@@ -0,0 +1,281 @@
+#!/usr/bin/python
+
+""" Connection pooling.
+
+Keeps persistent HTTP/1.1 connections to the Fusion Tables API so that
+consecutive queries reuse an open socket instead of paying a fresh TCP
+and TLS handshake for every request.
+"""
+
+import httplib
+import select
+import socket
+import threading
+import time
+import urlparse
+from Queue import LifoQueue, Empty, Full
+
+
+DEFAULT_MAXSIZE = 4
+DEFAULT_MAX_IDLE = 60
+DEFAULT_TIMEOUT = 60
+DEFAULT_CHUNK_SIZE = 65536
+
+# errors raised sending a request over a socket the server closed while idle
+DEAD_CONNECTION_ERRORS = (httplib.CannotSendRequest, socket.error)
+
+# methods that can be resent when it isn't known whether the server got them
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD'])
+
+
+class PooledResponse(object):
+  """ An HTTP response that hands its connection back to the pool.
+
+  The connection is released as soon as the body has been read to the end,
+  so callers that simply call read() never have to think about the pool.
+  """
+
+  def __init__(self, pool, key, conn, response):
+    self._pool = pool
+    self._key = key
+    self._conn = conn
+    self._response = response
+    self.status = response.status
+    self.reason = response.reason
+    self.msg = response.msg
+
+  def getheader(self, name, default=None):
+    return self._response.getheader(name, default)
+
+  def getheaders(self):
+    return self._response.getheaders()
+
+  def read(self, amt=None):
+    data = self._response.read(amt)
+    if self._response.isclosed():
+      self.release()
+    return data
+
+  def iter_lines(self, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yield the body line by line, line endings included, reading it
+    from the socket `chunk_size` bytes at a time. """
+    pending = ''
+    try:
+      while True:
+        chunk = self.read(chunk_size)
+        if not chunk:
+          break
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+          yield line + '\n'
+      if pending:
+        yield pending
+    finally:
+      # a no-op once the body has been read to the end
+      self.close()
+
+  __iter__ = iter_lines
+
+  def release(self):
+    """ Return the underlying connection to the pool. """
+    if self._conn is not None:
+      conn, self._conn = self._conn, None
+      if self._response.will_close:
+        self._pool._discard(self._key, conn)
+      else:
+        self._pool._put(self._key, conn)
+
+  def close(self):
+    """ Abandon the response, dropping the connection if it is mid-body. """
+    if self._conn is not None:
+      conn, self._conn = self._conn, None
+      self._response.close()
+      self._pool._discard(self._key, conn)
+
+
+class ConnectionPool(object):
+  """ A keep-alive connection pool, keyed by (scheme, host, port).
+
+  Args:
+    maxsize: the number of connections kept per host. When `block` is
+      False, extra connections are opened under load and closed after use.
+    block: wait for a free connection rather than opening a new one once
+      `maxsize` connections to a host are in use.
+    max_idle: seconds a connection may sit unused in the pool before it is
+      assumed dead and replaced.
+    timeout: socket timeout in seconds for new connections.
+  """
+
+  connection_classes = {
+    'http': httplib.HTTPConnection,
+    'https': httplib.HTTPSConnection,
+  }
+
+  def __init__(self, maxsize=DEFAULT_MAXSIZE, block=False,
+               max_idle=DEFAULT_MAX_IDLE, timeout=DEFAULT_TIMEOUT):
+    self.maxsize = maxsize
+    self.block = block
+    self.max_idle = max_idle
+    self.timeout = timeout
+    self._pools = {}
+    self._slots = {}
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.recycled = 0
+
+  def stats(self):
+    """ Returns a dictionary of pool hit/miss counters. """
+    return {'hits': self.hits, 'misses': self.misses, 'recycled': self.recycled}
+
+  def _host_pool(self, key):
+    with self._lock:
+      if key not in self._pools:
+        self._pools[key] = LifoQueue(max(self.maxsize, 0) or 1)
+        self._slots[key] = threading.BoundedSemaphore(max(self.maxsize, 1))
+      return self._pools[key]
+
+  def _new_conn(self, key):
+    scheme, host, port = key
+    with self._lock:
+      self.misses += 1
+    conn = self.connection_classes[scheme](host, port, timeout=self.timeout)
+    conn.connect()
+    # httplib writes headers and body separately; don't let Nagle hold
+    # the body back waiting for an ack of the headers
+    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return conn
+
+  def _get(self, key):
+    """ Returns (connection, reused) for the given host key. """
+    pool = self._host_pool(key)
+    if self.block:
+      self._slots[key].acquire()
+    while True:
+      try:
+        conn, last_used = pool.get_nowait()
+      except Empty:
+        try:
+          return self._new_conn(key), False
+        except:
+          if self.block:
+            self._slots[key].release()
+          raise
+
+      if conn.sock is None or time.time() - last_used > self.max_idle or is_dropped(conn):
+        # the server has hung up, or will have on a socket left idle this long
+        conn.close()
+        with self._lock:
+          self.recycled += 1
+        continue
+
+      with self._lock:
+        self.hits += 1
+      return conn, True
+
+  def _put(self, key, conn):
+    try:
+      if self.maxsize > 0:
+        self._host_pool(key).put_nowait((conn, time.time()))
+      else:
+        conn.close()
+    except Full:
+      conn.close()
+    if self.block:
+      self._slots[key].release()
+
+  def _discard(self, key, conn):
+    conn.close()
+    if self.block:
+      self._slots[key].release()
+
+  def urlopen(self, method, url, body=None, headers=None):
+    """ Issue a request over a pooled connection.
+
+    Args:
+      method: the HTTP method
+      url: an absolute http or https url
+      body: the request body, if any
+      headers: a dictionary of request headers
+
+    Returns:
+      a PooledResponse
+    """
+    parsed = urlparse.urlparse(url)
+    key = (parsed.scheme, parsed.hostname, parsed.port)
+    selector = urlparse.urlunparse(('', '', parsed.path or '/', parsed.params,
+                                    parsed.query, ''))
+
+    conn, reused = self._get(key)
+    try:
+      sent = False
+      try:
+        conn.request(method, selector, body, headers or {})
+        sent = True
+        response = conn.getresponse()
+      except (httplib.BadStatusLine,) + DEAD_CONNECTION_ERRORS, e:
+        if not (reused and can_resend(method, sent, e)):
+          raise
+        # the server closed a pooled socket between requests; retry once
+        # on a fresh connection
+        conn.close()
+        with self._lock:
+          self.recycled += 1
+        conn = self._new_conn(key)
+        conn.request(method, selector, body, headers or {})
+        response = conn.getresponse()
+    except:
+      self._discard(key, conn)
+      raise
+
+    return PooledResponse(self, key, conn, response)
+
+  def clear(self):
+    """ Close every idle connection in the pool. """
+    with self._lock:
+      pools = self._pools.values()
+    for pool in pools:
+      while True:
+        try:
+          conn, last_used = pool.get_nowait()
+        except Empty:
+          break
+        conn.close()
+
+  def after_fork(self):
+    """ Forget every pooled connection without closing it, in a forked
+    child process whose sockets are still in use by its parent. """
+    self._lock = threading.Lock()
+    self._pools = {}
+    self._slots = {}
+
+
+def is_dropped(conn):
+  """ Whether an idle connection's socket has been closed by the server;
+  there is nothing else for an idle socket to be readable for. """
+  try:
+    return bool(select.select([conn.sock], [], [], 0)[0])
+  except (select.error, socket.error):
+    return True
+
+def can_resend(method, sent, error):
+  """ Whether a request that failed with `error` on a reused connection
+  certainly never reached the server, or can safely reach it twice.
+
+  A request that could not be sent is safe to send again. One that was
+  sent may have reached the server whenever the reply is missing - a
+  timeout, or a reset after the request went out - and resending e.g. an
+  INSERT batch could store its rows twice, so only idempotent requests
+  are resent, and only when the socket closed without a byte of reply.
+  """
+  if isinstance(error, socket.timeout):
+    return False
+  if not sent:
+    return True
+  return method in IDEMPOTENT_METHODS and isinstance(error, httplib.BadStatusLine) and \
+      (error.line.startswith('No status line received') or error.line == "''")
+
+
+# the pool shared by every FTClient unless one is passed explicitly
+default_pool = ConnectionPool()
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+""" Reads CSV files through a memory map.
+
+The file is read a block at a time, each block being copied out of the
+map once and split into lines in C. `values` parses the records of a
+block straight from those lines; `records` also works out the offset
+each record ends at, so a reader can be stopped and resumed anywhere.
+The file can be split into byte ranges that start and end on record
+boundaries, for workers to read in parallel.
+"""
+
+import os
+import csv
+import mmap
+from itertools import chain, izip
+
+# bytes to copy out of the map at once
+BLOCK_SIZE = 1 << 20
+
+
+class MappedCSV:
+  """ A CSV file with a header row, mapped into memory.
+
+  Args:
+    filename: the path of the file
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.file = open(filename, "rb")
+    self.size = os.fstat(self.file.fileno()).st_size
+    if self.size:
+      self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      # an empty file can't be mapped, but reads the same as an empty string
+      self.map = ''
+    self.data_start, quotes = self._scan(0, 0)
+    self.header = csv.reader([self.map[:self.data_start]]).next() if self.data_start else []
+
+  def close(self):
+    if self.size:
+      self.map.close()
+    self.file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def _scan(self, pos, quotes):
+    """ The offset after the first newline from `pos` that is outside of
+    quotes, given the number of quotes before `pos`, and the number of
+    quotes before that offset. """
+    m = self.map
+    while pos < self.size:
+      newline = m.find('\n', pos)
+      end = self.size if newline < 0 else newline + 1
+      quotes += m[pos:end].count('"')
+      pos = end
+      if quotes % 2 == 0:
+        break
+    return pos, quotes
+
+  def _align(self, pos, scanned, quotes):
+    """ The first record boundary at or after `pos`, and the number of
+    quotes before it, given the number of quotes before `scanned`, an
+    earlier record boundary. """
+    m = self.map
+    # a long record may have carried the last boundary past `pos`
+    pos = max(pos, scanned)
+    while scanned < pos:
+      block_end = min(scanned + BLOCK_SIZE, pos)
+      quotes += m[scanned:block_end].count('"')
+      scanned = block_end
+    if pos >= self.size or (quotes % 2 == 0 and m[pos - 1:pos] == '\n'):
+      return pos, quotes
+    return self._scan(pos, quotes)
+
+  def split(self, parts):
+    """ Split the records into at most `parts` byte ranges of about the
+    same size.
+
+    Returns:
+      a list of (start, end) offsets
+    """
+    length = self.size - self.data_start
+    bounds = [self.data_start]
+    quotes = 0
+    for i in xrange(1, parts):
+      bound, quotes = self._align(self.data_start + length * i / parts, bounds[-1], quotes)
+      if bound > bounds[-1]:
+        bounds.append(bound)
+    if self.size > bounds[-1]:
+      bounds.append(self.size)
+    return zip(bounds, bounds[1:])
+
+  def _blocks(self, start, end):
+    """ Yields (offset, block) for blocks of about BLOCK_SIZE bytes from
+    `start` up to `end`, each ending on a newline or at `end` """
+    if start is None: start = self.data_start
+    if end is None: end = self.size
+    m = self.map
+    pos = start
+    while pos < end:
+      newline = m.find('\n', min(pos + BLOCK_SIZE, end) - 1, end)
+      block_end = end if newline < 0 else newline + 1
+      yield pos, m[pos:block_end]
+      pos = block_end
+
+  def values(self, start=None, end=None):
+    """ Parse the records from `start`, the start of a record, up to `end`,
+    leaving all the line splitting and quote handling to C.
+
+    Returns:
+      an iterator of lists of values
+    """
+    return csv.reader(chain.from_iterable(block.splitlines(True)
+                                          for pos, block in self._blocks(start, end)))
+
+  def records(self, start=None, end=None):
+    """ Like values, but with the offset after each record, at some cost
+    in speed.
+
+    Returns:
+      a generator of (values, offset after the record) pairs
+    """
+    # the lines of a record with a quoted newline, and their quotes
+    pending = []
+    quotes = 0
+    offset = None
+    for pos, block in self._blocks(start, end):
+      block_end = pos + len(block)
+      lines = block.split('\n')
+      if lines[-1] == '':
+        lines.pop()
+
+      offset = pos
+      if not pending and '"' not in block:
+        # one line to a record
+        for line, values in izip(lines, csv.reader(lines)):
+          offset += len(line) + 1
+          yield values, min(offset, block_end)
+      else:
+        for line in lines:
+          offset += len(line) + 1
+          pending.append(line)
+          quotes += line.count('"')
+          if quotes % 2 == 0:
+            yield csv.reader(['\n'.join(pending)]).next(), min(offset, block_end)
+            pending = []
+            quotes = 0
+      offset = block_end
+
+    if pending:
+      # an unterminated quote runs to the end of the range
+      yield csv.reader(['\n'.join(pending)]).next(), offset
@@ -10,8 +10,42 @@ Imports CSV files into Fusion Tables.
 __author__ = 'kbrisbin@google.com (Kathryn Brisbin)'
 
 
-from sql.sqlbuilder import SQL
+import os
 import csv
+import time
+from itertools import chain, islice, izip, repeat
+from urllib2 import HTTPError
+
+from pyft.client.sql.sqlbuilder import SQL
+from pyft.client.sql.sqlbuilder import quote
+from pyft.client.sql.batchbuilder import BatchBuilder
+from pyft.client.sql.batchbuilder import MAX_BATCH_BYTES, MAX_BATCH_STATEMENTS
+from pyft.client.sql.batchbuilder import pack_in_lists
+from pyft.client.sql.batchbuilder import utf8_size
+from pyft import ratelimit
+from pyft.utils import imap_bounded
+from pyft.checkpoint import Checkpoint
+from pyft.client.fileimport import typeinference
+from pyft.client.fileimport.csvsource import MappedCSV
+
+# seconds to wait before the first retry of a failed batch, doubled for each
+# retry after that
+RETRY_DELAY = 0.5
+
+
+class FileImportError(Exception):
+  """ Raised when some batches of an import failed even after retrying.
+
+  `row_ids` holds the new row id of every row of the file, in order, None
+  for the rows of failed batches, and `failures` the (first record,
+  number of rows, error) of each failed batch, records counted from 0
+  after the header, or from the start of the byte range imported.
+  """
+
+  def __init__(self, message, row_ids, failures):
+    super(FileImportError, self).__init__(message)
+    self.row_ids = row_ids
+    self.failures = failures
 
 
 class Importer:
@@ -23,63 +57,296 @@ class Importer:
 
 
 class CSVImporter(Importer):
-  def __init__(self, ftclient):
+  """ Streams CSV files into Fusion Tables.
+
+  Rows are read, rendered and packed into batches of at most `max_bytes`
+  and `max_statements` as they are needed, and `concurrency` batches are
+  uploaded at a time. Only a few batches are read ahead of the uploads,
+  so memory use does not grow with the size of the file.
+
+  A batch the server rejects with a 4xx status is given up on straight
+  away. After any other error the server may have stored the batch all
+  the same - Fusion Tables has been known to report a 500 for inserts
+  that went through - so it is never simply resent. With `unique_keys`,
+  the table is probed for the batch's rows, as FusionTable does after a
+  500, and only the missing ones are sent again, up to `retries` times;
+  without, there is no telling which rows were stored, so the batch is
+  given up on and `retries` must be 0.
+
+  Args:
+    ftclient: the FTClient to send the queries with
+    concurrency: the number of batches to upload at once
+    max_bytes: the largest batch, in UTF-8 bytes
+    max_statements: the most rows in one batch
+    retries: how often to send the rows of a batch that may have failed,
+      which needs `unique_keys`; by default 2 with them and 0 without
+    rate_limiter: the TokenBucket every request takes a token from, by
+      default pyft.ratelimit.default_rate_limiter, which FusionTable
+      uses too, so concurrent imports keep to the account's rate along
+      with everything else
+    unique_keys: the columns whose values identify a row, to look the
+      rows of a batch up by after an error
+  """
+
+  def __init__(self, ftclient, concurrency=1, max_bytes=MAX_BATCH_BYTES,
+               max_statements=MAX_BATCH_STATEMENTS, retries=None, rate_limiter=None,
+               unique_keys=None):
+    if retries is None:
+      retries = 2 if unique_keys else 0
+    elif retries and not unique_keys:
+      raise ValueError('retries need unique_keys to tell which rows were stored')
     self.ftclient = ftclient
+    self.concurrency = concurrency
+    self.max_bytes = max_bytes
+    self.max_statements = max_statements
+    self.retries = retries
+    self._rate_limiter = rate_limiter
+    self.unique_keys = unique_keys
 
-  def importFile(self, filename, table_name=None, data_types=None):
-    """ Creates new table and imports data from CSV file """
-    filehandle = csv.reader(open(filename, "rb"))
-    cols = filehandle.next()
-    if data_types: columns_and_types = dict(zip(cols, data_types))
-    else: columns_and_types = dict([(c, "STRING") for c in cols])
+  @property
+  def rate_limiter(self):
+    return self._rate_limiter or ratelimit.default_rate_limiter
 
-    table = {}
-    table[table_name or filename] = columns_and_types
-    results = self.ftclient.query(SQL().createTable(table))
-    table_id = int(results.split()[1])
+  def importFile(self, filename, table_name=None, data_types=None,
+                 sample_rows=typeinference.SAMPLE_ROWS):
+    """ Creates new table and imports data from CSV file
 
-    self._importRows(filehandle, table_id, cols)
+    Without `data_types`, the column types are inferred from the first
+    `sample_rows` rows (see typeinference); 0 makes every column a
+    STRING. The values of NUMBER columns are sent without quotes.
+    """
+    with MappedCSV(filename) as source:
+      cols = source.header
+      rows = self._records(source)
+      if not data_types and sample_rows:
+        sample = list(islice(rows, sample_rows))
+        data_types = typeinference.infer_types([values for values, position in sample], len(cols))
+        rows = chain(sample, rows)
+      if data_types: columns_and_types = dict(zip(cols, data_types))
+      else: columns_and_types = dict([(c, "STRING") for c in cols])
+
+      table = {}
+      table[table_name or filename] = columns_and_types
+      results = self.ftclient.query(SQL().createTable(table))
+      table_id = int(results.split()[1])
+
+      self._importRows(rows, table_id, cols,
+                       typeinference.formatters([columns_and_types[c].upper() for c in cols]))
 
     return table_id
 
 
-  def importMoreRows(self, filename, table_id):
-    """ Imports more rows in a CSV file to an existing table. First row is a header """
-    filehandle = csv.reader(open(filename, "rb"))
-    return self._importRows(filehandle, table_id, filehandle.next())
+  def inferTypes(self, filename, sample_rows=typeinference.SAMPLE_ROWS, reservoir=False):
+    """ The column types importFile would infer for a CSV file, as a list
+    of (column, type) pairs. With `reservoir`, the sample is drawn from
+    the whole file instead of its first rows. """
+    with MappedCSV(filename) as source:
+      rows = source.values()
+      if reservoir:
+        sample = typeinference.reservoir_sample(rows, sample_rows)
+      else:
+        sample = islice(rows, sample_rows)
+      return zip(source.header, typeinference.infer_types(sample, len(source.header)))
+
+
+  def splitFile(self, filename, parts):
+    """ Split the rows of a CSV file into at most `parts` byte ranges, on
+    row boundaries, for workers to import in parallel with importMoreRows.
+    """
+    with MappedCSV(filename) as source:
+      return source.split(parts)
+
+
+  def importMoreRows(self, filename, table_id, checkpoint=None, byte_range=None):
+    """ Imports more rows in a CSV file to an existing table. First row is a header
+
+    With `byte_range`, a (start, end) pair from splitFile, only the rows
+    in that part of the file are imported.
+
+    With `checkpoint`, the path of a journal (see pyft.checkpoint.Checkpoint),
+    each batch is recorded once the server acknowledges it, and running
+    the same import again after an interruption carries on from the row
+    after the last recorded batch, skipping any recorded after that. The
+    import then stops sending batches at the first one that fails, so it
+    can be resumed from there, but still records the ones in flight.
+    """
+    with MappedCSV(filename) as source:
+      start, end = byte_range or (source.data_start, source.size)
+      if checkpoint is None:
+        return self._importRows(self._records(source, start, end), table_id, source.header)
+
+      job = 'import of %s into %s' % (os.path.abspath(filename), table_id)
+      if byte_range:
+        job += ', bytes %d-%d' % tuple(byte_range)
+      journal = Checkpoint(checkpoint, job)
+      first_line = 0
+      if journal.position is not None:
+        first_line, start = journal.position
 
+      rows = self._records(source, start, end, first_line, offsets=True)
+      batches = BatchBuilder(self.max_bytes, self.max_statements).pack(
+        self._statements(rows, table_id, source.header))
+      failures = []
 
-  def _importRows(self, filehandle, table_id, cols):
+      def numbered():
+        for number, batch in enumerate(batches, journal.batches):
+          if failures:
+            return
+          if number not in journal.ahead:
+            yield number, batch
+
+      def upload(numbered_batch):
+        number, batch = numbered_batch
+        if failures:
+          # left for a resumed import
+          return number, None
+        result = self._uploadBatch(batch, table_id, source.header)
+        if result[1] is not None:
+          failures.append(result[1])
+        return number, result
+
+      if self.concurrency > 1:
+        results = imap_bounded(upload, numbered(), self.concurrency)
+      else:
+        results = (upload(batch) for batch in numbered())
+      for number, result in results:
+        if result is not None and result[1] is None:
+          batch_row_ids, failure, position = result
+          journal.commit(batch_row_ids, position, number)
+      if failures:
+        failures.sort()
+        raise FileImportError('the batch from row %d failed' % failures[0][0],
+                              list(journal.row_ids), failures)
+      return list(journal.row_ids)
+
+
+  def iterImportRows(self, filename, table_id, byte_range=None):
+    """ Like importMoreRows, but yields the new row ids a batch at a time,
+    in file order, as the uploads finish. The rows of a batch that failed
+    come back as None. """
+    with MappedCSV(filename) as source:
+      start, end = byte_range or (source.data_start, source.size)
+      for row_ids, failure, position in self._uploadBatches(self._records(source, start, end),
+                                                            table_id, source.header):
+        yield row_ids
+
+
+  def _importRows(self, rows, table_id, cols, formatters=None):
     """ Helper function to upload rows of data in a CSV file to a table """
-    max_per_batch = 100
-    current_row = 0
-    queries = []
-    rows = []
-    for line in filehandle:
-      values = dict(zip(cols, line))
-      query = SQL().insert(table_id, values)
-      queries.append(query)
-      current_row += 1
-      if current_row == max_per_batch:
-        full_query = ';'.join(queries)
-        try:
-          rows += self.ftclient.query(full_query).split("\n")[1:-1]
-        except:
-          print "query failed" + full_query + "\n"
-          
-        current_row = 0
-        queries = []
-        
-    if len(queries) > 0:
-      full_query = ';'.join(queries)
+    row_ids = []
+    failures = []
+    for batch_row_ids, failure, position in self._uploadBatches(rows, table_id, cols, formatters):
+      row_ids += batch_row_ids
+      if failure is not None:
+        failures.append(failure)
+    if failures:
+      raise FileImportError('%d of the batches failed' % len(failures), row_ids, failures)
+    return row_ids
+
+
+  def _records(self, source, start=None, end=None, first_line=0, offsets=False):
+    """ Yields the values of every record of a MappedCSV, with the position
+    after it: the number of the next record and, with `offsets`, its byte
+    offset """
+    if offsets:
+      records = source.records(start, end)
+    else:
+      records = izip(source.values(start, end), repeat(None))
+    for line_no, (values, offset) in enumerate(records, first_line):
+      yield values, (line_no + 1, offset)
+
+
+  def _statements(self, rows, table_id, cols, formatters=None):
+    """ Yields an INSERT for every row, with the row """
+    prepared = SQL().prepare_insert(table_id, cols, formatters)
+    for row in rows:
+      values = row[0]
+      if len(values) == len(cols):
+        statement = prepared.render(values)
+      elif not values:
+        # a blank line
+        continue
+      else:
+        # a short or long line fills as many columns as it has values for
+        n = min(len(values), len(cols))
+        statement = SQL().prepare_insert(table_id, cols[:n], formatters and formatters[:n]) \
+                         .render(values[:n])
+      yield statement, row
+
+
+  def _uploadBatches(self, rows, table_id, cols, formatters=None):
+    """ Packs the rows into batches and uploads them, yielding the row ids,
+    failure or None, and position after the batch of each batch in order """
+    builder = BatchBuilder(self.max_bytes, self.max_statements)
+    batches = builder.pack(self._statements(rows, table_id, cols, formatters))
+    upload = lambda batch: self._uploadBatch(batch, table_id, cols)
+    if self.concurrency > 1:
+      return imap_bounded(upload, batches, self.concurrency)
+    return (upload(batch) for batch in batches)
+
+
+  def _uploadBatch(self, batch, table_id, cols):
+    """ Sends one batch, looking up which of its rows were stored after an
+    error that may not have stopped them, and sending the rest again """
+    row_ids = [None] * len(batch)
+    missing = range(len(batch))
+    error = None
+    for attempt in xrange(self.retries + 1):
+      if attempt:
+        time.sleep(RETRY_DELAY * 2 ** (attempt - 1))
       try:
-        rows += self.ftclient.query(full_query).split("\n")[1:-1]
-      except:
-        print "query failed" + full_query
+        if error is not None:
+          stored = self._storedRows([batch[i][1][0] for i in missing], table_id, cols)
+          for i, row_id in zip(list(missing), stored):
+            row_ids[i] = row_id
+          missing = [i for i, row_id in zip(missing, stored) if row_id is None]
+          if not missing:
+            error = None
+            break
+        self.rate_limiter.acquire()
+        result = self.ftclient.query(';'.join([batch[i][0] for i in missing]))
+      except HTTPError, e:
+        error = e
+        if e.code < 500:
+          # rejected, so sending it again would not help
+          break
+      except Exception, e:
+        error = e
+      else:
+        for i, row_id in zip(missing, result.strip().split("\n")[1:]):
+          row_ids[i] = row_id
+        error = None
+        break
 
-    return rows
+    position = batch[-1][1][1]
+    if error is None:
+      return row_ids, None, position
+    first_line = batch[0][1][1][0] - 1
+    return [None] * len(batch), (first_line, len(batch), error), position
 
-if __name__ == "__main__":
-  pass
 
+  def _storedRows(self, rows, table_id, cols):
+    """ The row id of each of `rows` (lists of values for `cols`) found in
+    the table by its `unique_keys`, or None. The table is probed with IN
+    queries on the first key, split to stay under the request size limit,
+    the whole key matched locally. """
+    key_indexes = [cols.index(key) for key in self.unique_keys]
+    def key(values):
+      return tuple(values[i] if i < len(values) else '' for i in key_indexes)
+
+    select_columns = self.unique_keys + ['rowid']
+    in_test = "'%s' IN (" % self.unique_keys[0]
+    query_size = utf8_size(SQL().select(table_id, select_columns, in_test + ')'))
+    in_values = set(quote(key(values)[0]) for values in rows)
+    found = {}
+    for probe in pack_in_lists(in_values, MAX_BATCH_BYTES - query_size):
+      self.rate_limiter.acquire()
+      results = csv.reader(self.ftclient.query(
+        SQL().select(table_id, select_columns, in_test + ','.join(probe) + ')')).strip().split('\n'))
+      next(results, None) # skips header row
+      for result in results:
+        found.setdefault(tuple(result[:-1]), result[-1])
+    return [found.get(key(values)) for values in rows]
 
+if __name__ == "__main__":
+  pass
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+""" Infers Fusion Tables column types from CSV values.
+
+A column is a NUMBER, DATETIME or LOCATION if every non-empty value
+sampled from it looks like one, and a STRING otherwise. Values are
+checked against cheap patterns for the formats Fusion Tables accepts,
+not parsed, and each column stops being checked as soon as it can only
+be a STRING.
+"""
+
+import re
+import random
+
+from pyft.client.sql.sqlbuilder import quote
+
+NUMBER = 'NUMBER'
+DATETIME = 'DATETIME'
+LOCATION = 'LOCATION'
+STRING = 'STRING'
+
+# the first rows of a file to infer its column types from
+SAMPLE_ROWS = 1000
+
+# a leading zero, as in a ZIP code, phone number or ID, would be lost
+# sending the value as a number, so 02134 is not one (but 0 and 0.5 are)
+NUMBER_RE = re.compile(r"^[-+]?(?:(?:0|[1-9]\d*)(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?$")
+TIME = r"(?:[ T]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:\s*[AaPp][Mm])?(?:Z|[-+]\d{2}:?\d{2})?)?"
+DATETIME_RE = re.compile(r"^(?:\d{4}-\d{1,2}-\d{1,2}|\d{4}/\d{1,2}/\d{1,2}|\d{1,2}/\d{1,2}/\d{2,4})%s$" % TIME)
+LAT_LNG_RE = re.compile(r"^\s*([-+]?\d{1,2}\.\d+)\s*[, ]\s*([-+]?\d{1,3}\.\d+)\s*$")
+KML_RE = re.compile(r"^\s*<(?:Point|LineString|Polygon|MultiGeometry)\b")
+
+
+def is_number(value):
+  return NUMBER_RE.match(value) is not None
+
+
+def is_datetime(value):
+  return DATETIME_RE.match(value) is not None
+
+
+def is_location(value):
+  """ A 'latitude, longitude' pair with decimal points, or a KML geometry """
+  m = LAT_LNG_RE.match(value)
+  if m is not None:
+    return abs(float(m.group(1))) <= 90 and abs(float(m.group(2))) <= 180
+  return KML_RE.match(value) is not None
+
+
+# the candidate types, most specific first
+CHECKS = ((NUMBER, is_number), (DATETIME, is_datetime), (LOCATION, is_location))
+
+
+class TypeInferencer:
+  """ Narrows down the type of each column as rows are added.
+
+  Args:
+    columns: the number of columns
+  """
+
+  def __init__(self, columns):
+    self.candidates = [list(CHECKS) for i in xrange(columns)]
+    self.seen = [False] * columns
+    self.rows = 0
+
+  def add(self, row):
+    """ Rule out the types a row's values do not fit. """
+    self.rows += 1
+    for i, value in enumerate(row[:len(self.candidates)]):
+      candidates = self.candidates[i]
+      if candidates and value:
+        value = value.strip()
+        if value:
+          self.seen[i] = True
+          candidates[:] = [(name, check) for name, check in candidates if check(value)]
+
+  def types(self):
+    """ The inferred type of each column; a column with no values is a STRING. """
+    types = []
+    for candidates, seen in zip(self.candidates, self.seen):
+      types.append(candidates[0][0] if candidates and seen else STRING)
+    return types
+
+
+def infer_types(rows, columns):
+  """ The types of `columns` columns for an iterable of rows. """
+  inferencer = TypeInferencer(columns)
+  for row in rows:
+    inferencer.add(row)
+  return inferencer.types()
+
+
+def reservoir_sample(rows, size, rng=random):
+  """ A uniform sample of `size` rows, read in a single pass that keeps
+  only the sample in memory. """
+  sample = []
+  for i, row in enumerate(rows):
+    if i < size:
+      sample.append(row)
+    else:
+      j = rng.randint(0, i)
+      if j < size:
+        sample[j] = row
+  return sample
+
+
+def format_number_text(value):
+  """ Write a value of a NUMBER column bare if it is a number, so that it
+  is sent without quotes, and quoted otherwise. """
+  value = value.strip()
+  if NUMBER_RE.match(value) is not None:
+    return value
+  return quote(value)
+
+
+def formatters(types):
+  """ The PreparedInsert formatters for CSV text in columns of `types`. """
+  if NUMBER not in types:
+    return None
+  return [format_number_text if t == NUMBER else quote for t in types]
@@ -10,81 +10,215 @@ Issue requests to Fusion Tables.
 __author__ = 'kbrisbin@google.com (Kathryn Brisbin)'
 
 import urllib2, urllib
-try:
-  import oauth2
-  import authorization.oauth
-except: pass
+import threading
+from StringIO import StringIO
+import connectionpool
+from authorization.clientlogin import ClientLogin
+from sql import statements
+
+# longer GET urls are sent as POSTs instead
+MAX_GET_URL_LENGTH = 2048
+# larger read results are not cached
+MAX_CACHED_RESULT_SIZE = 1048576
 
 
 class FTClient():
-  def _get(self, query): pass
-  def _post(self, query): pass
+  pool = None
+  # a pyft.cache.QueryCache for the results of read-only queries
+  read_cache = None
+
+  def _prepare(self, method, query):
+    """ Build the request for an urlencoded query.
+
+    Returns:
+      a (method, url, body, headers) tuple
+    """
+    pass
+
+  def _get(self, query, stream=False):
+    return self._request(*self._prepare("GET", query), stream=stream)
+
+  def _post(self, query, stream=False):
+    return self._request(*self._prepare("POST", query), stream=stream)
+
+  def _request(self, method, url, body=None, headers=None, stream=False):
+    """ Send a request over the shared connection pool.
+
+    Raises urllib2.HTTPError on an error status, as urllib2.urlopen did.
+
+    Returns:
+      the response body, or with `stream` the unread response, which can
+      be iterated over line by line
+    """
+    pool = self.pool or connectionpool.default_pool
+    resp = pool.urlopen(method, url, body=body, headers=headers)
+    if stream and resp.status < 400:
+      return resp
+    content = resp.read()
+    if resp.status >= 400:
+      raise urllib2.HTTPError(url, resp.status, resp.reason, resp.msg,
+                              StringIO(content))
+    return content
+
+  def prepare_query(self, query, request_type=None):
+    """ Build the request query() would send, without sending it.
+
+    Read-only queries go over GET, unless the url would be longer than
+    MAX_GET_URL_LENGTH, and everything else over POST. A `request_type`
+    of "GET" or "POST" overrides the choice.
 
-  def query(self, query, request_type=None):
-    """ Issue a query to the Fusion Tables API and return the result. """
+    Returns:
+      a (method, url, body, headers) tuple
+    """
 
     #encode to UTF-8
     try: query = query.encode("utf-8")
     except: query = query.decode('raw_unicode_escape').encode("utf-8")
 
-    lowercase_query = query.lower()
+    params = urllib.urlencode({'sql': query})
+    if request_type is None and statements.is_read_only(query):
+      request = self._prepare("GET", params)
+      if len(request[1]) <= MAX_GET_URL_LENGTH:
+        return request
     if request_type=="GET":
-      return self._get(urllib.urlencode({'sql': query}))
+      return self._prepare("GET", params)
     else:
-      return self._post(urllib.urlencode({'sql': query}))
+      return self._prepare("POST", params)
+
+  def invalidate_cache(self, query):
+    """ Drop the cached results a mutating query makes stale. """
+    if self.read_cache is None or statements.is_read_only(query):
+      return
+    self.read_cache.invalidate(statements.tables_written(query))
+
+  def query(self, query, request_type=None, stream=False):
+    """ Issue a query to the Fusion Tables API and return the result.
+
+    With `stream` the result is returned unread, as an iterable of lines,
+    so that large results never have to be held in memory at once.
+
+    With a `read_cache`, read-only queries are answered from it when they
+    can be, and mutating queries drop the results they make stale, both
+    before they are sent and once they have finished.
+    """
+    if self.read_cache is None:
+      return self._request(*self.prepare_query(query, request_type), stream=stream)
+    if not statements.is_read_only(query):
+      self.invalidate_cache(query)
+      try:
+        return self._request(*self.prepare_query(query, request_type), stream=stream)
+      finally:
+        # reads answered while this was in flight may have been cached
+        # from the table as it was before
+        self.invalidate_cache(query)
+
+    key = statements.normalize(query)
+    cached = self.read_cache.get(key)
+    if cached is not None:
+      return StringIO(cached) if stream else cached
+
+    generation = self.read_cache.generation()
+    tables = statements.tables_read(query)
+    result = self._request(*self.prepare_query(query, request_type), stream=stream)
+    if stream:
+      return self._cache_lines(result, key, tables, generation)
+    if len(result) <= MAX_CACHED_RESULT_SIZE:
+      self.read_cache.set(key, tables, result, generation)
+    return result
+
+  def _cache_lines(self, response, key, tables, generation):
+    """ Pass a streamed response through, caching it if it is read to
+    the end and is no larger than MAX_CACHED_RESULT_SIZE. """
+    lines = []
+    size = 0
+    for line in response:
+      if lines is not None:
+        size += len(line)
+        if size <= MAX_CACHED_RESULT_SIZE:
+          lines.append(line)
+        else:
+          lines = None
+      yield line
+    if lines is not None:
+      self.read_cache.set(key, tables, ''.join(lines), generation)
 
 
 class ClientLoginFTClient(FTClient):
+  """ A client authorized by a ClientLogin token.
 
-  def __init__(self, token):
+  Given a `username` and `password` instead of a `token`, the client logs
+  in when it sends its first query, reusing a token from `token_cache`
+  if there is one, and logs in again if the token is rejected.
+  """
+
+  def __init__(self, token=None, pool=None, username=None, password=None, token_cache=None):
     self.auth_token = token
+    self.username = username
+    self.password = password
+    self.token_cache = token_cache
     self.request_url = "https://www.google.com/fusiontables/api/query"
-
-  def _get(self, query):
-    headers = {
-      'Authorization': 'GoogleLogin auth=' + self.auth_token,
-    }
-    serv_req = urllib2.Request(url="%s?%s" % (self.request_url, query),
-                               headers=headers)
-    serv_resp = urllib2.urlopen(serv_req)
-    return serv_resp.read()
-
-  def _post(self, query):
+    self.pool = pool
+    self._auth_lock = threading.Lock()
+
+  def authorize(self, renew=False):
+    """ Set auth_token, from the token cache unless `renew`, otherwise by
+    logging in. """
+    with self._auth_lock:
+      token = None
+      if self.token_cache is not None:
+        if renew:
+          self.token_cache.invalidate(self.username)
+        else:
+          token = self.token_cache.get(self.username)
+      if token is None:
+        token = ClientLogin().authorize(self.username, self.password)
+        if self.token_cache is not None:
+          self.token_cache.set(self.username, token)
+      self.auth_token = token
+
+  def _prepare(self, method, query):
+    if self.auth_token is None:
+      self.authorize()
     headers = {
       'Authorization': 'GoogleLogin auth=' + self.auth_token,
-      'Content-Type': 'application/x-www-form-urlencoded',
     }
-
-    serv_req = urllib2.Request(url=self.request_url, data=query, headers=headers)
-    serv_resp = urllib2.urlopen(serv_req)
-    return serv_resp.read()
+    if method == "GET":
+      return method, "%s?%s" % (self.request_url, query), None, headers
+    headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    return method, self.request_url, query, headers
+
+  def query(self, query, request_type=None, stream=False):
+    try:
+      return FTClient.query(self, query, request_type, stream)
+    except urllib2.HTTPError, e:
+      if e.code != 401 or self.username is None:
+        raise
+    # the token expired or was revoked
+    self.authorize(renew=True)
+    return FTClient.query(self, query, request_type, stream)
 
 
 class OAuthFTClient(FTClient):
 
-  def __init__(self, consumer_key, consumer_secret, oauth_token, oauth_token_secret):
+  def __init__(self, consumer_key, consumer_secret, oauth_token, oauth_token_secret, pool=None):
+    # oauth2 pulls in httplib2, so only load it for OAuth clients
+    import oauth2
+    import oauthsigner
     self.consumer_key = consumer_key
     self.consumer_secret = consumer_secret
     self.token = oauth2.Token(oauth_token, oauth_token_secret)
-    
-    self.scope = "https://www.google.com/fusiontables/api/query"
+    self.signer = oauthsigner.OAuthSigner(oauth2.Consumer(consumer_key, consumer_secret), self.token)
+    self.pool = pool
 
+    self.scope = "https://www.google.com/fusiontables/api/query"
 
-  def _get(self, query):
-    consumer = oauth2.Consumer(self.consumer_key, self.consumer_secret)
-    client = oauth2.Client(consumer, self.token)
-    resp, content = client.request(uri="%s?%s" % (self.scope, query),
-                         method="GET")
-    return content
-
+  def _prepare(self, method, query):
+    # the OAuth parameters go in a header, so the query is sent as it is
+    headers = self.signer.header(self.signer.sign(method, self.scope, query))
+    if method == "GET":
+      return method, "%s?%s" % (self.scope, query), None, headers
+    headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    return method, self.scope, query, headers
 
-  def _post(self, query):
-    consumer = oauth2.Consumer(self.consumer_key, self.consumer_secret)
-    client = oauth2.Client(consumer, self.token)
-    resp, content = client.request(uri=self.scope,
-                                   method="POST",
-                                   body=query)
-    return content
 
 
-  
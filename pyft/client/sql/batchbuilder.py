@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+""" Packs SQL statements into batches.
+
+Fusion Tables accepts several statements joined with ';' in a single
+request, up to a limit on the request size and the number of statements.
+"""
+
+MAX_BATCH_BYTES = 1048576
+MAX_BATCH_STATEMENTS = 500
+# the most values looked up with one IN (...) list
+KEY_PROBE_SIZE = 500
+
+
+def utf8_size(statement):
+  """ The number of bytes a statement occupies once UTF-8 encoded, as
+  FTClient.query sends it. """
+  if isinstance(statement, unicode):
+    return len(statement.encode('utf-8'))
+  return len(statement)
+
+
+class BatchBuilder:
+  """ Incrementally packs statements into ';'-joined batches.
+
+  The running byte size and statement count of the open batch are kept
+  up to date as statements are added, so packing n statements is O(n).
+  Each statement may carry an item (e.g. the Row it was rendered from)
+  which is handed back alongside it in the finished batch.
+
+  Args:
+    max_bytes: the largest joined batch, in UTF-8 bytes
+    max_statements: the most statements in one batch
+  """
+
+  def __init__(self, max_bytes=MAX_BATCH_BYTES, max_statements=MAX_BATCH_STATEMENTS):
+    self.max_bytes = max_bytes
+    self.max_statements = max_statements
+    self.batch = []
+    self.size = 0
+
+  def add(self, statement, item=None):
+    """ Add a statement to the open batch.
+
+    Returns:
+      the finished batch, a list of (statement, item) pairs, if this
+      statement did not fit into it, otherwise None
+    """
+    statement_size = utf8_size(statement)
+    finished = None
+    if self.batch and (self.size + 1 + statement_size > self.max_bytes
+                       or len(self.batch) >= self.max_statements):
+      finished = self.flush()
+
+    if self.batch:
+      # the ';' separator
+      self.size += 1
+    self.size += statement_size
+    self.batch.append((statement, item))
+    return finished
+
+  def flush(self):
+    """ Close the open batch and return it, or None if it is empty. """
+    finished = self.batch or None
+    self.batch = []
+    self.size = 0
+    return finished
+
+  def pack(self, statements):
+    """ Pack an iterable of (statement, item) pairs.
+
+    Returns:
+      a generator of batches
+    """
+    for statement, item in statements:
+      finished = self.add(statement, item)
+      if finished:
+        yield finished
+    finished = self.flush()
+    if finished:
+      yield finished
+
+
+def pack_in_lists(values, max_bytes=MAX_BATCH_BYTES, max_values=KEY_PROBE_SIZE):
+  """ Split quoted values into lists of at most `max_values` that each
+  join with ',' into at most `max_bytes` UTF-8 bytes, for the IN lists of
+  lookups that have to stay under the request size limit.
+
+  Returns:
+    a generator of lists of values
+  """
+  builder = BatchBuilder(max_bytes, max_values)
+  for batch in builder.pack((value, None) for value in values):
+    yield [value for value, _ in batch]
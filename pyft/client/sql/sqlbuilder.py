@@ -11,10 +11,134 @@ __author__ = 'kbrisbin@google.com (Kathryn Brisbin)'
 
 
 import re
+import sys
+from itertools import izip
+
+from pyft.cache import TTLCache
+
+
+UNESCAPED_QUOTE = re.compile(r"(?<!\\)'")
+# the most PreparedInserts kept, for the most recently used column sets
+PREPARED_INSERT_CACHE_SIZE = 256
+
+
+def quote(value):
+  """ Quote a string value, escaping any unescaped single quotes. """
+  if "'" not in value:
+    return "'%s'" % value
+  return "'%s'" % UNESCAPED_QUOTE.sub("\\'", value)
+
+
+def format_int(value):
+  return '%d' % value
+
+
+def format_float(value):
+  return '%f' % value
+
+
+def format_other(value):
+  return quote("%s" % value)
+
+
+# how each python type is written into a statement; anything else is quoted
+FORMATTERS = {
+  int: format_int,
+  float: format_float,
+  str: quote,
+  unicode: quote,
+}
+
+
+def format_value(value):
+  """ Format a value for a statement: ints and floats bare, all else quoted. """
+  return FORMATTERS.get(type(value), format_other)(value)
+
+
+def format_column(values, formatter=None):
+  """ Format a whole column of values at once.
+
+  NumPy integer and float arrays are converted in bulk; anything else is
+  formatted value by value, with `formatter` if given or as format_value
+  would.
+
+  Returns:
+    a list of strings
+  """
+  if formatter is not None:
+    return map(formatter, values)
+  # anyone passing us an array has imported numpy already
+  numpy = sys.modules.get('numpy')
+  if numpy is not None and isinstance(values, numpy.ndarray):
+    if values.dtype.kind in 'iu':
+      return values.astype(str).tolist()
+    if values.dtype.kind == 'f':
+      return numpy.char.mod('%f', values).tolist()
+    values = values.tolist()
+  return [FORMATTERS.get(type(value), format_other)(value) for value in values]
+
+
+class PreparedInsert:
+  """ An INSERT statement for a fixed table and column list.
+
+  The column header is built once, so rendering a row is a single join
+  over its formatted values. Use SQL().prepare_insert to get one.
+
+  Args:
+    table_id: the id of the table
+    columns: the column names, in the order values will be given
+    formatters: an optional list of functions, one per column, that
+      format that column's values. By default the formatter is picked by
+      each value's type, as SQL.insert does.
+  """
+
+  def __init__(self, table_id, columns, formatters=None):
+    self.table_id = table_id
+    self.columns = list(columns)
+    self.formatters = formatters
+    self.prefix = 'INSERT INTO %s (%s) VALUES (' % (
+      table_id, ','.join(["'%s'" % col for col in self.columns]))
+
+  def render(self, values):
+    """ Build the INSERT for a sequence of values in column order. """
+    if len(values) != len(self.columns):
+      raise ValueError('The columns and values do not match!')
+    if self.formatters is None:
+      formatted = [FORMATTERS.get(type(value), format_other)(value) for value in values]
+    else:
+      formatted = [f(value) for f, value in zip(self.formatters, values)]
+    return '%s%s)' % (self.prefix, ','.join(formatted))
+
+  def render_dict(self, values):
+    """ Build the INSERT for a dictionary of column to value. """
+    return self.render([values[col] for col in self.columns])
+
+  def render_columns(self, columns):
+    """ Build the INSERTs for whole columns of values.
+
+    Args:
+      columns: a sequence of values for each column, in column order
+
+    Returns:
+      a generator of statements, one per row
+    """
+    if len(columns) != len(self.columns):
+      raise ValueError('The columns and values do not match!')
+    if len(set(len(values) for values in columns)) > 1:
+      raise ValueError('The columns are not all the same length!')
+
+    formatters = self.formatters or [None] * len(columns)
+    formatted = [format_column(values, f) for values, f in zip(columns, formatters)]
+    prefix = self.prefix
+    return ('%s%s)' % (prefix, ','.join(row)) for row in izip(*formatted))
+
 
 class SQL:
   """ Helper class for building SQL queries """
 
+  # PreparedInserts by (table_id, columns), shared by every SQL instance
+  prepared_inserts = TTLCache(maxsize=PREPARED_INSERT_CACHE_SIZE)
+
   def showTables(self):
     """ Build a SHOW TABLES sql statement.
 
@@ -59,7 +183,8 @@ class SQL:
     return "CREATE TABLE '%s' (%s)" % (table_name, cols_and_datatypes)
 
 
-  def select(self, table_id, cols=None, condition=None):
+  def select(self, table_id, cols=None, condition=None, order_by=None,
+             offset=None, limit=None):
     """ Build a SELECT sql statement.
 
     Args:
@@ -67,6 +192,9 @@ class SQL:
       cols: a list of columns to return. If None, return all
       condition: a statement to add to the WHERE clause. For example,
         "age > 30" or "Name = 'Steve'". Use single quotes as per the API.
+      order_by: a column to sort the results by
+      offset: the number of rows to skip
+      limit: the most rows to return
 
     Returns:
       the sql statement
@@ -78,6 +206,9 @@ class SQL:
 
     if condition: select = 'SELECT %s FROM %s WHERE %s' % (stringCols, table_id, condition)
     else: select = 'SELECT %s FROM %s' % (stringCols, table_id)
+    if order_by: select = '%s ORDER BY %s' % (select, order_by)
+    if offset: select = '%s OFFSET %d' % (select, offset)
+    if limit is not None: select = '%s LIMIT %d' % (select, limit)
     return select
 
 
@@ -96,32 +227,22 @@ class SQL:
     if len(cols) != len(values):
       raise ValueError('The columns and values do not match!')
 
-    updateStatement = ""
-    count = 1
-    for i in range(len(cols)):
-      updateStatement = "%s'%s' = " % (updateStatement, cols[i])
-      if type(values[i]).__name__ == 'int':
-        updateStatement = "%s%d" % (updateStatement, values[i])
-      elif type(values[i]).__name__ == 'float':
-        updateStatement = "%s%f" % (updateStatement, values[i])
-      else:
-        updateStatement = "%s'%s'" % (updateStatement, values[i])
-
-      if count < len(cols): updateStatement = "%s," % (updateStatement)
-      count += 1
+    updateStatement = ",".join(["'%s' = %s" % (col, format_value(value))
+                                for col, value in zip(cols, values)])
 
     return "UPDATE %s SET %s WHERE ROWID = '%d'" % (table_id, updateStatement, row_id)
 
-  def delete(self, table_id, row_id):
+  def delete(self, table_id, row_id=None):
     """ Build DELETE sql statement.
 
     Args:
       table_id: the id of the table
-      row_id: the id of the row to delete
+      row_id: the id of the row to delete. If None, delete every row
 
     Returns:
       the sql statement
     """
+    if row_id is None: return "DELETE FROM %s" % (table_id)
     return "DELETE FROM %s WHERE ROWID = '%d'" % (table_id, row_id)
 
 
@@ -141,21 +262,27 @@ class SQL:
     Returns:
       the sql statement
     """
-    stringValues = ""
-    count = 1
-    cols = values.keys()
-    values = values.values()
-    for value in values:
-      if type(value).__name__=='int':
-        stringValues = '%s%d' % (stringValues, value)
-      elif type(value).__name__=='float':
-        stringValues = '%s%f' % (stringValues, value)
-      else:
-        stringValues = "%s'%s'" % (stringValues, re.sub(r"(?<!\\)'", "\\'", value))
-      if count < len(values): stringValues = "%s," % (stringValues)
-      count += 1
-
-    return 'INSERT INTO %s (%s) VALUES (%s)' % (table_id, ','.join(["'%s'" % col for col in cols]), stringValues)
+    return self.prepare_insert(table_id, values.keys()).render(values.values())
+
+  def prepare_insert(self, table_id, columns, formatters=None):
+    """ Build a reusable INSERT sql statement for a fixed set of columns.
+
+    Args:
+      table_id: the id of the table
+      columns: the column names, in the order values will be given
+      formatters: optionally, a function per column to format its values
+
+    Returns:
+      a PreparedInsert, cached for later calls with the same table and
+      columns (the PREPARED_INSERT_CACHE_SIZE most recently used are kept)
+    """
+    key = (table_id, tuple(columns))
+    prepared = self.prepared_inserts.get(key)
+    if prepared is None or formatters is not None:
+      prepared = PreparedInsert(table_id, columns, formatters)
+      if formatters is None:
+        self.prepared_inserts.set(key, prepared)
+    return prepared
 
   def dropTable(self, table_id):
     """ Build DROP TABLE sql statement.
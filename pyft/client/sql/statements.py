@@ -0,0 +1,72 @@
+#!/usr/bin/python
+
+""" Classifies Fusion Tables SQL.
+
+Tells read-only queries (SELECT, SHOW, DESCRIBE) from mutating ones and
+finds the tables a query reads or writes, so that read results can be
+cached and dropped again when a table changes.
+
+Quoted strings are not parsed out: a value that happens to look like SQL
+can only make a query seem to touch more tables than it does, which at
+worst drops cached results early.
+"""
+
+import re
+
+READ_ONLY_STATEMENTS = ('select', 'show', 'describe')
+
+# a quoted string, whitespace, or anything else
+TOKEN = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|\s+|[^'"\s]+|['"]""", re.S)
+
+# SHOW TABLES, and CREATE/DROP TABLE, read or change the list of tables
+TABLES = 'tables'
+
+READ_TABLE = re.compile(r"\b(?:from|describe)\s+([\w-]+)", re.I)
+WRITTEN_TABLE = re.compile(r"\b(?:into|update|delete\s+from|drop\s+table)\s+([\w-]+)", re.I)
+STATEMENT_START = re.compile(r"(?:^|;)\s*(\w+)")
+
+
+def _tokens(query):
+  return TOKEN.findall(query.strip())
+
+
+def normalize(query):
+  """ The query with runs of whitespace outside of quotes collapsed, and
+  without a trailing ';', for use as a cache key. """
+  tokens = [' ' if token.isspace() else token for token in _tokens(query)]
+  return ''.join(tokens).strip().rstrip(';').strip()
+
+
+def verbs(query):
+  """ The lowercased first word of each statement in the query. """
+  return [verb.lower() for verb in STATEMENT_START.findall(query)]
+
+
+def is_read_only(query):
+  if not query.lstrip()[:8].lower().startswith(READ_ONLY_STATEMENTS):
+    return False
+  if ';' not in query:
+    return True
+  statement_verbs = verbs(query)
+  return bool(statement_verbs) and all(verb in READ_ONLY_STATEMENTS for verb in statement_verbs)
+
+
+def tables_read(query):
+  """ The set of table ids a read-only query reads. """
+  tables = set(READ_TABLE.findall(query))
+  if 'show' in verbs(query):
+    tables.add(TABLES)
+  return tables
+
+
+def tables_written(query):
+  """ The set of table ids a mutating query changes, or None if they
+  can't be told. """
+  statement_verbs = verbs(query)
+  tables = set(WRITTEN_TABLE.findall(query))
+  if 'create' in statement_verbs or 'drop' in statement_verbs:
+    tables.add(TABLES)
+  if not tables or any(verb not in ('insert', 'update', 'delete', 'create', 'drop')
+                       for verb in statement_verbs):
+    return None
+  return tables
@@ -1,6 +1,13 @@
+import sys
 import logging
+import datetime
+from array import array
+from dateutil import parser as date_parser
 logger = logging.getLogger(__name__)
 
+# how fusion tables returns the DATETIMEs we insert
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
 #class LocalStore(object):
 #  def schema(self):
 #    raise NotImplementedError()
@@ -15,6 +22,8 @@ logger = logging.getLogger(__name__)
 
 class Row(list):
 
+  __slots__ = ('row_id', 'unique_keys', 'field_lookup')
+
   def __init__(self, row_id=None, fields=[]):
     res = super(Row, self).__init__()
     self.row_id = row_id
@@ -33,49 +42,203 @@ class Row(list):
   def values(self):
     return [field.value for field in self]
 
-  def field_lookup(self, column_name):
-    pass
+  def prepared_values(self):
+    return [self.field_lookup[field.column_name] for field in self]
+
+class Column(object):
+  "a column of a RowSchema"
+
+  __slots__ = ('column_name', 'field_type', 'unique_key')
+
+  def __init__(self, column_name, field_type, unique_key=False):
+    self.column_name = column_name
+    self.field_type = field_type
+    self.unique_key = unique_key
+
+class RowSchema(object):
+  """
+  The columns shared by a set of CompactRows. `columns` is a list of
+  (column_name, field class) pairs, `unique_keys` the names of the
+  columns that identify a row. Build rows with `row()`.
+  """
+
+  __slots__ = ('columns', 'unique_keys', '_column_names')
+
+  def __init__(self, columns, unique_keys=()):
+    self.columns = [Column(name, field_type, name in unique_keys)
+                    for name, field_type in columns]
+    self.unique_keys = [column for column in self.columns if column.unique_key]
+    self._column_names = [column.column_name for column in self.columns]
+
+  def column_names(self):
+    return list(self._column_names)
+
+  def row(self, values, row_id=None):
+    return CompactRow(self, values, row_id)
+
+class CompactRow(object):
+  """
+  A row that holds its values in a tuple and shares its column layout
+  with every other row of its RowSchema, so it costs a small object and
+  a tuple rather than a list, a dict and a field object per value.
+  Accepted anywhere a Row is, by FusionTable.insert, update and upsert.
+  """
+
+  __slots__ = ('schema', 'row_id', '_values', '_prepared')
+
+  def __init__(self, schema, values, row_id=None):
+    if len(values) != len(schema.columns):
+      raise ValueError('The columns and values do not match!')
+    self.schema = schema
+    self.row_id = row_id
+    self._values = tuple(values)
+    self._prepared = None
+
+  def __len__(self):
+    return len(self._values)
+
+  @property
+  def unique_keys(self):
+    return self.schema.unique_keys
+
+  @property
+  def field_lookup(self):
+    return dict(zip(self.schema._column_names, self.prepared_values()))
+
+  def column_names(self):
+    return self.schema.column_names()
+
+  def values(self):
+    return list(self._values)
+
+  def prepared_values(self):
+    # computed on first use; the values can't change afterwards
+    if self._prepared is None:
+      self._prepared = tuple(column.field_type.format(value)
+                             for column, value in zip(self.schema.columns, self._values))
+    return self._prepared
 
 class BaseField(object):
 
+  __slots__ = ('value', 'ft_column_id', 'column_name', '_column_type', 'unique_key')
+
   def __init__(self, value=None, ft_column_id=None, column_name=None, column_type=None, unique_key=False):
 
     self.value = value
 
     self.ft_column_id = ft_column_id
     self.column_name = column_name
-    self.column_type = column_type
+    self._column_type = column_type
     self.unique_key = unique_key
 
+  # subclasses fix their type with a plain class attribute
+  column_type = property(lambda self: self._column_type)
+
+  @staticmethod
+  def format(value):
+    "the string sent to fusion tables for `value`"
+    return "{0}".format(value)
+
   def prepare_value(self):
-    return "{0}".format(self.value)
+    return self.format(self.value)
+
+  @staticmethod
+  def decode(value):
+    "the python value of a result cell, None if it can't be read"
+    return value
+
+  @classmethod
+  def decode_column(cls, values):
+    """
+    Decode a whole column of result cells at once. Subclasses try to
+    convert the column in one go and only fall back to decode(), cell
+    by cell, when that fails.
+    """
+    return [cls.decode(value) for value in values]
 
 class RowID(BaseField):
+  __slots__ = ()
   column_type = "RowID"
 
 class StringField(BaseField):
+  __slots__ = ()
   column_type = "STRING"
 
-  def prepare_value(self):
-    return "{0}".format(self.value)
-
 class NumberField(BaseField):
+  __slots__ = ()
   column_type = "NUMBER"
 
-  def prepare_value(self):
-    if type(self.value).__name__ == 'int':
-      return "{0:d}".format(self.value)
+  @staticmethod
+  def format(value):
+    if type(value).__name__ == 'int':
+      return "{0:d}".format(value)
     #XXX round off:
-    elif type(self.value).__name__ == 'float':
-      return "{0:f}".format(self.value)
-    elif type(self.value).__name__ == 'Decimal':
-      return "%s" % self.value
+    elif type(value).__name__ == 'float':
+      return "{0:f}".format(value)
+    elif type(value).__name__ == 'Decimal':
+      return "%s" % value
+
+  @staticmethod
+  def decode(value):
+    try:
+      return float(value)
+    except ValueError:
+      return float('nan')
+
+  @classmethod
+  def decode_column(cls, values):
+    "a float array (a NumPy array if NumPy is loaded), NaN for blank cells"
+    numpy = sys.modules.get('numpy')
+    try:
+      if numpy is not None:
+        return numpy.array(values, dtype=numpy.float64)
+      return array('d', map(float, values))
+    except ValueError:
+      decoded = [cls.decode(value) for value in values]
+      if numpy is not None:
+        return numpy.array(decoded, dtype=numpy.float64)
+      return array('d', decoded)
 
 class LocationField(StringField):
+  __slots__ = ()
   column_type = "LOCATION"
 
+  @staticmethod
+  def decode(value):
+    "a (lat, lng) pair, or None for an address or KML"
+    try:
+      lat, lng = map(float, value.replace(',', ' ').split())
+      return lat, lng
+    except ValueError:
+      return None
+
+  @classmethod
+  def decode_column(cls, values):
+    try:
+      return [(float(lat), float(lng)) for lat, lng in
+              (value.replace(',', ' ').split() for value in values)]
+    except ValueError:
+      return [cls.decode(value) for value in values]
+
 class DatetimeField(BaseField):
+  __slots__ = ()
   column_type = "DATETIME"
 
-  def prepare_value(self):
-    return "%s" % self.value
\ No newline at end of file
+  @staticmethod
+  def format(value):
+    return "%s" % value
+
+  @staticmethod
+  def decode(value):
+    try:
+      return date_parser.parse(value)
+    except (ValueError, OverflowError):
+      return None
+
+  @classmethod
+  def decode_column(cls, values):
+    strptime = datetime.datetime.strptime
+    try:
+      return [strptime(value, DATETIME_FORMAT) for value in values]
+    except ValueError:
+      return [cls.decode(value) for value in values]
@@ -1,17 +1,37 @@
+import sys
 import logging
-import datetime
 import csv
 import time
+import hashlib
+from itertools import chain, count, islice, izip
+from StringIO import StringIO
 from urllib2 import HTTPError
+from multiprocessing.pool import Pool, ThreadPool
 
 from pyft import current_app
 from pyft.client.sql.sqlbuilder import SQL
+from pyft.client.sql.sqlbuilder import quote
+from pyft.client.sql.batchbuilder import BatchBuilder
+from pyft.client.sql.batchbuilder import utf8_size
+from pyft.client.sql.batchbuilder import pack_in_lists
+from pyft.client.sql.batchbuilder import KEY_PROBE_SIZE
+from pyft.client.fileimport import typeinference
+from pyft.client.fileimport.csvsource import MappedCSV
+from pyft import ratelimit
+from pyft.ratelimit import QUERY_MAX_RATE
+from pyft.ratelimit import SharedTokenBucket
+from pyft.instrumentation import QueryStats
+from pyft.instrumentation import Truncated
+from pyft.utils import imap_bounded
+from pyft.client.connectionpool import default_pool
+from pyft.checkpoint import Checkpoint
 
 from pyft.fields import RowID
 from pyft.fields import StringField
 from pyft.fields import NumberField
 from pyft.fields import LocationField
 from pyft.fields import DatetimeField
+from pyft.fields import Row, CompactRow
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +44,38 @@ DEFAULT_TYPE_HANDLER = {
     }
 
 QUERY_SIZE_LIMIT = 1048576
-QUERY_MAX_RATE = datetime.timedelta(milliseconds=200)
+QUERY_BATCH_SIZE = 500
+SELECT_PAGE_SIZE = 1000
+# rows a worker process of FusionTable.execute_inserts_in_processes takes at a time
+PROCESS_CHUNK_SIZE = QUERY_BATCH_SIZE * 4
+
+class SelectCursor(object):
+  """
+  The position of a paged select, see FusionTable.iter_pages.
+
+  `keyset` pages on ROWID, recording the last rowid seen; otherwise pages
+  are fetched by OFFSET, recording the number of rows seen so far.
+  """
+
+  def __init__(self, page_size=SELECT_PAGE_SIZE, keyset=True):
+    self.page_size = page_size
+    self.keyset = keyset
+    self.last_rowid = None
+    self.offset = 0
+    self.headers = None
+    self.done = False
+
+class BatchError(Exception):
+  """
+  Raised when some of the statements of a bulk operation failed.
+  `results` holds the result for each row, None where it failed, and
+  `failures` the (row, error) pairs.
+  """
+
+  def __init__(self, message, results, failures):
+    super(BatchError, self).__init__(message)
+    self.results = results
+    self.failures = failures
 
 class FusionTable(object):
 
@@ -34,7 +85,12 @@ class FusionTable(object):
   _db_model = None
   _schema = None
   _django_schema = None
-  _last_query_time = None
+  # statement types the server turned out not to accept in batches
+  unbatchable = frozenset()
+  # shared by every table, since the request rate is enforced per account
+  rate_limiter = ratelimit.default_rate_limiter
+  # timing and size of every query sent, shared like the rate limiter
+  stats = QueryStats()
 
   def __init__(self, table_id, type_handler=DEFAULT_TYPE_HANDLER, name_handler={}):
     self.table_id = table_id
@@ -43,44 +99,43 @@ class FusionTable(object):
     self.column_handler_by_name = name_handler
 
   @property
-  def table_name(self):
-    # parse resp into rows(\n) and columns(,),
-    # discarding the first row which is header info
-    tbl_attrs = []
-    query_res = self.client.query("show tables")
-    for table_line in query_res.strip().split("\n")[1:]:
-      tbl_attrs.append(table_line.split(","))
-
-    # cast table ids as int
-    tbl_ids = [int(tbl_attr[0]) for tbl_attr in tbl_attrs]
-
-    this_tbl_idx = tbl_ids.index(self.table_id)
-    self.table_name = tbl_attrs[this_tbl_idx][1]
+  def metadata_cache(self):
+    return current_app.metadata_cache
 
-    return self.table_name
+  @property
+  def table_name(self):
+    return self.set_table_name()
 
   def set_table_name(self):
-    # parse resp into rows(\n) and columns(,),
-    # discarding the first row which is header info
-    tbl_attrs = []
-    query_res = self.client.query("show tables")
-    for table_line in query_res.strip().split("\n")[1:]:
-      tbl_attrs.append(table_line.split(","))
-
+    table_names = self.metadata_cache.get_or_set(('tables',), self.fetch_table_names)
+    if int(self.table_id) not in table_names:
+      # the table may have been created since the names were cached
+      self.metadata_cache.invalidate(('tables',))
+      table_names = self.metadata_cache.get_or_set(('tables',), self.fetch_table_names)
+    if int(self.table_id) not in table_names:
+      raise ValueError('table {0} not found'.format(self.table_id))
+    return table_names[int(self.table_id)]
+
+  def fetch_table_names(self):
+    "returns a dictionary of table id to table name for every table"
+
+    rows = csv.reader(self.client.query(SQL().showTables(), stream=True))
+    next(rows, None) # skips header row
     # cast table ids as int
-    tbl_ids = [int(tbl_attr[0]) for tbl_attr in tbl_attrs]
-
-    this_tbl_idx = tbl_ids.index(self.table_id)
-    self.table_name = tbl_attrs[this_tbl_idx][1]
+    return dict((int(tbl_attr[0]), tbl_attr[1]) for tbl_attr in rows)
 
-    return self.table_name
+  @property
+  def schema(self):
+    "the schema list from fetch_schema, cached for PYFT_METADATA_TTL seconds"
+    return self.metadata_cache.get_or_set(('schema', str(self.table_id)), self.fetch_schema)
 
   def fetch_schema(self):
     "returns a list that represents the fusion table schema"
 
-    description = self.client.query(SQL().describeTable(self.table_id))
+    rows = csv.reader(self.client.query(SQL().describeTable(self.table_id), stream=True))
+    next(rows, None) # skips header row
     self._schema = [('rowid','rowid','rowid')]
-    self._schema += [tuple(row.split(",")) for row in description.split("\n")][1:-1] #skips header row
+    self._schema += [tuple(row) for row in rows]
 
     return self._schema
 
@@ -88,9 +143,8 @@ class FusionTable(object):
   def base_schema(self):
     "Get a python compatible schema list from fusion table"
 
-    description = self.client.query(SQL().describeTable(self.table_id))
     schema = {}
-    for col_id, col_name, col_type in self.fetch_schema():
+    for col_id, col_name, col_type in self.schema:
 
       if col_type == 'rowid':
         field = RowID
@@ -111,25 +165,38 @@ class FusionTable(object):
     return schema
 
   @classmethod
-  def run_query(self, query):
-
-    if self._last_query_time:
-      if datetime.datetime.now() - QUERY_MAX_RATE < self._last_query_time:
-        td = QUERY_MAX_RATE - (datetime.datetime.now() - self._last_query_time)
-        seconds_to_sleep = (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10**6.0
-        logger.debug('sleeping : {0}'.format(seconds_to_sleep,td, ) )
-        time.sleep(seconds_to_sleep)
+  def run_query(cls, query, stream=False):
 
-    self._last_query_time = datetime.datetime.now()
+    cls.rate_limiter.acquire()
 
-    logger.debug('execute query: %s' % query)
     if not query:
       return None
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+      logger.debug('execute query: %s', Truncated(query))
 
-    res =  current_app.client.query(query)
-    logger.debug('result: %s' % res)
+    res = cls.stats.timed(query, lambda: current_app.client.query(query, stream=stream))
+    if debug and not stream:
+      logger.debug('result: %s', Truncated(res))
     return res
 
+  @classmethod
+  def run_query_async(cls, query):
+    """
+    Like run_query, but returns a Future of the result straight away. The
+    rate limit is kept by delaying the request instead of sleeping.
+    """
+    delay = cls.rate_limiter.reserve()
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug('execute query async: %s', Truncated(query))
+    future = current_app.get_async_client().query(query, delay=delay)
+    start = time.time() + delay
+    def record(done):
+      error = done.exception()
+      cls.stats.record(query, None if error else done.result(), time.time() - start, error)
+    future.add_done_callback(record)
+    return future
+
   @classmethod
   def create(cls, schema, table_name, type_handler=DEFAULT_TYPE_HANDLER, name_handler={}):
     """
@@ -148,6 +215,7 @@ class FusionTable(object):
         { table_name: schema }
       ))
     table_id = resp.split('\n')[1]
+    current_app.metadata_cache.invalidate(('tables',))
 
     return cls(table_id)
 
@@ -155,6 +223,8 @@ class FusionTable(object):
     " Delete this remote fusion table "
     drop_sql = SQL().dropTable(self.table_id)
     resp = self.run_query(drop_sql)
+    self.metadata_cache.invalidate(('tables',))
+    self.metadata_cache.invalidate(('schema', str(self.table_id)))
     return resp
 
   def pull(self):
@@ -178,36 +248,68 @@ class FusionTable(object):
     # assume all the rows are the same
     return rows[0].unique_keys
 
-  def determine_which_rows_are_not_inserted(self, rows):
+  def row_key(self, row, key_columns):
+    "the tuple of a row's prepared values for `key_columns`"
+    return tuple(row.field_lookup[column_name] for column_name in key_columns)
+
+  def determine_which_rows_are_not_inserted(self, rows, concurrency=1):
     """
     Return the list of rows not present in the fusion table
-    and the rowid's of those rows present
+    and the rowid's of those rows present, as a dictionary keyed by
+    the tuple of each row's unique key values (see `row_key`)
+
+    The table is probed with IN queries on the first unique key, split
+    to stay under QUERY_SIZE_LIMIT and run `concurrency` at a time; the
+    whole composite key is then matched locally.
     """
 
     unique_keys = self.get_unique_keys(rows)
+    if not unique_keys:
+      raise ValueError('Rows must have a `unique_key` field to be matched')
+    key_columns = [x.column_name for x in unique_keys]
     # Use the first unique key
-    key_column_name = unique_keys[0].column_name
-    in_clause = {key_column_name:[row.field_lookup[key_column_name].prepare_value() for row in rows]}
-    logger.debug('determine_rows_inserted: using column_key {0}'.format(unique_keys[0]))
-
-    headers, results = self.select([x.column_name for x in unique_keys] + ['rowid'], in_clause)
-
-    logger.debug('seeing these columns {0} and results {1}'.format(headers, results))
-
-    result_index = headers.index(key_column_name)
-    key_results = [result[result_index] for result in results]
-
-    rows_not_present = []
-    for row in rows:
-      if row.field_lookup[key_column_name].prepare_value() not in key_results:
-        rows_not_present.append(row)
-    return rows_not_present
-
-
-  def insert(self, rows=[]):
+    key_column_name = key_columns[0]
+    select_columns = key_columns + ['rowid']
+    logger.debug('determine_rows_inserted: using column_key %s', unique_keys[0])
+
+    probe_values = set(quote(row.field_lookup[key_column_name]) for row in rows)
+    query_size = utf8_size(self.select_query(select_columns, {key_column_name: []}))
+    probes = pack_in_lists(probe_values, QUERY_SIZE_LIMIT - query_size, KEY_PROBE_SIZE)
+
+    def probe(in_values):
+      in_clause = {key_column_name: in_values}
+      headers, results = self.select(select_columns, in_clause)
+      key_indexes = [headers.index(column_name) for column_name in key_columns]
+      rowid_index = headers.index('rowid')
+      return [(tuple(result[i] for i in key_indexes), result[rowid_index])
+              for result in results]
+
+    if concurrency > 1:
+      found = imap_bounded(probe, probes, concurrency)
+    else:
+      found = (probe(in_values) for in_values in probes)
+
+    row_ids = {}
+    for results in found:
+      for key, row_id in results:
+        row_ids.setdefault(key, row_id)
+
+    rows_not_present = [row for row in rows
+                        if self.row_key(row, key_columns) not in row_ids]
+    return rows_not_present, row_ids
+
+  def insert(self, rows=[], concurrency=1, checkpoint=None, processes=1):
     """
       Push data locally back to google-hosted fusion table
       `rows` is a list of Row objects that have the same column structure
+      `concurrency` is the number of batches kept in flight at once; the
+      returned row ids are always in the same order as `rows`
+      `checkpoint` is the path of a journal (see pyft.checkpoint) that
+      records every batch the server acknowledged; inserting the same
+      rows again after an interruption only sends the rows after the
+      last recorded batch
+      `processes`, if more than one, is the number of worker processes
+      rendering and sending the batches, see execute_inserts_in_processes
       schema: a dictionary representing the rows to be inserted. example:
         {
         "col_name1":"STRING",
@@ -217,112 +319,617 @@ class FusionTable(object):
         }
     """
 
-    def execute_query_list(ql, handle_500_exception=True):
-      new_row_ids = []
-      logger.debug('running query list insert of {0} queries'.format(len(ql)))
-      query_list, row_list = zip(*ql)
+    logger.debug('starting bulk insert of %d rows', len(rows))
+    journal = None
+    if checkpoint is not None:
+      rows = list(rows)
+      journal = Checkpoint(checkpoint, self.insert_job(rows))
+      if journal.position:
+        logger.debug('resuming insert after %d rows', journal.position)
+
+    if processes > 1:
+      return self.execute_inserts_in_processes(rows, processes, concurrency, journal)
+    done = journal and journal.position or 0
+    return self.execute_inserts(self.insert_batches(islice(rows, done, None)), concurrency, journal)
+
+  def insert_job(self, rows):
+    """
+    Name an insert of `rows` for its Checkpoint: the table, the number of
+    rows and a hash of the first and last rows' INSERTs, so a journal is
+    not resumed with rows other than the ones it was written for
+    """
+    digest = hashlib.sha1()
+    for row in rows[:1] + rows[1:][-1:]:
+      statement = SQL().prepare_insert(self.table_id, row.column_names()).render(row.prepared_values())
+      if isinstance(statement, unicode):
+        statement = statement.encode('utf-8')
+      digest.update(statement + '\n')
+    return 'insert of {0} rows into {1}, {2}'.format(len(rows), self.table_id, digest.hexdigest())
+
+  def execute_inserts(self, batches, concurrency=1, checkpoint=None):
+    """
+    Send batches of (query, row) INSERT pairs, `concurrency` at a time,
+    and return the new row ids in order. With a Checkpoint, `batches`
+    start at its position; each batch is committed to it by number as it
+    is acknowledged, the position being the number of rows inserted, and
+    the batches it already holds are not sent again. Once a batch fails
+    no more are sent, but the ones in flight are waited for and committed
+    before its error is raised, so resuming does not send them twice.
+    """
+    row_ids = []
+    first = 0
+    acknowledged = {}
+    if checkpoint is not None:
+      row_ids += checkpoint.row_ids
+      first = checkpoint.batches
+      for number, (position, new_row_ids) in checkpoint.ahead.items():
+        acknowledged[number] = new_row_ids
+    errors = []
+
+    def numbered():
+      position = len(row_ids)
+      for number, ql in enumerate(batches, first):
+        if errors:
+          return
+        position += len(ql)
+        if number not in acknowledged:
+          yield number, position, ql
+
+    def send(batch):
+      number, position, ql = batch
+      if errors:
+        # left for a resumed insert
+        return number, position, None
       try:
-        result = self.run_query(";".join(query_list))
-      except HTTPError, e:
-        logger.debug('Insert Error State!', e)
-        if e.code == 500 and handle_500_exception:
-          # XXX Fusion Table throws 500 for successful inserts
-          logger.debug('500 Insert Error')
-          # did google fusion tables barf?
-          # check if our rows are present
-          reinsert_these_rows = self.determine_which_rows_are_not_inserted()
-          insert_queries = [SQL().insert(self.table_id, row.field_lookup) for row in reinsert_these_rows]
-          execute_query_list(insert_queries, handle_500_exception=False)
-          headers, result_rows = self.client.query("select ")
-
-
-      rows = result.strip().split('\n')
-      # skip the header
-      for row in csv.reader(rows[1:]):
-        new_row_ids += row
-      return new_row_ids
-
-    query_list = []
-    # assume all the rows are the same
-    unique_keys = self.get_unique_keys(rows)
+        return number, position, self.execute_insert_batch(ql)
+      except Exception:
+        errors.append(sys.exc_info())
+        return number, position, None
+
+    if concurrency > 1:
+      results = imap_bounded(send, numbered(), concurrency)
+    else:
+      results = (send(batch) for batch in numbered())
+
+    for number, position, new_row_ids in results:
+      if new_row_ids is not None:
+        acknowledged[number] = new_row_ids
+        if checkpoint is not None:
+          checkpoint.commit(new_row_ids, position, number)
+    if errors:
+      raise errors[0][0], errors[0][1], errors[0][2]
+
+    for number in sorted(acknowledged):
+      row_ids += acknowledged[number]
+    return row_ids
+
+  def execute_inserts_in_processes(self, rows, processes, concurrency=1, checkpoint=None):
+    """
+    Insert `rows` from `processes` forked worker processes, so rendering
+    the statements is not held to one core. Each worker takes a range of
+    PROCESS_CHUNK_SIZE rows at a time, and renders and sends its batches
+    with `concurrency` in flight. The rows are inherited by the workers
+    when they fork, so only the row ids are passed back. The first such
+    insert replaces the class's rate limiter, and the default one if it
+    is that, with a SharedTokenBucket at the same rate, which the workers
+    inherit, so that they and this process keep to the one rate limit.
+    Ranges are merged in order, so the row ids are in the order of `rows`.
+    With a Checkpoint, each range is committed as it is merged.
+    """
+    rows = list(rows)
     row_ids = []
-    logger.debug('starting bulk insert of {0} queries'.format(len(query_list)))
+    done = 0
+    if checkpoint is not None:
+      row_ids += checkpoint.row_ids
+      done = checkpoint.position or 0
+    ranges = [(start, min(start + PROCESS_CHUNK_SIZE, len(rows)))
+              for start in xrange(done, len(rows), PROCESS_CHUNK_SIZE)]
+
+    self.share_rate_limiter()
+    pool = Pool(processes, _init_insert_worker, (self, rows, concurrency))
+    try:
+      for new_row_ids in pool.imap(_insert_range, ranges):
+        row_ids += new_row_ids
+        if checkpoint is not None:
+          checkpoint.commit(new_row_ids, len(row_ids))
+    finally:
+      pool.terminate()
+      pool.join()
+    return row_ids
 
-    for row in rows:
-      query = SQL().insert(self.table_id, row.field_lookup)
-
-      if len(";".join([t[0] for t in query_list] + [query])) > QUERY_SIZE_LIMIT \
-          or len(query_list) >= 500:
-        # execute the queued up queries
-        row_ids += execute_query_list(query_list)
-        logger.debug('Hit critical limit, size:{0},len:{1}'.format(len(";".join([t[0] for t in query_list] + [query])),
-          len(query_list)))
-        query_list = [(query,row)]
-      else:
-        query_list.append((query,row))
+  @classmethod
+  def share_rate_limiter(cls):
+    "make the rate limiter a SharedTokenBucket, for processes forked after"
+    rate_limiter = cls.rate_limiter
+    if isinstance(rate_limiter, SharedTokenBucket):
+      return
+    shared = SharedTokenBucket(rate_limiter.rate, rate_limiter.capacity)
+    if rate_limiter is ratelimit.default_rate_limiter:
+      ratelimit.default_rate_limiter = shared
+    cls.rate_limiter = shared
+
+  def execute_insert_batch(self, ql, handle_500_exception=True):
+    new_row_ids = []
+    logger.debug('running query list insert of %d queries', len(ql))
+    query_list, row_list = zip(*ql)
+    try:
+      result = self.run_query(";".join(query_list))
+    except HTTPError, e:
+      logger.debug('Insert Error State! %s', e)
+      if e.code == 500 and handle_500_exception and \
+          isinstance(row_list[0], (Row, CompactRow)) and self.get_unique_keys(row_list):
+        # XXX Fusion Table throws 500 for successful inserts
+        logger.debug('500 Insert Error')
+        # did google fusion tables barf?
+        # check if our rows are present
+        reinsert_these_rows, present_row_ids = self.determine_which_rows_are_not_inserted(row_list)
+        insert_queries = [(SQL().insert(self.table_id, row.field_lookup), row) for row in reinsert_these_rows]
+        reinserted_row_ids = iter(self.execute_insert_batch(insert_queries, handle_500_exception=False) if insert_queries else [])
+        key_columns = [x.column_name for x in self.get_unique_keys(row_list)]
+        for row in row_list:
+          key = self.row_key(row, key_columns)
+          new_row_ids.append(present_row_ids[key] if key in present_row_ids else next(reinserted_row_ids))
+        return new_row_ids
+      raise
+
+
+    rows = result.strip().split('\n')
+    # skip the header
+    for row in csv.reader(rows[1:]):
+      new_row_ids += row
+    return new_row_ids
 
-    # clean up any remaining queries
-    if query_list:
-      row_ids += execute_query_list(query_list)
+  def insert_async(self, rows=[], concurrency=None):
+    """
+    Like insert, but returns a Future of the new row ids. Batches are
+    built as earlier ones finish, `concurrency` (by default the async
+    client's max_connections) at a time, so memory use does not grow with
+    the number of rows. A failed batch fails the insert; there is no 500
+    recovery.
+    """
+    # the async client needs fcntl and os.pipe, so isn't imported until used
+    from pyft.client.asyncclient import gather_bounded
+    def submit(ql):
+      return self.run_query_async(";".join([query for query, row in ql])).then(self.result_column)
+    concurrency = concurrency or current_app.get_async_client().max_connections
+    future = gather_bounded(submit, self.insert_batches(rows), concurrency)
+    return future.then(lambda results: list(chain.from_iterable(results)))
+
+  def insert_columns(self, columns, concurrency=1):
+    """
+    Insert rows given column by column, as a dictionary of column name to
+    a sequence of values (e.g. a NumPy array), without building a Row or
+    field per value. Each column is formatted in one pass, NumPy number
+    arrays in bulk, and the statements are batched like insert's.
 
-    return row_ids
+    Returns the new row ids in order.
+    """
+    names = columns.keys()
+    prepared = SQL().prepare_insert(self.table_id, names)
+    statements = prepared.render_columns([columns[name] for name in names])
+
+    builder = BatchBuilder(QUERY_SIZE_LIMIT, QUERY_BATCH_SIZE)
+    batches = builder.pack(izip(statements, count()))
+    return self.execute_inserts(batches, concurrency)
+
+  def insert_csv(self, filename, concurrency=1, byte_range=None):
+    """
+    Insert the rows of a CSV file whose header names columns of the table,
+    read through a memory map (see MappedCSV) without building a Row per
+    line. Values of number columns are sent without quotes. A record
+    with fewer or more values than the header fills the columns it has
+    values for, and a blank line is skipped. With `byte_range`, a (start,
+    end) pair from MappedCSV.split, only the rows in that part of the
+    file are inserted, so workers can share a file.
+
+    Returns the new row ids in order.
+    """
+    types = dict((col_name, col_type) for col_id, col_name, col_type in self.schema)
+    with MappedCSV(filename) as source:
+      start, end = byte_range or (source.data_start, source.size)
+      header = source.header
+      formatters = typeinference.formatters([types.get(col, 'string').upper() for col in header])
+      prepared = SQL().prepare_insert(self.table_id, header, formatters)
+
+      def render():
+        for values in source.values(start, end):
+          if len(values) == len(header):
+            yield prepared.render(values)
+          elif values:
+            n = min(len(values), len(header))
+            yield SQL().prepare_insert(self.table_id, header[:n], formatters[:n]).render(values[:n])
+      statements = izip(render(), count())
+
+      builder = BatchBuilder(QUERY_SIZE_LIMIT, QUERY_BATCH_SIZE)
+      return self.execute_inserts(builder.pack(statements), concurrency)
+
+  def insert_batches(self, rows):
+    """
+    Yield lists of (query, row) pairs, each small enough to send as one
+    multi-statement request
+    """
+    def queries():
+      prepared = None
+      for row in rows:
+        # rows normally share their columns, so the statement is prepared once
+        columns = row.column_names()
+        if prepared is None or columns != prepared.columns:
+          prepared = SQL().prepare_insert(self.table_id, columns)
+        yield prepared.render(row.prepared_values()), row
+
+    builder = BatchBuilder(QUERY_SIZE_LIMIT, QUERY_BATCH_SIZE)
+    for query_list in builder.pack(queries()):
+      logger.debug('packed batch of %d queries', len(query_list))
+      yield query_list
 
   def select(self, select_columns=None, in_clause={}):
     """
     Based on a set of rows, get the remote fusion table row_ids
     """
 
+    headers, rows = self.iter_select(select_columns, in_clause)
+    return headers, list(rows)
+
+  def select_arrays(self, select_columns=None, in_clause={}, condition=None):
+    """
+    Like select, but returns the result column by column, decoded to
+    python types according to the table schema (see decode_columns)
+    """
+
+    query = self.select_query(select_columns, in_clause, condition)
+    headers, rows = self.iter_row_results(self.run_query(query, stream=True))
+    return headers, self.decode_columns(headers, rows)
+
+  def column_handler(self, column_name):
+    "the field class for a result column, from the name or schema type"
+    if column_name in self.column_handler_by_name:
+      return self.column_handler_by_name[column_name]
+    for col_id, col_name, col_type in self.schema:
+      if col_name == column_name:
+        return self.column_handler_by_type.get(col_type, StringField)
+    # e.g. an aggregate
+    return StringField
+
+  def decode_columns(self, headers, rows):
+    """
+    Turn result rows into one typed buffer per column, each decoded in a
+    single pass by its field class's decode_column: NUMBERs to a float
+    array, DATETIMEs to datetimes, LOCATIONs to (lat, lng) pairs.
+    """
+    columns = zip(*rows) or [()] * len(headers)
+    return [self.column_handler(name).decode_column(column)
+            for name, column in zip(headers, columns)]
+
+  def select_async(self, select_columns=None, in_clause={}):
+    "Like select, but returns a Future of the headers and rows"
+
+    select_query = self.select_query(select_columns, in_clause)
+    return self.run_query_async(select_query).then(self.parse_row_results)
+
+  def iter_select(self, select_columns=None, in_clause={}):
+    """
+    Like select, but the result rows are parsed lazily as they arrive
+    from the server, so memory use does not grow with the result size.
+    Returns the header and an iterator over the rows.
+    """
+
+    select_query = self.select_query(select_columns, in_clause)
+    return self.iter_row_results(self.run_query(select_query, stream=True))
+
+  def select_query(self, select_columns=None, in_clause={}, condition=None, **kwargs):
+    """
+    Build a SELECT for this table, AND-ing an IN test for each column in
+    `in_clause` with `condition`. Extra keyword arguments (order_by,
+    offset, limit) are passed on to SQL().select.
+    """
+
     if select_columns is None:
       select_columns = self.base_schema.keys()
 
     membership_clauses = []
     for key in in_clause.keys():
       membership_clauses.append("'{0}' IN ({1})".format(key, ",".join(in_clause[key])))
+    if condition:
+      membership_clauses.append(condition)
 
-    select_query = SQL().select(self.table_id, cols=select_columns, condition="AND".join(membership_clauses))
-    return self.parse_row_results(self.run_query(select_query))
+    return SQL().select(self.table_id, cols=select_columns,
+                        condition=" AND ".join(membership_clauses), **kwargs)
+
+  def iter_pages(self, select_columns=None, in_clause={}, cursor=None, prefetch=False, condition=None):
+    """
+    Walk the table `cursor.page_size` rows at a time, yielding rows.
+
+    With keyset paging (the default) each page picks up after the last
+    ROWID seen, which stays cheap however deep into the table we are;
+    otherwise pages are fetched with OFFSET/LIMIT. With `prefetch` the
+    next page is fetched in a background thread while the current one
+    is consumed. `condition` is AND-ed into every page's WHERE clause.
+
+    The cursor is advanced as each row is yielded, so after a failure the
+    same cursor can be passed back in to resume where the walk stopped.
+    """
+    if cursor is None:
+      cursor = SelectCursor()
+    if select_columns is None:
+      select_columns = self.base_schema.keys()
+    select_columns = list(select_columns)
+
+    lowered = [c.lower() for c in select_columns]
+    added_rowid = cursor.keyset and 'rowid' not in lowered
+    if added_rowid:
+      select_columns.append('rowid')
+      lowered.append('rowid')
+    rowid_index = lowered.index('rowid') if cursor.keyset else None
+
+    def strip(row):
+      # hide the rowid column if we only asked for it to page with
+      return row[:-1] if added_rowid else row
+
+    def fetch_page(last_rowid, offset):
+      if cursor.keyset:
+        conditions = [condition] if condition else []
+        if last_rowid is not None:
+          conditions.append("ROWID > '{0}'".format(last_rowid))
+        query = self.select_query(select_columns, in_clause, " AND ".join(conditions),
+                                  order_by='ROWID', limit=cursor.page_size)
+      else:
+        query = self.select_query(select_columns, in_clause, condition,
+                                  offset=offset, limit=cursor.page_size)
+      headers, rows = self.iter_row_results(self.run_query(query, stream=True))
+      return headers, list(rows)
+
+    pool = ThreadPool(1) if prefetch else None
+    try:
+      page = None if cursor.done else fetch_page(cursor.last_rowid, cursor.offset)
+      while page:
+        headers, rows = page
+        cursor.headers = strip(headers)
+
+        next_page = None
+        if pool and len(rows) == cursor.page_size:
+          last_rowid = rows[-1][rowid_index] if cursor.keyset else None
+          next_page = pool.apply_async(fetch_page, (last_rowid, cursor.offset + len(rows)))
+
+        for row in rows:
+          cursor.offset += 1
+          if cursor.keyset:
+            cursor.last_rowid = row[rowid_index]
+          yield strip(row)
+
+        if len(rows) < cursor.page_size:
+          cursor.done = True
+          break
+        if next_page:
+          page = next_page.get()
+        else:
+          page = fetch_page(cursor.last_rowid, cursor.offset)
+    finally:
+      if pool:
+        pool.terminate()
 
   def parse_row_results(self, results):
-    rows = results.strip().split('\n')
-    parsed_rows = []
-    # skip the header
-    for row in csv.reader(rows):
-      parsed_rows.append(row)
+    headers, rows = self.iter_row_results(results)
     # return the header, and the rows
-    return parsed_rows[0], parsed_rows[1:]
+    return headers, list(rows)
+
+  def iter_row_results(self, results):
+    """
+    Split a query result into its header and a lazy csv reader over the
+    rows. `results` may be the result text or a streamed response.
+    """
+    if isinstance(results, basestring):
+      results = StringIO(results.strip())
+    rows = csv.reader(results)
+    return next(rows, []), rows
 
-  def update(self, rows=[]):
+  def update(self, rows=[], concurrency=1):
     """
     Push data locally back to google-hosted fusion table
     `rows` is a list of Row objects
+
+    UPDATEs are packed into multi-statement batches the way insert packs
+    INSERTs, `concurrency` batches at a time. A batch the server rejects
+    is resent one statement per request, so a bad row only fails itself;
+    if all of those then succeed, the server is taken not to accept
+    batched UPDATEs and later batches go one statement per request.
+
+    Returns the result for each row, in order. If any row failed, raises
+    a BatchError carrying the results and the (row, error) failures.
     """
+    for row in rows:
+      if row.row_id is None:
+        raise AttributeError('Rows must have a `row_id` set on UPDATE')
+
+    result_batch = []
+    failures = []
+    for row, value, error in self.execute_batches(self.update_batches(rows), concurrency, 'UPDATE'):
+      if error is not None:
+        failures.append((row, error))
+      result_batch.append(value)
+    logger.debug('BULk UPDATE result batch %s', Truncated(result_batch))
+
+    if failures:
+      raise BatchError('{0} of {1} UPDATEs failed'.format(len(failures), len(rows)),
+                       result_batch, failures)
+    return result_batch
 
-    query_list = []
+  def update_async(self, rows=[], concurrency=None):
+    """
+    Like update, but returns a Future of the result for each row. Batches
+    are built as earlier ones finish, like insert_async's. A rejected
+    batch fails the update, it is not retried statement by statement.
+    """
     for row in rows:
       if row.row_id is None:
         raise AttributeError('Rows must have a `row_id` set on UPDATE')
 
-      column_name_field_map = {}
-      unique_columns = []
-      values = []
+    def batch_results(ql):
+      def results(result):
+        values = self.result_column(result)
+        if len(values) != len(ql):
+          values = [result] * len(ql)
+        return values
+      return results
+
+    if 'UPDATE' in self.unbatchable:
+      batches = ([(self.update_query(row), row)] for row in rows)
+    else:
+      batches = self.update_batches(rows)
+    from pyft.client.asyncclient import gather_bounded
+    def submit(ql):
+      return self.run_query_async(";".join([query for query, row in ql])).then(batch_results(ql))
+    concurrency = concurrency or current_app.get_async_client().max_connections
+    future = gather_bounded(submit, batches, concurrency)
+    return future.then(lambda results: list(chain.from_iterable(results)))
+
+  def execute_batches(self, batches, concurrency=1, verb='UPDATE'):
+    """
+    Run batches of (query, item) pairs, `concurrency` batches at a time,
+    yielding (item, result, error) for every statement in order.
+
+    A batch that fails is resent one statement per request, so a bad
+    statement only fails itself. If the server rejected the batch with a
+    4xx status and all of its statements then succeed, the server is taken
+    not to accept batches of `verb` statements and later batches go one
+    statement per request (see `unbatchable`). A 5xx says nothing about
+    batching - Fusion Tables reports 500s for writes that went through -
+    so it never does.
+    """
 
-      for field in row:
-        if field.unique_key:
-          unique_columns.append(field.column_name)
+    def execute_single(pair):
+      query, item = pair
+      try:
+        return self.result_column(self.run_query(query))[0], None
+      except HTTPError, e:
+        logger.debug('%s of %s failed: %s', verb, Truncated(item), e)
+        return None, e
+
+    def execute_batch(ql):
+      rejected = False
+      if len(ql) > 1 and verb not in self.unbatchable:
+        try:
+          result = self.run_query(";".join([query for query, item in ql]))
+          values = self.result_column(result)
+          if len(values) != len(ql):
+            # no per statement results to hand out
+            values = [result] * len(ql)
+          return [(value, None) for value in values]
+        except HTTPError, e:
+          logger.debug('batched %s failed, retrying singly: %s', verb, e)
+          rejected = e.code < 500
+
+      if concurrency > 1:
+        outcomes = list(imap_bounded(execute_single, ql, concurrency))
+      else:
+        outcomes = [execute_single(pair) for pair in ql]
+      if rejected and verb not in self.unbatchable and not [e for v, e in outcomes if e]:
+        logger.debug('server does not accept batched %ss', verb)
+        self.unbatchable = self.unbatchable | set([verb])
+      return outcomes
+
+    def run(ql):
+      return ql, execute_batch(ql)
+
+    if concurrency > 1:
+      results = imap_bounded(run, batches, concurrency)
+    else:
+      results = (run(ql) for ql in batches)
+
+    for ql, outcomes in results:
+      for (query, item), (value, error) in zip(ql, outcomes):
+        yield item, value, error
+
+  def result_column(self, result):
+    "the values of the first column of a query result"
+    headers, rows = self.parse_row_results(result)
+    return [row[0] for row in rows]
+
+  def update_query(self, row):
+    if row.row_id is None:
+      raise AttributeError('Rows must have a `row_id` set on UPDATE')
+
+    return SQL().update(self.table_id,
+                        row.column_names(),
+                        row.values(),
+                        int(row.row_id))
+
+  def update_batches(self, rows):
+    """
+    Yield lists of (query, row) UPDATE pairs, packed like insert_batches
+    """
+    builder = BatchBuilder(QUERY_SIZE_LIMIT, QUERY_BATCH_SIZE)
+    return builder.pack((self.update_query(row), row) for row in rows)
 
-      update_query = SQL().update(self.table_id,
-                                  row.column_names(),
-                                  row.values(),
-                                  int(row.row_id))
+  def upsert(self, rows=[], concurrency=1):
+    """
+    Insert the rows that are not in the table yet and update the ones that
+    are, matching rows on their `unique_keys`. Existing row ids are looked
+    up in batched key probes, and both the inserts and the updates are
+    sent as batched multi-statement requests, `concurrency` at a time.
 
-      query_list.append(update_query)
+    Sets `row_id` on every row and returns the row ids in the same order
+    as `rows`.
+    """
+    if not rows:
+      return []
 
-    result_batch = []
-    for query in query_list:
-      result_batch.append(self.run_query(query))
-    logger.debug('BULk UPDATE result batch {0}'.format(result_batch) )
-    return result_batch
+    missing, present_row_ids = self.determine_which_rows_are_not_inserted(rows, concurrency)
+    key_columns = [x.column_name for x in self.get_unique_keys(rows)]
+
+    present = []
+    for row in rows:
+      key = self.row_key(row, key_columns)
+      if key in present_row_ids:
+        row.row_id = present_row_ids[key]
+        present.append(row)
+    logger.debug('upsert: %d inserts, %d updates', len(missing), len(present))
+
+    for row, row_id in zip(missing, self.insert(missing, concurrency)):
+      row.row_id = row_id
+
+    self.update(present, concurrency)
+
+    return [row.row_id for row in rows]
+
+
+  def delete_rows(self, row_ids, concurrency=1):
+    """
+    Delete rows by row id. `row_ids` may be any iterable, and is read
+    lazily; DELETEs are packed and sent like update's UPDATEs.
+
+    Returns the number of rows deleted. If any failed, raises a BatchError
+    whose failures are (row_id, error) pairs.
+    """
+    builder = BatchBuilder(QUERY_SIZE_LIMIT, QUERY_BATCH_SIZE)
+    batches = builder.pack((SQL().delete(self.table_id, int(row_id)), row_id) for row_id in row_ids)
+
+    deleted = 0
+    results = []
+    failures = []
+    for row_id, value, error in self.execute_batches(batches, concurrency, 'DELETE'):
+      if error is not None:
+        failures.append((row_id, error))
+      else:
+        deleted += 1
+      results.append(value)
+
+    if failures:
+      raise BatchError('{0} of {1} DELETEs failed'.format(len(failures), len(results)),
+                       results, failures)
+    return deleted
+
+  def delete_where(self, condition, in_clause={}, concurrency=1):
+    """
+    Delete the rows matching a WHERE condition and/or IN clause. Fusion
+    Tables only deletes by ROWID, so the matching row ids are paged
+    through with iter_pages and deleted as they arrive.
+    """
+    matching = self.iter_pages(['rowid'], in_clause, condition=condition)
+    return self.delete_rows((row[0] for row in matching), concurrency)
 
+  def truncate(self):
+    " Delete every row in the table with a single DELETE "
+    return self.run_query(SQL().delete(self.table_id))
 
   def pull(self):
     """
@@ -334,7 +941,7 @@ class FusionTable(object):
     select_fields = ','.join(col_ids)
 
     query_string = "select %s from %s"%(select_fields, self.table_id)
-    rows = self.client.query(query_string).strip().split('\n')
+    rows = self.client.query(query_string, stream=True)
 
     model_class = self.db_model
     error_messages = []
@@ -365,3 +972,25 @@ class FusionTable(object):
 
     return error_messages
 
+# the table, rows and concurrency of an execute_inserts_in_processes worker
+_insert_worker = {}
+
+def _init_insert_worker(table, rows, concurrency):
+  # the connections in the pools belong to the parent
+  default_pool.after_fork()
+  if current_app.client.pool is not None:
+    current_app.client.pool.after_fork()
+  _insert_worker.update(table=table, rows=rows, concurrency=concurrency)
+
+def _insert_range(bounds):
+  table = _insert_worker['table']
+  start, end = bounds
+  batches = table.insert_batches(_insert_worker['rows'][start:end])
+  try:
+    return table.execute_inserts(batches, _insert_worker['concurrency'])
+  except HTTPError, e:
+    # HTTPError doesn't pickle, so it would never reach the parent: send
+    # one that does, without the response
+    error = HTTPError(e.url, e.code, e.msg, None, None)
+    error.args = (e.url, e.code, e.msg, None, None)
+    raise error
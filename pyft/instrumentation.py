@@ -0,0 +1,95 @@
+import time
+import logging
+import threading
+from collections import deque, namedtuple
+
+query_logger = logging.getLogger('pyft.queries')
+
+# characters of a query or result to log
+LOG_TRUNCATE = 1000
+
+class Truncated(object):
+  """
+  Formats `value` as at most `limit` characters, but only when a log
+  record is actually emitted, so passing one as a logging argument costs
+  nothing while the level is off.
+  """
+  __slots__ = ('value', 'limit')
+
+  def __init__(self, value, limit=LOG_TRUNCATE):
+    self.value = value
+    self.limit = limit
+
+  def __unicode__(self):
+    text = self.value
+    if isinstance(text, str):
+      # queries and results are UTF-8 bytes; decoded, they can be measured
+      # and cut in characters, and mix with unicode log messages
+      text = text.decode('utf-8', 'replace')
+    elif not isinstance(text, unicode):
+      text = unicode(text)
+    if len(text) <= self.limit:
+      return text
+    return u'%s... (%d more characters)' % (text[:self.limit], len(text) - self.limit)
+
+  def __str__(self):
+    text = self.__unicode__()
+    if isinstance(text, unicode):
+      text = text.encode('utf-8')
+    return text
+
+
+QueryRecord = namedtuple('QueryRecord', 'verb query_size result_size seconds error')
+
+class QueryStats(object):
+  """
+  A thread-safe record of the queries sent: running totals plus the last
+  `maxlen` QueryRecords. Result sizes of streamed queries are not known
+  and are recorded as None.
+  """
+
+  def __init__(self, maxlen=1000):
+    self.records = deque(maxlen=maxlen)
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self.records.clear()
+      self.queries = 0
+      self.errors = 0
+      self.seconds = 0.0
+      self.query_bytes = 0
+      self.result_bytes = 0
+
+  def record(self, query, result, seconds, error=None):
+    record = QueryRecord(query.split(None, 1)[0].upper() if query.strip() else '',
+                         len(query),
+                         len(result) if isinstance(result, basestring) else None,
+                         seconds,
+                         error)
+    with self._lock:
+      self.records.append(record)
+      self.queries += 1
+      self.seconds += seconds
+      self.query_bytes += record.query_size
+      self.result_bytes += record.result_size or 0
+      if error is not None:
+        self.errors += 1
+    if query_logger.isEnabledFor(logging.DEBUG):
+      query_logger.debug('%s: %d bytes sent, %s bytes received in %.3fs%s',
+                         record.verb, record.query_size,
+                         '?' if record.result_size is None else record.result_size,
+                         seconds, ' (%s)' % error if error is not None else '')
+    return record
+
+  def timed(self, query, run):
+    "call `run`, recording how long it took and the size of what it returned"
+    start = time.time()
+    try:
+      result = run()
+    except Exception, e:
+      self.record(query, None, time.time() - start, e)
+      raise
+    self.record(query, result, time.time() - start)
+    return result
@@ -10,7 +10,18 @@ class Loader(object):
 
   def setup_settings(self, settingsdict):
     default = {
-        'TEST_TABLE_PREFIX':'__pyft_test_'
+        'TEST_TABLE_PREFIX':'__pyft_test_',
+        # seconds to cache table schemas and names for
+        'PYFT_METADATA_TTL':300,
+        # results of read-only queries to cache, 0 to not cache them
+        'PYFT_QUERY_CACHE_SIZE':0,
+        'PYFT_QUERY_CACHE_TTL':60,
+        # where ClientLogin tokens are kept between runs, None for nowhere
+        'PYFT_TOKEN_CACHE':'~/.pyft/tokens',
+        'PYFT_TOKEN_TTL':86400,
+        # file to log pyft's messages to, None to leave logging to the caller
+        'PYFT_LOG_FILE':None,
+        'PYFT_LOG_LEVEL':'DEBUG',
     }
     default.update(settingsdict)
     return default
@@ -0,0 +1,80 @@
+import time
+import datetime
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+# the most requests Fusion Tables takes from an account
+QUERY_MAX_RATE = datetime.timedelta(milliseconds=200)
+
+class TokenBucket(object):
+  """
+  A thread-safe token bucket.
+
+  `rate` tokens are added per second, up to `capacity`. Each acquire()
+  takes a token, sleeping until one is available. Callers reserve their
+  token under the lock and sleep outside it, so concurrent callers are
+  spaced out evenly rather than woken all at once.
+  """
+
+  def __init__(self, rate, capacity=1):
+    self.rate = float(rate)
+    self.capacity = capacity
+    self._tokens = float(capacity)
+    self._last = time.time()
+    self._lock = threading.Lock()
+
+  def reserve(self, tokens=1):
+    "take `tokens` and return the number of seconds to wait before using them"
+    with self._lock:
+      now = time.time()
+      self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+      self._last = now
+      self._tokens -= tokens
+      if self._tokens >= 0:
+        return 0
+      return -self._tokens / self.rate
+
+  def acquire(self, tokens=1):
+    seconds_to_sleep = self.reserve(tokens)
+    if seconds_to_sleep > 0:
+      logger.debug('sleeping : {0}'.format(seconds_to_sleep))
+      time.sleep(seconds_to_sleep)
+    return seconds_to_sleep
+
+
+class SharedTokenBucket(TokenBucket):
+  """
+  A TokenBucket kept in shared memory, so that it is shared by the
+  processes forked after it is made, e.g. the workers of a
+  multiprocessing.Pool.
+  """
+
+  def __init__(self, rate, capacity=1):
+    import multiprocessing
+    self.rate = float(rate)
+    self.capacity = capacity
+    # tokens, and when they were last topped up
+    self._state = multiprocessing.Array('d', [float(capacity), time.time()], lock=False)
+    self._lock = multiprocessing.Lock()
+
+  @property
+  def _tokens(self):
+    return self._state[0]
+
+  @_tokens.setter
+  def _tokens(self, value):
+    self._state[0] = value
+
+  @property
+  def _last(self):
+    return self._state[1]
+
+  @_last.setter
+  def _last(self, value):
+    self._state[1] = value
+
+
+# the bucket FusionTable and CSVImporter take their tokens from, shared
+# by everything since the request rate is enforced per account
+default_rate_limiter = TokenBucket(1 / QUERY_MAX_RATE.total_seconds())
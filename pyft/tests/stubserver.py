@@ -0,0 +1,302 @@
+"""
+A local stand-in for the Fusion Tables query API, used by the tests and
+benchmarks that should not need a google account or network access.
+
+It keeps tables in memory and understands the handful of statements that
+pyft sends: SHOW TABLES, DESCRIBE, CREATE TABLE, DROP TABLE, INSERT,
+UPDATE, DELETE and SELECT.
+"""
+import re
+import csv
+import sys
+import ssl
+import socket
+import time
+import threading
+import unittest
+import urlparse
+from StringIO import StringIO
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from pyft import current_app
+from pyft.client.ftclient import ClientLoginFTClient
+from pyft.client.connectionpool import default_pool
+from pyft.fusiontables import FusionTable
+from pyft import ratelimit
+from pyft.ratelimit import TokenBucket
+
+STRING_RE = r"'(?:\\.|[^'\\])*'"
+VALUE_RE = re.compile(r"\s*(%s|[-+0-9.eE]+)\s*" % STRING_RE)
+
+
+def split_statements(sql):
+  "split a ';' joined batch, ignoring semicolons inside quoted strings"
+  statements = []
+  for part in re.findall(r"(?:%s|[^;'])+" % STRING_RE, sql):
+    if part.strip():
+      statements.append(part.strip())
+  return statements
+
+def parse_value(token):
+  token = token.strip()
+  if token.startswith("'"):
+    return re.sub(r"\\(.)", r"\1", token[1:-1])
+  return token
+
+def parse_values(text):
+  return [parse_value(v) for v in VALUE_RE.findall(text)]
+
+def compare(left, op, right):
+  try:
+    left, right = float(left), float(right)
+  except ValueError:
+    pass
+  return {'=': left == right, '>': left > right, '<': left < right,
+          '>=': left >= right, '<=': left <= right}[op]
+
+CONDITION_RE = re.compile(r"(ROWID|rowid|'[^']*'|\w+)\s*(IN|>=|<=|=|>|<)\s*"
+                          r"(\((?:%s|[^)])*\)|%s|[-\w.]+)" % (STRING_RE, STRING_RE))
+
+def parse_condition(condition):
+  "parse a WHERE clause of AND-ed comparisons and IN lists"
+  tests = []
+  for col, op, value in CONDITION_RE.findall(condition or ''):
+    if op == 'IN':
+      value = set(str(v) for v in parse_values(value[1:-1]))
+    else:
+      value = parse_value(value)
+    tests.append((col.strip("'"), op, value))
+  return tests
+
+def matches(row_id, row, tests):
+  for col, op, value in tests:
+    actual = row_id if col.lower() == 'rowid' else row.get(col, '')
+    if op == 'IN':
+      if str(actual) not in value:
+        return False
+    elif not compare(actual, op, value):
+      return False
+  return True
+
+def to_csv(header, rows):
+  out = StringIO()
+  writer = csv.writer(out, lineterminator='\n')
+  writer.writerow(header)
+  writer.writerows(rows)
+  return out.getvalue()
+
+
+class StubFusionTables(object):
+  "in-memory tables, keyed by numeric table id"
+
+  def __init__(self):
+    self.tables = {}
+    self.next_table_id = 1000
+    self.lock = threading.Lock()
+    self.statements = 0
+    self.batch_mutations = True
+
+  def execute(self, sql):
+    with self.lock:
+      results = []
+      statements = split_statements(sql)
+      if not self.batch_mutations and len(statements) > 1 and \
+          [s for s in statements if s.upper().startswith(('UPDATE', 'DELETE'))]:
+        raise ValueError('only INSERT statements can be batched')
+      for statement in statements:
+        self.statements += 1
+        results.append(self.execute_statement(statement))
+      if results and all(r[0] == results[0][0] for r in results):
+        # a batch of inserts comes back as a single rowid column
+        return to_csv(results[0][0], sum([r[1] for r in results], []))
+      return to_csv(*results[-1]) if results else ''
+
+  def execute_statement(self, statement):
+    verb = statement.split(None, 1)[0].upper()
+    return getattr(self, 'do_' + verb.lower())(statement)
+
+  def do_show(self, statement):
+    return ['table id', 'name'], [[tid, t['name']] for tid, t in sorted(self.tables.items())]
+
+  def do_describe(self, statement):
+    table = self.tables[int(statement.split()[1])]
+    return ['column id', 'name', 'type'], [list(c) for c in table['columns']]
+
+  def do_create(self, statement):
+    m = re.match(r"CREATE TABLE '(.*?)' \((.*)\)$", statement, re.S)
+    columns = []
+    for i, (name, col_type) in enumerate(re.findall(r"'(.*?)': (\w+)", m.group(2))):
+      columns.append(('col%d' % i, name, col_type.lower()))
+    self.next_table_id += 1
+    self.tables[self.next_table_id] = {'name': m.group(1), 'columns': columns,
+                                       'rows': {}, 'next_rowid': 1}
+    return ['tableid'], [[self.next_table_id]]
+
+  def do_drop(self, statement):
+    del self.tables[int(statement.split()[2])]
+    return ['result'], [['OK']]
+
+  def do_insert(self, statement):
+    m = re.match(r"INSERT INTO (\d+) \((.*?)\) VALUES \((.*)\)$", statement, re.S)
+    table = self.tables[int(m.group(1))]
+    cols = re.findall(r"'(.*?)'", m.group(2))
+    row_id = table['next_rowid']
+    table['next_rowid'] += 1
+    table['rows'][row_id] = dict(zip(cols, parse_values(m.group(3))))
+    return ['rowid'], [[row_id]]
+
+  def do_update(self, statement):
+    m = re.match(r"UPDATE (\d+) SET (.*) WHERE ROWID = '(\d+)'$", statement, re.S)
+    row = self.tables[int(m.group(1))]['rows'][int(m.group(3))]
+    for col, value in re.findall(r"'(.*?)' = (%s|[-+0-9.eE]+)" % STRING_RE, m.group(2)):
+      row[col] = parse_value(value)
+    return ['affected_rows'], [[1]]
+
+  def do_delete(self, statement):
+    m = re.match(r"DELETE FROM (\d+)(?: WHERE ROWID = '(\d+)')?$", statement)
+    rows = self.tables[int(m.group(1))]['rows']
+    if m.group(2) is None:
+      deleted = len(rows)
+      rows.clear()
+    else:
+      deleted = rows.pop(int(m.group(2)), None) is not None and 1 or 0
+    return ['affected_rows'], [[deleted]]
+
+  def do_select(self, statement):
+    m = re.match(r"SELECT (.*?) FROM (\d+)(?: WHERE (.*?))?(?: ORDER BY (\w+))?"
+                 r"(?: OFFSET (\d+))?(?: LIMIT (\d+))?$", statement, re.S)
+    table = self.tables[int(m.group(2))]
+    if m.group(1).strip() == '*':
+      cols = [c[1] for c in table['columns']]
+    else:
+      cols = [c.strip().strip("'") for c in m.group(1).split(',')]
+    rows = []
+    tests = parse_condition(m.group(3))
+    for row_id, row in sorted(table['rows'].items()):
+      if matches(row_id, row, tests):
+        rows.append([row_id if c.lower() == 'rowid' else row.get(c, '') for c in cols])
+    offset = int(m.group(5) or 0)
+    limit = int(m.group(6)) if m.group(6) else None
+    return cols, rows[offset:offset + limit if limit is not None else None]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    with self.server.counter_lock:
+      self.server.connections += 1
+
+  def log_message(self, format, *args):
+    pass
+
+  def respond(self, params):
+    with self.server.counter_lock:
+      self.server.requests += 1
+      self.server.in_flight += 1
+      self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+    sql = urlparse.parse_qs(params).get('sql', [''])[0]
+    if self.server.valid_tokens is not None and \
+        self.headers.getheader('Authorization', '')[len('GoogleLogin auth='):] not in self.server.valid_tokens:
+      with self.server.counter_lock:
+        self.server.in_flight -= 1
+      self.send_response(401)
+      self.send_header('Content-Length', '0')
+      self.end_headers()
+      return
+    try:
+      # pretend to be a server on the far side of the internet
+      time.sleep(self.server.latency)
+      body = self.server.fusiontables.execute(sql)
+      status = 200
+      if self.server.fail_after_execute:
+        # fusion tables has been known to report errors for queries
+        # that went through
+        status = self.server.fail_after_execute.pop(0)
+    except Exception, e:
+      body, status = 'bad query: %s' % e, 400
+    finally:
+      with self.server.counter_lock:
+        self.server.in_flight -= 1
+    self.send_response(status)
+    self.send_header('Content-Type', 'text/plain; charset=UTF-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    self.respond(urlparse.urlparse(self.path).query)
+
+  def do_POST(self):
+    self.respond(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+  "serve a StubFusionTables on localhost from a background thread"
+  daemon_threads = True
+
+  def __init__(self, port=0, latency=0, certfile=None):
+    HTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+    # serve https as localhost, with the key and certificate in `certfile`
+    self.certfile = certfile
+    if certfile is not None:
+      self.socket = ssl.wrap_socket(self.socket, certfile=certfile, server_side=True)
+    self.fusiontables = StubFusionTables()
+    self.latency = latency
+    self.fail_after_execute = []
+    # ClientLogin tokens to accept, None for any
+    self.valid_tokens = None
+    self.counter_lock = threading.Lock()
+    self.connections = 0
+    self.requests = 0
+    self.in_flight = 0
+    self.max_in_flight = 0
+
+  @property
+  def url(self):
+    if self.certfile is not None:
+      return 'https://localhost:%d/fusiontables/api/query' % self.server_address[1]
+    return 'http://127.0.0.1:%d/fusiontables/api/query' % self.server_address[1]
+
+  def handle_error(self, request, client_address):
+    # clients going away mid-request, e.g. terminated worker processes
+    if not isinstance(sys.exc_info()[1], socket.error):
+      HTTPServer.handle_error(self, request, client_address)
+
+  def start(self):
+    thread = threading.Thread(target=self.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+class StubServerTestCase(unittest.TestCase):
+  """ Runs each test against a fresh StubServer, with current_app.client
+  (also `self.client`) sending queries to it and a rate limit of `rate`
+  requests per second in place of the real one. """
+
+  # seconds the server takes over each request
+  latency = 0
+  rate = 1000
+
+  def setUp(self):
+    self.server = StubServer(latency=self.latency).start()
+    self._app_client = current_app.client
+    current_app.client = self.client = ClientLoginFTClient('token')
+    self.client.request_url = self.server.url
+    self._rate_limiters = FusionTable.rate_limiter, ratelimit.default_rate_limiter
+    FusionTable.rate_limiter = ratelimit.default_rate_limiter = TokenBucket(self.rate)
+    current_app.metadata_cache.clear()
+
+  def tearDown(self):
+    current_app.client = self._app_client
+    FusionTable.rate_limiter, ratelimit.default_rate_limiter = self._rate_limiters
+    default_pool.clear()
+    self.server.stop()
@@ -0,0 +1,95 @@
+import time
+import socket
+import httplib
+import unittest
+from urllib2 import HTTPError
+
+from pyft.client.ftclient import ClientLoginFTClient
+from pyft.client.connectionpool import ConnectionPool
+from pyft.client.connectionpool import can_resend
+from pyft.client.sql.sqlbuilder import SQL
+from pyft.tests.stubserver import StubServer
+
+class PYFTConnectionPool(unittest.TestCase):
+
+  def setUp(self):
+    self.server = StubServer().start()
+
+  def client(self, pool):
+    client = ClientLoginFTClient('token', pool=pool)
+    client.request_url = self.server.url
+    return client
+
+  def test_connections_are_reused(self):
+    pool = ConnectionPool(maxsize=2)
+    client = self.client(pool)
+    for i in xrange(10):
+      client.query(SQL().showTables())
+    self.assertEqual(self.server.connections, 1)
+    self.assertEqual(pool.stats()['misses'], 1)
+    self.assertEqual(pool.stats()['hits'], 9)
+
+  def test_dead_connections_are_recycled(self):
+    pool = ConnectionPool(maxsize=2)
+    client = self.client(pool)
+    client.query(SQL().showTables())
+    # kill the pooled socket underneath the pool
+    conn, last_used = pool._pools.values()[0].queue[0]
+    conn.sock.shutdown(socket.SHUT_RDWR)
+    client.query(SQL().showTables())
+    self.assertEqual(pool.stats()['recycled'], 1)
+    self.assertEqual(self.server.connections, 2)
+
+  def test_idle_connections_are_recycled(self):
+    pool = ConnectionPool(maxsize=2, max_idle=-1)
+    client = self.client(pool)
+    client.query(SQL().showTables())
+    client.query(SQL().showTables())
+    self.assertEqual(pool.stats(), {'hits': 0, 'misses': 2, 'recycled': 1})
+
+  def test_timeouts_are_not_resent(self):
+    pool = ConnectionPool(timeout=0.2)
+    client = self.client(pool)
+    client.query(SQL().showTables())
+    requests = self.server.requests
+    # the INSERT reaches the server on the reused connection, but the
+    # reply is too slow; sending it again would store the row twice
+    self.server.latency = 0.4
+    self.assertRaises(socket.timeout, client.query,
+                      "CREATE TABLE 'PYFTConnectionPool' ('numbers': NUMBER)")
+    time.sleep(0.5)
+    self.assertEqual(self.server.requests - requests, 1)
+    self.assertEqual(len(self.server.fusiontables.tables), 1)
+
+  def test_can_resend(self):
+    closed = httplib.BadStatusLine('')
+    self.assertTrue(can_resend('POST', False, socket.error(32, 'Broken pipe')))
+    self.assertTrue(can_resend('GET', True, closed))
+    self.assertFalse(can_resend('POST', True, closed))
+    self.assertFalse(can_resend('GET', True, httplib.BadStatusLine('HTTP/1.1 2')))
+    self.assertFalse(can_resend('GET', True, socket.error(104, 'Connection reset by peer')))
+    self.assertFalse(can_resend('GET', False, socket.timeout('timed out')))
+
+  def test_http_errors_are_raised(self):
+    client = self.client(ConnectionPool())
+    self.assertRaises(HTTPError, client.query, "DESCRIBE 12345")
+    # the connection survives an error response
+    client.query(SQL().showTables())
+    self.assertEqual(self.server.connections, 1)
+
+  def test_benchmark_queries_per_second(self):
+    n = 500
+    for label, pool in (('new connection per query', ConnectionPool(maxsize=0)),
+                        ('pooled keep-alive', ConnectionPool())):
+      client = self.client(pool)
+      start = time.time()
+      for i in xrange(n):
+        client.query(SQL().showTables())
+      elapsed = time.time() - start
+      print '%s: %.0f queries/sec %s' % (label, n / elapsed, pool.stats())
+
+  def tearDown(self):
+    self.server.stop()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,139 @@
+import time
+import threading
+import unittest
+
+from pyft.fusiontables import FusionTable
+from pyft.fusiontables import BatchError
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import Row
+from pyft.ratelimit import TokenBucket
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTConcurrentInsert(StubServerTestCase):
+  latency = 0.05
+  rate = 100
+
+  def setUp(self):
+    super(PYFTConcurrentInsert, self).setUp()
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTConcurrentInsert")
+
+  def build_rows(self, n, start=0):
+    return [Row(row_id=None, fields=[NumberField(i, column_name="numbers", unique_key=True),
+                                     StringField("row%d" % i, column_name="letters", unique_key=True)])
+            for i in xrange(start, start + n)]
+
+  def test_determine_which_rows_are_not_inserted(self):
+    present = self.ft.insert(self.build_rows(1500))
+    rows = self.build_rows(2000, start=1000)
+    # same number, different letters: not a match on the composite key
+    rows[0] = self.build_rows(1, start=1)[0]
+    rows[0][1].value = rows[0].field_lookup['letters'] = 'other'
+
+    missing, row_ids = self.ft.determine_which_rows_are_not_inserted(rows, concurrency=3)
+    self.assertEqual([r.field_lookup['numbers'] for r in missing],
+                     ['1'] + [str(i) for i in xrange(1500, 3000)])
+    # every remote row the probes turned up, including ('1', 'row1')
+    self.assertEqual(len(row_ids), 500)
+    self.assertFalse(('1', 'other') in row_ids)
+    self.assertEqual(row_ids[('1001', 'row1001')], present[1001])
+
+  def test_insert_recovers_from_500_on_success(self):
+    self.ft.insert(self.build_rows(10))
+    # the second batch goes through, but the server says it failed
+    self.server.fail_after_execute = [200, 500]
+    rows = self.build_rows(1000, start=10)
+    row_ids = self.ft.insert(rows)
+    self.assertEqual(row_ids, [str(i) for i in xrange(11, 1011)])
+
+  def test_concurrent_insert_keeps_row_order(self):
+    rows = self.build_rows(5000)
+    row_ids = self.ft.insert(rows, concurrency=4)
+    self.assertEqual(len(row_ids), len(rows))
+
+    stored = self.server.fusiontables.tables[int(self.ft.table_id)]['rows']
+    for row, row_id in zip(rows, row_ids):
+      self.assertEqual(stored[int(row_id)]['numbers'], str(row[0].value))
+    self.assertTrue(self.server.max_in_flight > 1)
+
+  def test_upsert(self):
+    self.ft.insert(self.build_rows(600))
+    rows = self.build_rows(1000, start=300)
+    rows[0][1].value = "it's updated"
+
+    requests = self.server.requests
+    row_ids = self.ft.upsert(rows, concurrency=2)
+    self.assertEqual(row_ids, [str(i) for i in xrange(301, 601)] +
+                              [str(i) for i in xrange(601, 1301)])
+    self.assertEqual([r.row_id for r in rows], row_ids)
+    # 2 key probes, 2 insert batches, 1 update batch
+    self.assertEqual(self.server.requests - requests, 5)
+    stored = self.server.fusiontables.tables[int(self.ft.table_id)]['rows']
+    self.assertEqual(stored[301]['letters'], "it's updated")
+
+  def test_batched_update(self):
+    rows = self.build_rows(1200)
+    for row, row_id in zip(rows, self.ft.insert(rows)):
+      row.row_id = row_id
+      row[1].value = 'updated'
+    requests = self.server.requests
+    results = self.ft.update(rows, concurrency=2)
+    self.assertEqual(results, ['1'] * 1200)
+    self.assertEqual(self.server.requests - requests, 3)
+
+  def test_update_falls_back_to_single_statements(self):
+    self.server.fusiontables.batch_mutations = False
+    rows = self.build_rows(20)
+    for row, row_id in zip(rows, self.ft.insert(rows)):
+      row.row_id = row_id
+    self.assertEqual(self.ft.update(rows), ['1'] * 20)
+    self.assertTrue('UPDATE' in self.ft.unbatchable)
+
+    requests = self.server.requests
+    rows[5].row_id = 9999
+    try:
+      self.ft.update(rows, concurrency=4)
+      self.fail('expected a BatchError')
+    except BatchError, e:
+      self.assertEqual([row for row, error in e.failures], [rows[5]])
+      self.assertEqual(e.results, ['1'] * 5 + [None] + ['1'] * 14)
+    self.assertEqual(self.server.requests - requests, 20)
+
+  def test_server_errors_dont_stop_batching(self):
+    rows = self.build_rows(20)
+    for row, row_id in zip(rows, self.ft.insert(rows)):
+      row.row_id = row_id
+    # a 500 for a batch that went through, then the statements one by one
+    self.server.fail_after_execute = [500]
+    self.assertEqual(self.ft.update(rows), ['1'] * 20)
+    self.assertEqual(self.ft.unbatchable, frozenset())
+    requests = self.server.requests
+    self.assertEqual(self.ft.update(rows), ['1'] * 20)
+    self.assertEqual(self.server.requests - requests, 1)
+
+    self.server.fail_after_execute = [503]
+    self.assertEqual(self.ft.delete_rows([row.row_id for row in rows]), 20)
+    self.assertEqual(self.ft.unbatchable, frozenset())
+
+  def test_serial_insert(self):
+    row_ids = self.ft.insert(self.build_rows(1200))
+    self.assertEqual(row_ids, [str(i) for i in xrange(1, 1201)])
+    self.assertEqual(self.server.max_in_flight, 1)
+
+  def test_token_bucket_is_shared_across_threads(self):
+    bucket = TokenBucket(50)
+    def worker():
+      for i in xrange(5):
+        bucket.acquire()
+    threads = [threading.Thread(target=worker) for i in xrange(4)]
+    start = time.time()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    # the first token is free, the other 19 are spaced 20ms apart
+    self.assertTrue(time.time() - start >= 19 / 50.0 - 0.01)
+
+if __name__ == '__main__':
+  unittest.main()
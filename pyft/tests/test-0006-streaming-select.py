@@ -0,0 +1,72 @@
+import unittest
+
+from pyft import current_app
+from pyft.fusiontables import FusionTable
+from pyft.fusiontables import SelectCursor
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import Row
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTStreamingSelect(StubServerTestCase):
+  rate = 100
+
+  def setUp(self):
+    super(PYFTStreamingSelect, self).setUp()
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTStreamingSelect")
+    self.ft.client = current_app.client
+    self.letters = ['line one\nline two', 'quoted "comma, here"', 'x' * 10000]
+    self.ft.insert([Row(row_id=None, fields=[NumberField(i, column_name="numbers"),
+                                             StringField(l, column_name="letters")])
+                    for i, l in enumerate(self.letters * 100)])
+
+  def test_iter_select_parses_multiline_fields(self):
+    headers, rows = self.ft.iter_select(['rowid', 'numbers', 'letters'])
+    self.assertEqual(headers, ['rowid', 'numbers', 'letters'])
+    self.assertFalse(isinstance(rows, list))
+    letters = [row[2] for row in rows]
+    self.assertEqual(letters, self.letters * 100)
+
+  def test_connection_is_reused_after_streaming(self):
+    headers, rows = self.ft.iter_select(['numbers'])
+    for row in rows:
+      pass
+    headers, rows = self.ft.select(['numbers'])
+    self.assertEqual(len(rows), 300)
+    self.assertEqual(self.server.connections, 1)
+
+  def test_schema_and_name(self):
+    self.assertEqual(sorted(c[1:] for c in self.ft.fetch_schema()),
+                     [('letters', 'string'), ('numbers', 'number'), ('rowid', 'rowid')])
+    self.assertEqual(self.ft.table_name, "PYFTStreamingSelect")
+
+  def test_keyset_paging(self):
+    cursor = SelectCursor(page_size=7)
+    rows = list(self.ft.iter_pages(['numbers'], cursor=cursor, prefetch=True))
+    self.assertEqual([int(r[0]) for r in rows], range(300))
+    self.assertEqual(cursor.headers, ['numbers'])
+    self.assertTrue(cursor.done)
+    self.assertEqual(cursor.last_rowid, '300')
+
+  def test_offset_paging(self):
+    cursor = SelectCursor(page_size=50, keyset=False)
+    rows = list(self.ft.iter_pages(['rowid', 'numbers'], cursor=cursor))
+    self.assertEqual([r[0] for r in rows], [str(i) for i in xrange(1, 301)])
+    self.assertEqual(cursor.offset, 300)
+
+  def test_paging_resumes_from_cursor(self):
+    for keyset in (True, False):
+      cursor = SelectCursor(page_size=20, keyset=keyset)
+      seen = []
+      for row in self.ft.iter_pages(['rowid'], cursor=cursor, prefetch=True):
+        seen.append(row[0])
+        if len(seen) == 45:
+          break
+      seen += [row[0] for row in self.ft.iter_pages(['rowid'], cursor=cursor)]
+      self.assertEqual(seen, [str(i) for i in xrange(1, 301)])
+
+if __name__ == '__main__':
+  unittest.main()
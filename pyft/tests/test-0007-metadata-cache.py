@@ -0,0 +1,58 @@
+import time
+import unittest
+
+from pyft import current_app
+from pyft.cache import TTLCache
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTMetadataCache(StubServerTestCase):
+  rate = 100
+
+  def setUp(self):
+    super(PYFTMetadataCache, self).setUp()
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTMetadataCache")
+    self.ft.client = current_app.client
+
+  def metadata_queries(self):
+    return self.server.fusiontables.statements - 1 # the CREATE TABLE
+
+  def test_steady_state_issues_no_metadata_queries(self):
+    self.ft.base_schema
+    self.assertEqual(self.ft.table_name, "PYFTMetadataCache")
+    self.assertEqual(self.metadata_queries(), 2)
+
+    misses = current_app.metadata_cache.misses
+    for i in xrange(10):
+      self.ft.base_schema
+      self.ft.table_name
+      self.ft.select()
+    self.assertEqual(current_app.metadata_cache.misses, misses)
+    # just the ten selects
+    self.assertEqual(self.metadata_queries(), 12)
+
+  def test_create_and_delete_invalidate(self):
+    self.ft.table_name
+    other = FusionTable.create(self.schema, "PYFTMetadataCacheOther")
+    other.client = current_app.client
+    self.assertEqual(other.table_name, "PYFTMetadataCacheOther")
+    other.base_schema
+    other.delete()
+    self.assertRaises(ValueError, getattr, other, 'table_name')
+    self.assertRaises(Exception, getattr, other, 'base_schema')
+
+  def test_ttl_expiry(self):
+    cache = TTLCache(ttl=0.05)
+    cache.set('key', 1)
+    self.assertEqual(cache.get('key'), 1)
+    time.sleep(0.06)
+    self.assertEqual(cache.get('key'), None)
+    self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 0})
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import Row
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTBulkDelete(StubServerTestCase):
+  latency = 0.01
+
+  def setUp(self):
+    super(PYFTBulkDelete, self).setUp()
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTBulkDelete")
+    self.row_ids = self.ft.insert([Row(row_id=None, fields=[NumberField(i, column_name="numbers"),
+                                                            StringField("row%d" % i, column_name="letters")])
+                                   for i in xrange(2000)])
+
+  def remaining(self):
+    return sorted(self.server.fusiontables.tables[int(self.ft.table_id)]['rows'])
+
+  def test_delete_rows(self):
+    requests = self.server.requests
+    self.assertEqual(self.ft.delete_rows(self.row_ids[:1200], concurrency=2), 1200)
+    self.assertEqual(self.server.requests - requests, 3)
+    self.assertEqual(self.remaining(), range(1201, 2001))
+
+  def test_delete_where(self):
+    self.assertEqual(self.ft.delete_where("numbers >= 500 AND numbers < 1500"), 1000)
+    self.assertEqual(self.remaining(), range(1, 501) + range(1501, 2001))
+
+  def test_truncate(self):
+    self.ft.truncate()
+    self.assertEqual(self.remaining(), [])
+
+  def test_benchmark_deletes_per_second(self):
+    self.server.latency = 0.005
+    for label, row_ids, unbatchable in (
+        ('one DELETE per request', self.row_ids[:200], frozenset(['DELETE'])),
+        ('batched', self.row_ids[200:], frozenset())):
+      self.ft.unbatchable = unbatchable
+      start = time.time()
+      self.ft.delete_rows(row_ids)
+      print '%s: %.0f deletes/sec' % (label, len(row_ids) / (time.time() - start))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import re
+import time
+import unittest
+
+from pyft.client.sql.sqlbuilder import SQL
+from pyft.client.sql.sqlbuilder import quote
+from pyft.client.sql.sqlbuilder import PREPARED_INSERT_CACHE_SIZE
+
+class PYFTPreparedInsert(unittest.TestCase):
+
+  def setUp(self):
+    self.values = {'numbers': 12, 'ratio': 0.5, 'letters': "it's", 'name': u'caf\xe9'}
+
+  def old_insert(self, table_id, values):
+    # the string building SQL.insert used to do
+    stringValues = ""
+    count = 1
+    cols = values.keys()
+    values = values.values()
+    for value in values:
+      if type(value).__name__=='int':
+        stringValues = '%s%d' % (stringValues, value)
+      elif type(value).__name__=='float':
+        stringValues = '%s%f' % (stringValues, value)
+      else:
+        stringValues = "%s'%s'" % (stringValues, re.sub(r"(?<!\\)'", "\\'", value))
+      if count < len(values): stringValues = "%s," % (stringValues)
+      count += 1
+    return 'INSERT INTO %s (%s) VALUES (%s)' % (table_id, ','.join(["'%s'" % col for col in cols]), stringValues)
+
+  def test_matches_insert(self):
+    self.assertEqual(SQL().insert(1234, self.values), self.old_insert(1234, self.values))
+    prepared = SQL().prepare_insert(1234, self.values.keys())
+    self.assertEqual(prepared.render_dict(self.values), self.old_insert(1234, self.values))
+    self.assertTrue(SQL().prepare_insert(1234, self.values.keys()) is prepared)
+
+  def test_cache_is_bounded(self):
+    prepared = SQL().prepare_insert(1234, ['numbers'])
+    for i in xrange(PREPARED_INSERT_CACHE_SIZE * 2):
+      SQL().prepare_insert(i, ['numbers', 'letters'])
+    self.assertEqual(SQL.prepared_inserts.stats()['size'], PREPARED_INSERT_CACHE_SIZE)
+    self.assertFalse(SQL().prepare_insert(1234, ['numbers']) is prepared)
+
+  def test_column_formatters(self):
+    prepared = SQL().prepare_insert(1234, ['numbers', 'letters'], formatters=[str, quote])
+    self.assertEqual(prepared.render(['7', "a'b"]),
+                     "INSERT INTO 1234 ('numbers','letters') VALUES (7,'a\\'b')")
+    self.assertRaises(ValueError, prepared.render, ['7'])
+
+  def test_update(self):
+    self.assertEqual(SQL().update(1234, ['numbers', 'letters'], [3, "it's"], 5),
+                     "UPDATE 1234 SET 'numbers' = 3,'letters' = 'it\\'s' WHERE ROWID = '5'")
+
+  def test_benchmark_rows_per_second(self):
+    rows = [{'numbers': i, 'letters': 'row%d' % i, 'ratio': i / 3.0, 'name': "o'neil"}
+            for i in xrange(100000)]
+    start = time.clock()
+    for row in rows:
+      self.old_insert(1234, row)
+    print 'string concatenation builder: %.0f rows/sec' % (len(rows) / (time.clock() - start))
+
+    start = time.clock()
+    for row in rows:
+      SQL().insert(1234, row)
+    print 'SQL().insert: %.0f rows/sec' % (len(rows) / (time.clock() - start))
+
+    prepared = SQL().prepare_insert(1234, rows[0].keys())
+    start = time.clock()
+    for row in rows:
+      prepared.render_dict(row)
+    print 'prepare_insert: %.0f rows/sec' % (len(rows) / (time.clock() - start))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,75 @@
+import time
+import random
+import string
+import resource
+import unittest
+
+from pyft.client.sql.sqlbuilder import SQL
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import Row
+from pyft.tests.stubserver import StubServerTestCase
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+def max_rss_mb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+class PYFTColumnInsert(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTColumnInsert, self).setUp()
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTColumnInsert")
+
+  def test_insert_columns(self):
+    letters = ["row%d" % i for i in xrange(1200)]
+    letters[3] = "it's"
+    row_ids = self.ft.insert_columns({'numbers': range(1200), 'letters': letters})
+    self.assertEqual(row_ids, [str(i) for i in xrange(1, 1201)])
+    stored = self.server.fusiontables.tables[int(self.ft.table_id)]['rows']
+    self.assertEqual(stored[4], {'numbers': '3', 'letters': "it's"})
+
+  def test_mismatched_columns(self):
+    self.assertRaises(ValueError, self.ft.insert_columns, {'numbers': [1, 2], 'letters': ['a']})
+
+  @unittest.skipIf(numpy is None, "numpy is not installed")
+  def test_insert_numpy_columns(self):
+    numbers = numpy.arange(1000, dtype=numpy.int64)
+    ratios = numpy.linspace(0, 1, 1000)
+    statements = list(SQL().prepare_insert(1234, ['numbers', 'ratio']).render_columns([numbers, ratios]))
+    self.assertEqual(statements[1], "INSERT INTO 1234 ('numbers','ratio') VALUES (1,%f)" % ratios[1])
+
+    row_ids = self.ft.insert_columns({'numbers': numbers, 'letters': numpy.array(['a'] * 1000)})
+    self.assertEqual(len(row_ids), 1000)
+
+  @unittest.skipIf(numpy is None, "numpy is not installed")
+  def test_benchmark_1m_rows(self):
+    n = 1000000
+    numbers = numpy.arange(n)
+    letters = [''.join(random.sample(string.letters, 5)) for i in xrange(n)]
+
+    rss = max_rss_mb()
+    start = time.clock()
+    statements = SQL().prepare_insert(1234, ['numbers', 'letters']).render_columns([numbers, letters])
+    for statement in statements:
+      pass
+    print 'columns: %.0f rows/sec, peak rss +%.0fMB' % (n / (time.clock() - start), max_rss_mb() - rss)
+
+    rss = max_rss_mb()
+    start = time.clock()
+    rows = [Row(row_id=None, fields=[NumberField(i, column_name="numbers"),
+                                     StringField(l, column_name="letters")])
+            for i, l in zip(xrange(n), letters)]
+    for row in rows:
+      SQL().insert(1234, row.field_lookup)
+    print 'Row objects: %.0f rows/sec, peak rss +%.0fMB' % (n / (time.clock() - start), max_rss_mb() - rss)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,91 @@
+import sys
+import unittest
+
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import Row
+from pyft.fields import RowSchema
+from pyft.tests.stubserver import StubServerTestCase
+
+def deep_size(obj, seen):
+  "bytes held by `obj` and everything it references that isn't in `seen`"
+  if id(obj) in seen or isinstance(obj, type):
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems())
+  elif isinstance(obj, (list, tuple, set)):
+    size += sum(deep_size(item, seen) for item in obj)
+  for slots in [getattr(cls, '__slots__', ()) for cls in type(obj).__mro__]:
+    for name in slots:
+      size += deep_size(getattr(obj, name, None), seen)
+  if hasattr(obj, '__dict__'):
+    size += deep_size(obj.__dict__, seen)
+  return size
+
+class PYFTCompactRows(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTCompactRows, self).setUp()
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTCompactRows")
+    self.row_schema = RowSchema([('numbers', NumberField), ('letters', StringField)],
+                                unique_keys=['numbers', 'letters'])
+
+  def build_rows(self, n, start=0):
+    return [self.row_schema.row((i, "row%d" % i)) for i in xrange(start, start + n)]
+
+  def test_compact_row(self):
+    row = self.row_schema.row((3, "it's"))
+    self.assertEqual(row.column_names(), ['numbers', 'letters'])
+    self.assertEqual(row.values(), [3, "it's"])
+    self.assertEqual(row.prepared_values(), ('3', "it's"))
+    self.assertTrue(row.prepared_values() is row.prepared_values())
+    self.assertEqual(row.field_lookup, {'numbers': '3', 'letters': "it's"})
+    self.assertEqual([c.column_name for c in row.unique_keys], ['numbers', 'letters'])
+    self.assertRaises(AttributeError, setattr, row, 'other', 1)
+    self.assertRaises(ValueError, self.row_schema.row, (1,))
+
+  def test_insert_and_update(self):
+    rows = self.build_rows(1200)
+    row_ids = self.ft.insert(rows)
+    self.assertEqual(row_ids, [str(i) for i in xrange(1, 1201)])
+    stored = self.server.fusiontables.tables[int(self.ft.table_id)]['rows']
+    self.assertEqual(stored[4], {'numbers': '3', 'letters': 'row3'})
+
+    rows = [self.row_schema.row((i, "updated"), row_id=row_id)
+            for i, row_id in zip(xrange(10), row_ids)]
+    self.ft.update(rows)
+    self.assertEqual(stored[4], {'numbers': '3', 'letters': 'updated'})
+
+  def test_upsert_and_recover_from_500(self):
+    self.ft.insert(self.build_rows(10))
+    self.server.fail_after_execute = [500]
+    row_ids = self.ft.insert(self.build_rows(20, start=10))
+    self.assertEqual(row_ids, [str(i) for i in xrange(11, 31)])
+
+    rows = self.build_rows(40)
+    self.assertEqual(self.ft.upsert(rows), [str(i) for i in xrange(1, 41)])
+
+  def test_memory_per_row(self):
+    n = 1000
+    old_rows = [Row(row_id=None, fields=[NumberField(i, column_name="numbers", unique_key=True),
+                                         StringField("row%d" % i, column_name="letters", unique_key=True)])
+                for i in xrange(n)]
+    rows = self.build_rows(n)
+    old_size = deep_size(old_rows, set()) / float(n)
+    # the schema is shared by every row
+    size = deep_size(rows, set([id(self.row_schema)])) / float(n)
+    for row in rows:
+      row.prepared_values()
+    prepared_size = deep_size(rows, set([id(self.row_schema)])) / float(n)
+    print 'Row: %.0f bytes/row, CompactRow: %.0f bytes/row (%.0f once prepared)' % (
+      old_size, size, prepared_size)
+    self.assertTrue(prepared_size < old_size / 2)
+
+if __name__ == '__main__':
+  unittest.main()
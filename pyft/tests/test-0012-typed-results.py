@@ -0,0 +1,75 @@
+import math
+import time
+import datetime
+import unittest
+from array import array
+
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import LocationField
+from pyft.fields import DatetimeField
+from pyft.fields import RowSchema
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTTypedResults(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTTypedResults, self).setUp()
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers': NumberField.column_type,
+                   'place': LocationField.column_type,
+                   'when': DatetimeField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTTypedResults")
+    self.row_schema = RowSchema([('letters', StringField), ('numbers', NumberField),
+                                 ('place', LocationField), ('when', DatetimeField)])
+
+  def test_decode_columns(self):
+    start = datetime.datetime(2012, 1, 1)
+    self.ft.insert([self.row_schema.row(("row%d" % i, i * 0.5, "%d,-%d" % (i, i),
+                                          start + datetime.timedelta(hours=i)))
+                    for i in xrange(1200)])
+    headers, columns = self.ft.select_arrays(['letters', 'numbers', 'place', 'when', 'rowid'])
+    self.assertEqual(headers, ['letters', 'numbers', 'place', 'when', 'rowid'])
+    letters, numbers, places, whens, row_ids = columns
+    self.assertEqual(letters[3], 'row3')
+    self.assertTrue(isinstance(numbers, array) or hasattr(numbers, 'dtype'))
+    self.assertEqual(list(numbers[:3]), [0.0, 0.5, 1.0])
+    self.assertEqual(places[3], (3.0, -3.0))
+    self.assertEqual(whens[3], datetime.datetime(2012, 1, 1, 3))
+    self.assertEqual(row_ids[3], '4')
+
+  def test_slow_path(self):
+    numbers = NumberField.decode_column(['1', '', 'x', '2.5'])
+    self.assertEqual(numbers[0], 1.0)
+    self.assertTrue(math.isnan(numbers[1]) and math.isnan(numbers[2]))
+    self.assertEqual(LocationField.decode_column(['1 2', 'Paris', '3']), [(1.0, 2.0), None, None])
+    self.assertEqual(DatetimeField.decode_column(['2012-01-02', '']),
+                     [datetime.datetime(2012, 1, 2), None])
+
+  def test_no_rows(self):
+    headers, columns = self.ft.select_arrays(['letters', 'numbers'])
+    self.assertEqual(len(columns), 2)
+    self.assertEqual(len(columns[1]), 0)
+
+  def test_benchmark_decode(self):
+    n = 50000
+    headers = ['numbers', 'when']
+    rows = [[str(i * 0.5), '2012-01-01 00:00:%02d' % (i % 60)] for i in xrange(n)]
+
+    start = time.clock()
+    for row in rows:
+      try:
+        float(row[0])
+      except:
+        pass
+      DatetimeField.decode(row[1])
+    print 'per cell parsing: %.0f rows/sec' % (n / (time.clock() - start))
+
+    start = time.clock()
+    self.ft.decode_columns(headers, rows)
+    print 'decode_columns: %.0f rows/sec' % (n / (time.clock() - start))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,119 @@
+import os
+import ssl
+import time
+import unittest
+from urllib2 import HTTPError
+
+from pyft import current_app
+from pyft.client.ftclient import ClientLoginFTClient
+from pyft.client.ftclient import OAuthFTClient
+from pyft.client.asyncclient import AsyncFTClient
+from pyft.client.asyncclient import gather
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import RowSchema
+from pyft.tests.stubserver import StubServer
+from pyft.tests.stubserver import StubServerTestCase
+
+# a self-signed certificate for localhost
+CERTFILE = os.path.join(os.path.dirname(__file__), 'stubserver.pem')
+
+class PYFTAsyncClient(StubServerTestCase):
+  latency = 0.05
+
+  def setUp(self):
+    super(PYFTAsyncClient, self).setUp()
+    current_app.async_client = AsyncFTClient(current_app.client, max_connections=4)
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTAsyncClient")
+    self.row_schema = RowSchema([('numbers', NumberField), ('letters', StringField)])
+
+  def assertStored(self, row_ids, numbers):
+    # batches in flight together may be stored in any order
+    stored = self.server.fusiontables.tables[int(self.ft.table_id)]['rows']
+    self.assertEqual(len(row_ids), len(numbers))
+    for number, row_id in zip(numbers, row_ids):
+      self.assertEqual(stored[int(row_id)]['numbers'], str(number))
+
+  def test_bounded_concurrent_queries(self):
+    connections = self.server.connections
+    start = time.time()
+    futures = [self.ft.select_async(['numbers']) for i in xrange(20)]
+    for future in futures:
+      self.assertEqual(future.result(5), (['numbers'], []))
+    elapsed = time.time() - start
+    # 20 queries of 50ms, 4 at a time
+    self.assertTrue(elapsed < 20 * 0.05 / 2, elapsed)
+    self.assertTrue(1 < self.server.max_in_flight <= 4)
+    self.assertTrue(self.server.connections - connections <= 4)
+    self.assertTrue(current_app.async_client.stats()['reused'] >= 16)
+
+  def test_insert_update_select(self):
+    rows = [self.row_schema.row((i, "row%d" % i)) for i in xrange(1200)]
+    row_ids = self.ft.insert_async(rows).result(5)
+    self.assertStored(row_ids, xrange(1200))
+
+    updated = [self.row_schema.row((i, "updated"), row_id=row_id)
+               for i, row_id in zip(xrange(600), row_ids)]
+    self.assertEqual(len(self.ft.update_async(updated).result(5)), 600)
+
+    headers, results = self.ft.select_async(['numbers', 'letters'], {'numbers': ['1', '700']}).result(5)
+    self.assertEqual(sorted(results), [['1', 'updated'], ['700', 'row700']])
+
+  def test_errors(self):
+    future = current_app.async_client.query("SELECT * FROM 999999")
+    self.assertRaises(HTTPError, future.result, 5)
+    # the connection stays usable
+    futures = [self.ft.select_async(['numbers']), current_app.async_client.query("nonsense")]
+    self.assertEqual(futures[0].result(5), (['numbers'], []))
+    self.assertRaises(HTTPError, gather(futures).result, 5)
+
+  def test_oauth_signing(self):
+    client = OAuthFTClient('key', 'secret', 'token', 'token secret')
+    client.scope = self.server.url
+    method, url, body, headers = client.prepare_query("SHOW TABLES")
+    self.assertTrue('oauth_signature=' in headers['Authorization'])
+    async_client = AsyncFTClient(client)
+    try:
+      self.assertTrue(async_client.query("SHOW TABLES").result(5).startswith('table id'))
+      self.assertTrue(async_client.query("SHOW TABLES", request_type="POST").result(5).startswith('table id'))
+    finally:
+      async_client.close()
+
+  def test_certificates_are_verified(self):
+    server = StubServer(certfile=CERTFILE).start()
+    client = ClientLoginFTClient('token')
+    client.request_url = server.url
+    untrusting = AsyncFTClient(client)
+    trusting = AsyncFTClient(client, ssl_context=ssl.create_default_context(cafile=CERTFILE))
+    try:
+      self.assertRaises(ssl.SSLError, untrusting.query("SHOW TABLES").result, 5)
+      self.assertTrue(trusting.query("SHOW TABLES").result(5).startswith('table id'))
+    finally:
+      untrusting.close()
+      trusting.close()
+      server.stop()
+
+  def test_batches_are_built_lazily(self):
+    built = []
+    def rows():
+      for i in xrange(5000):
+        built.append(i)
+        yield self.row_schema.row((i, "row%d" % i))
+    future = self.ft.insert_async(rows(), concurrency=2)
+    time.sleep(0.02)
+    # two batches of 500 in flight, and the rows of the next being read
+    self.assertTrue(len(built) <= 3 * 500 + 1, len(built))
+    self.assertStored(future.result(5), xrange(5000))
+    self.assertTrue(self.server.max_in_flight <= 2)
+
+  def tearDown(self):
+    current_app.async_client.close()
+    current_app.async_client = None
+    super(PYFTAsyncClient, self).tearDown()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,128 @@
+import threading
+import unittest
+
+from pyft import current_app
+from pyft.cache import QueryCache
+from pyft.cache import TTLCache
+from pyft.client.asyncclient import AsyncFTClient
+from pyft.client.sql import statements
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import RowSchema
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTReadCache(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTReadCache, self).setUp()
+    current_app.client.read_cache = QueryCache(maxsize=16, ttl=60)
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTReadCache")
+    self.other = FusionTable.create(self.schema, "PYFTReadCacheOther")
+    self.row_schema = RowSchema([('numbers', NumberField), ('letters', StringField)])
+
+  def test_statements(self):
+    self.assertTrue(statements.is_read_only("  select * FROM 123"))
+    self.assertTrue(statements.is_read_only("DESCRIBE 123; SHOW TABLES"))
+    self.assertFalse(statements.is_read_only("SELECT * FROM 123; DELETE FROM 123"))
+    self.assertFalse(statements.is_read_only("INSERT INTO 123 ('a') VALUES ('select')"))
+    self.assertEqual(statements.normalize("SELECT  a\n FROM 1 WHERE b = 'x  y' ;"),
+                     "SELECT a FROM 1 WHERE b = 'x  y'")
+    self.assertEqual(statements.tables_read("SELECT a FROM 12 WHERE b = 1"), set(['12']))
+    self.assertEqual(statements.tables_written("UPDATE 12 SET a = 1;DELETE FROM 13"), set(['12', '13']))
+    self.assertEqual(statements.tables_written("DROP TABLE 12"), set(['12', statements.TABLES]))
+    self.assertEqual(statements.tables_written("ALTER 12"), None)
+
+  def test_get_for_reads(self):
+    client = current_app.client
+    self.assertEqual(client.prepare_query("SELECT * FROM 1")[0], "GET")
+    self.assertEqual(client.prepare_query("SELECT * FROM 1", request_type="POST")[0], "POST")
+    self.assertEqual(client.prepare_query("DELETE FROM 1")[0], "POST")
+    long_select = "SELECT * FROM 1 WHERE a IN (%s)" % ",".join(["'%d'" % i for i in xrange(1000)])
+    self.assertEqual(client.prepare_query(long_select)[0], "POST")
+    result = client.query(long_select.replace('FROM 1', 'FROM %s' % self.ft.table_id))
+    self.assertEqual(sorted(result.strip().split(',')), ['letters', 'numbers'])
+
+  def test_cached_reads(self):
+    self.ft.insert([self.row_schema.row((i, "row%d" % i)) for i in xrange(10)])
+    requests = self.server.requests
+    first = self.ft.select(['numbers'])
+    self.assertEqual(self.ft.select(['numbers']), first)
+    self.other.select(['numbers'])
+    self.assertEqual(self.server.requests - requests, 2)
+
+    # only the results for the table that changed are dropped
+    self.ft.insert([self.row_schema.row((10, "row10"))])
+    headers, rows = self.ft.select(['numbers'])
+    self.assertEqual(len(rows), 11)
+    self.other.select(['numbers'])
+    self.assertEqual(self.server.requests - requests, 4)
+
+    # a create changes SHOW TABLES
+    self.assertEqual(len(self.ft.fetch_table_names()), 2)
+    FusionTable.create(self.schema, "PYFTReadCacheThird")
+    self.assertEqual(len(self.ft.fetch_table_names()), 3)
+
+  def hold_inserts(self):
+    """ Make the server wait for `go` before it runs an INSERT, setting
+    `received` once it has one. """
+    received, go = threading.Event(), threading.Event()
+    fusiontables = self.server.fusiontables
+    execute = fusiontables.execute
+    def held(sql):
+      if sql.startswith('INSERT'):
+        received.set()
+        go.wait(5)
+      return execute(sql)
+    fusiontables.execute = held
+    return received, go
+
+  def test_read_during_write(self):
+    self.ft.insert([self.row_schema.row((i, "row%d" % i)) for i in xrange(10)])
+    received, go = self.hold_inserts()
+    writer = threading.Thread(target=self.ft.insert,
+                              args=([self.row_schema.row((10, "row10"))],))
+    writer.start()
+    self.assertTrue(received.wait(5))
+    # answered, and cached, before the insert is applied
+    headers, rows = self.ft.select(['numbers'])
+    self.assertEqual(len(rows), 10)
+    go.set()
+    writer.join()
+    headers, rows = self.ft.select(['numbers'])
+    self.assertEqual(len(rows), 11)
+
+  def test_async_read_during_write(self):
+    current_app.async_client = AsyncFTClient(current_app.client)
+    try:
+      received, go = self.hold_inserts()
+      insert = self.ft.insert_async([self.row_schema.row((0, "row0"))])
+      self.assertTrue(received.wait(5))
+      self.assertEqual(len(self.ft.select(['numbers'])[1]), 0)
+      go.set()
+      insert.result(5)
+      self.assertEqual(len(self.ft.select(['numbers'])[1]), 1)
+    finally:
+      current_app.async_client.close()
+      current_app.async_client = None
+
+  def test_lru(self):
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    queries = QueryCache(maxsize=2)
+    generation = queries.generation()
+    queries.invalidate(['1'])
+    # a read that was in flight when its table changed isn't cached
+    queries.set('SELECT * FROM 1', ['1'], 'stale', generation)
+    self.assertEqual(queries.get('SELECT * FROM 1'), None)
+
+if __name__ == '__main__':
+  unittest.main()
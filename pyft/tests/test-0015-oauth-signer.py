@@ -0,0 +1,63 @@
+import time
+import urllib
+import unittest
+
+from pyft.client import oauth2
+from pyft.client.oauthsigner import OAuthSigner
+from pyft.client.oauthsigner import normalize_url
+
+URL = "https://www.google.com/fusiontables/api/query"
+
+class PYFTOAuthSigner(unittest.TestCase):
+
+  def setUp(self):
+    self.consumer = oauth2.Consumer('consumer key', 'consumer~secret')
+    self.token = oauth2.Token('token key', 'token/secret')
+    self.signer = OAuthSigner(self.consumer, self.token)
+
+  def old_sign(self, method, body, nonce=None, timestamp=None):
+    # what OAuthFTClient did for every query
+    consumer = oauth2.Consumer(self.consumer.key, self.consumer.secret)
+    parameters = dict(oauth2.parse_qsl(body))
+    if nonce:
+      parameters.update(oauth_nonce=nonce, oauth_timestamp=timestamp)
+    req = oauth2.Request.from_consumer_and_token(consumer,
+      token=self.token, http_method=method, http_url=URL,
+      parameters=parameters)
+    req.sign_request(oauth2.SignatureMethod_HMAC_SHA1(), consumer, self.token)
+    return req
+
+  def test_matches_oauth2(self):
+    query = u"INSERT INTO 1 ('a b','c') VALUES ('it\\'s ~ 100% + /;', '\xe9');SELECT 1".encode('utf-8')
+    body = urllib.urlencode({'sql': query})
+    for method in ("GET", "POST"):
+      expected = self.old_sign(method, body, '12345678', '1300000000')
+      signed = self.signer.sign(method, URL, body, nonce='12345678', timestamp=1300000000)
+      self.assertEqual(signed['oauth_signature'], expected['oauth_signature'])
+    self.assertTrue(self.signer.header(signed)['Authorization'].startswith('OAuth realm="", oauth_consumer_key="consumer%20key"'))
+
+  def test_normalize_url(self):
+    self.assertEqual(normalize_url("HTTPS://Example.com:443/a?b=c"), "https://example.com/a")
+    self.assertEqual(normalize_url("http://example.com:80/a"), "http://example.com/a")
+    self.assertEqual(normalize_url("http://example.com:8080/a"), "http://example.com:8080/a")
+
+  def test_benchmark_signing_cost(self):
+    row = "INSERT INTO 1234 ('numbers','letters') VALUES (12,'it\\'s a row')"
+    for size in (1024, 102400, 1048576, 4194304):
+      body = urllib.urlencode({'sql': ';'.join([row] * (size / len(row)))})
+      n = max(1, 1048576 / size)
+
+      start = time.time()
+      for i in xrange(n):
+        self.old_sign("POST", body).to_postdata()
+      old = (time.time() - start) / n
+
+      start = time.time()
+      for i in xrange(n):
+        self.signer.sign("POST", URL, body)
+      new = (time.time() - start) / n
+      print '%7d byte body: oauth2 %.2fms, OAuthSigner %.2fms per request' % (
+        len(body), old * 1000, new * 1000)
+
+if __name__ == '__main__':
+  unittest.main()
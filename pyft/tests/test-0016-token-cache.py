@@ -0,0 +1,94 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from pyft.client.ftclient import ClientLoginFTClient
+from pyft.client.asyncclient import AsyncFTClient
+from pyft.client.connectionpool import default_pool
+from pyft.client.authorization.clientlogin import ClientLogin
+from pyft.client.authorization.tokencache import TokenCache
+from pyft.tests.stubserver import StubServer
+
+class PYFTTokenCache(unittest.TestCase):
+
+  def setUp(self):
+    self.server = StubServer().start()
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, 'pyft', 'tokens')
+    # count logins instead of going to google
+    self.logins = []
+    self.authorize = ClientLogin.authorize
+    def authorize(login, username, password):
+      self.logins.append(username)
+      return 'token%d' % len(self.logins)
+    ClientLogin.authorize = authorize
+
+  def client(self, token_cache):
+    client = ClientLoginFTClient(username='user@example.com', password='secret',
+                                 token_cache=token_cache)
+    client.request_url = self.server.url
+    return client
+
+  def test_token_cache(self):
+    cache = TokenCache(self.path, ttl=60)
+    self.assertEqual(cache.get('user@example.com'), None)
+    cache.set('user@example.com', 'abc')
+    self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+    self.assertFalse('user@example.com' in open(self.path).read())
+    # another process sharing the file
+    self.assertEqual(TokenCache(self.path).get('user@example.com'), 'abc')
+    cache.invalidate('user@example.com')
+    self.assertEqual(TokenCache(self.path).get('user@example.com'), None)
+
+    cache = TokenCache(ttl=0.05)
+    cache.set('user@example.com', 'abc')
+    time.sleep(0.1)
+    self.assertEqual(cache.get('user@example.com'), None)
+
+  def test_lazy_login(self):
+    client = self.client(TokenCache(self.path))
+    self.assertEqual(self.logins, [])
+    client.query("SHOW TABLES")
+    client.query("SHOW TABLES")
+    self.assertEqual(self.logins, ['user@example.com'])
+
+    # a new process reuses the token
+    client = self.client(TokenCache(self.path))
+    client.query("SHOW TABLES")
+    self.assertEqual(client.auth_token, 'token1')
+    self.assertEqual(len(self.logins), 1)
+
+  def test_renew_on_401(self):
+    client = self.client(TokenCache(self.path))
+    client.query("SHOW TABLES")
+    self.server.valid_tokens = set(['token2'])
+    self.assertEqual(client.query("SHOW TABLES"), 'table id,name\n')
+    self.assertEqual(len(self.logins), 2)
+    self.assertEqual(TokenCache(self.path).get('user@example.com'), 'token2')
+
+  def test_async_renew_on_401(self):
+    client = self.client(TokenCache(self.path))
+    async_client = AsyncFTClient(client)
+    try:
+      async_client.query("SHOW TABLES").result(5)
+      self.server.valid_tokens = set(['token2'])
+      self.assertEqual(async_client.query("SHOW TABLES").result(5), 'table id,name\n')
+      self.assertEqual(len(self.logins), 2)
+
+      # a token rejected again is an error
+      self.server.valid_tokens = set()
+      self.assertEqual(async_client.query("SHOW TABLES").exception(5).code, 401)
+      self.assertEqual(len(self.logins), 3)
+    finally:
+      async_client.close()
+
+  def tearDown(self):
+    ClientLogin.authorize = self.authorize
+    shutil.rmtree(self.directory)
+    default_pool.clear()
+    self.server.stop()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import subprocess
+import unittest
+
+from pyft import LazyApp
+
+# time `import pyft` in a fresh interpreter that can't open a socket
+IMPORT_SCRIPT = """
+import socket, sys, time
+def no_network(*args, **kwargs):
+  raise AssertionError('network access during import')
+socket.socket.connect = socket.socket.connect_ex = no_network
+socket.create_connection = socket.getaddrinfo = no_network
+start = time.time()
+import pyft
+elapsed = time.time() - start
+heavy = [m for m in ('httplib2', 'pyft.client.oauth2', 'urllib2', 'multiprocessing', 'ssl')
+         if m in sys.modules]
+print elapsed, ','.join(heavy)
+"""
+
+# seconds `import pyft` may take
+IMPORT_TIME_LIMIT = 0.05
+
+class PYFTLazyImport(unittest.TestCase):
+
+  def test_import_time(self):
+    env = dict(os.environ)
+    # no configuration either
+    env.pop('PYFT_LOADER', None)
+    env['PYFT_CONFIG'] = 'no_such_config_module'
+    out = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], env=env)
+    elapsed, heavy = out.split(' ')
+    print 'import pyft: %.1fms' % (float(elapsed) * 1000)
+    self.assertEqual(heavy.strip(), '')
+    self.assertTrue(float(elapsed) < IMPORT_TIME_LIMIT, elapsed)
+
+  def test_fusiontables_without_async_client(self):
+    # the async client needs fcntl, which e.g. Windows doesn't have
+    script = 'import sys, pyft.fusiontables; print "pyft.client.asyncclient" in sys.modules'
+    out = subprocess.check_output([sys.executable, '-c', script])
+    self.assertEqual(out.strip(), 'False')
+
+  def test_lazy_app(self):
+    class App(object):
+      client = None
+    apps = []
+    def factory():
+      apps.append(App())
+      return apps[-1]
+
+    app = LazyApp(factory)
+    self.assertEqual(apps, [])
+    self.assertEqual(app.client, None)
+    app.client = 'client'
+    self.assertEqual(len(apps), 1)
+    self.assertEqual(apps[0].client, 'client')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,67 @@
+import logging
+import unittest
+from StringIO import StringIO
+
+from pyft.instrumentation import QueryStats
+from pyft.instrumentation import Truncated
+
+class PYFTInstrumentation(unittest.TestCase):
+
+  def test_truncated(self):
+    self.assertEqual(str(Truncated('abc', 5)), 'abc')
+    self.assertEqual(str(Truncated('a' * 12, 5)), 'aaaaa... (7 more characters)')
+    self.assertEqual(unicode(Truncated(u'\xe9' * 3, 2)), u'\xe9\xe9... (1 more characters)')
+    self.assertEqual(str(Truncated(u'\xe9')), '\xc3\xa9')
+    self.assertEqual(str(Truncated([1, 2])), '[1, 2]')
+    # UTF-8 bytes are cut in characters, not in the middle of one
+    self.assertEqual(unicode(Truncated((u'caf\xe9 ' * 300).encode('utf-8'), 4)),
+                     u'caf\xe9... (1496 more characters)')
+    self.assertEqual(str(Truncated('\xc3\xa9\xff', 5)), '\xc3\xa9\xef\xbf\xbd')
+
+  def test_truncated_utf8_is_logged(self):
+    stream = StringIO()
+    handler = logging.StreamHandler(stream)
+    logger = logging.getLogger('pyft.tests.instrumentation.utf8')
+    logger.addHandler(handler)
+    logger.propagate = False
+    try:
+      logger.error(u'result: %s', Truncated((u'caf\xe9,' * 1000).encode('utf-8')))
+    finally:
+      logger.removeHandler(handler)
+    self.assertTrue(stream.getvalue().startswith(u'result: caf\xe9,caf\xe9'), stream.getvalue()[:100])
+    self.assertTrue(u'(4000 more characters)' in stream.getvalue())
+
+  def test_truncated_is_lazy(self):
+    formatted = []
+    class Body(object):
+      def __unicode__(self):
+        formatted.append(self)
+        return u'body'
+    logger = logging.getLogger('pyft.tests.instrumentation')
+    logger.setLevel(logging.INFO)
+    logger.debug('result: %s', Truncated(Body()))
+    self.assertEqual(formatted, [])
+
+  def test_query_stats(self):
+    stats = QueryStats(maxlen=2)
+    self.assertEqual(stats.timed("select * FROM 1", lambda: 'a,b\n1,2\n'), 'a,b\n1,2\n')
+    stats.record("INSERT INTO 1 (a) VALUES (1)", None, 0.5)
+    def fail():
+      raise ValueError('boom')
+    self.assertRaises(ValueError, stats.timed, "DELETE FROM 1", fail)
+
+    self.assertEqual(stats.queries, 3)
+    self.assertEqual(stats.errors, 1)
+    self.assertEqual(stats.query_bytes, 15 + 28 + 13)
+    self.assertEqual(stats.result_bytes, 8)
+    self.assertTrue(stats.seconds >= 0.5)
+    # only the last two are kept
+    self.assertEqual([r.verb for r in stats.records], ['INSERT', 'DELETE'])
+    self.assertEqual(stats.records[0].result_size, None)
+    self.assertTrue(isinstance(stats.records[1].error, ValueError))
+
+    stats.reset()
+    self.assertEqual((stats.queries, len(stats.records)), (0, 0))
+
+if __name__ == '__main__':
+  unittest.main()
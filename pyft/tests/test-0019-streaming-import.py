@@ -0,0 +1,170 @@
+import os
+import csv
+import time
+import shutil
+import tempfile
+import unittest
+
+from pyft.client.fileimport import fileimporter
+from pyft.client.fileimport.fileimporter import CSVImporter
+from pyft.client.fileimport.fileimporter import FileImportError
+from pyft import ratelimit
+from pyft.ratelimit import TokenBucket
+from pyft.tests.stubserver import StubServerTestCase
+
+# megabytes of CSV for the throughput benchmark, raise it for a multi-GB run
+BENCHMARK_MB = int(os.environ.get('PYFT_BENCHMARK_MB', 5))
+
+class PYFTStreamingImport(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTStreamingImport, self).setUp()
+    self.directory = tempfile.mkdtemp()
+    self.retry_delay = fileimporter.RETRY_DELAY
+    fileimporter.RETRY_DELAY = 0
+
+  def write_csv(self, n, name='rows.csv'):
+    path = os.path.join(self.directory, name)
+    with open(path, 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['numbers', 'letters'])
+      for i in xrange(n):
+        writer.writerow([i, "it's row %d" % i])
+    return path
+
+  def stored(self, table_id):
+    return self.server.fusiontables.tables[table_id]['rows']
+
+  def test_import_file(self):
+    path = self.write_csv(1200)
+    importer = CSVImporter(self.client, max_statements=500)
+    table_id = importer.importFile(path, 'PYFTStreamingImport')
+    rows = self.stored(table_id)
+    self.assertEqual(len(rows), 1200)
+    self.assertEqual(rows[1200], {'numbers': '1199', 'letters': "it's row 1199"})
+    # the create, and three batches
+    self.assertEqual(self.server.requests, 4)
+
+  def test_batches_are_packed_by_bytes(self):
+    path = self.write_csv(100)
+    table_id = CSVImporter(self.client).importFile(path)
+    requests = self.server.requests
+    row_ids = CSVImporter(self.client, max_bytes=2000).importMoreRows(path, table_id)
+    self.assertEqual(row_ids, [str(i) for i in xrange(101, 201)])
+    self.assertTrue(self.server.requests - requests > 1)
+
+  def test_concurrent_import_keeps_row_order(self):
+    self.server.latency = 0.02
+    path = self.write_csv(2000)
+    table_id = CSVImporter(self.client).importFile(path)
+    importer = CSVImporter(self.client, concurrency=4, max_statements=100)
+    row_ids = importer.importMoreRows(path, table_id)
+    rows = self.stored(table_id)
+    for i, row_id in enumerate(row_ids):
+      self.assertEqual(rows[int(row_id)]['numbers'], str(i))
+    self.assertTrue(self.server.max_in_flight > 1)
+
+  def test_iter_import_rows(self):
+    path = self.write_csv(250)
+    table_id = CSVImporter(self.client).importFile(path)
+    batches = list(CSVImporter(self.client, max_statements=100).iterImportRows(path, table_id))
+    self.assertEqual([len(batch) for batch in batches], [100, 100, 50])
+
+  def create_table(self):
+    return int(self.client.query("CREATE TABLE 'PYFTStreamingImport' ('numbers': NUMBER, 'letters': STRING)").split()[1])
+
+  def test_stored_rows_are_not_sent_again(self):
+    path = self.write_csv(300)
+    table_id = self.create_table()
+    # the first batch goes through but is reported as failed; the rows it
+    # stored are looked up instead of being sent again
+    self.server.fail_after_execute = [500]
+    importer = CSVImporter(self.client, max_statements=100, unique_keys=['numbers'])
+    row_ids = importer.importMoreRows(path, table_id)
+    rows = self.stored(table_id)
+    self.assertEqual(len(rows), 300)
+    self.assertEqual(row_ids, [str(i) for i in xrange(1, 301)])
+
+  def test_stored_rows_are_probed_in_chunks(self):
+    path = self.write_csv(1200)
+    table_id = self.create_table()
+    self.server.fail_after_execute = [500]
+    requests = self.server.requests
+    importer = CSVImporter(self.client, max_statements=1200, unique_keys=['numbers'])
+    row_ids = importer.importMoreRows(path, table_id)
+    # the insert, then a lookup for every 500 keys
+    self.assertEqual(self.server.requests - requests, 4)
+    self.assertEqual(row_ids, [str(i) for i in xrange(1, 1201)])
+
+  def test_retries_need_unique_keys(self):
+    self.assertEqual(CSVImporter(self.client).retries, 0)
+    self.assertEqual(CSVImporter(self.client, unique_keys=['numbers']).retries, 2)
+    self.assertRaises(ValueError, CSVImporter, self.client, retries=2)
+
+  def test_unknown_failures_are_not_resent(self):
+    path = self.write_csv(300)
+    table_id = self.create_table()
+    self.server.fail_after_execute = [200, 500]
+    importer = CSVImporter(self.client, max_statements=100)
+    try:
+      importer.importMoreRows(path, table_id)
+      self.fail('expected a FileImportError')
+    except FileImportError, e:
+      self.assertEqual([(line, n, error.code) for line, n, error in e.failures], [(100, 100, 500)])
+      self.assertEqual(e.row_ids[99:101], ['100', None])
+    # without unique keys the batch can't be checked, so it isn't resent
+    self.assertEqual(len(self.stored(table_id)), 300)
+
+  def test_failed_batches_are_reported(self):
+    path = self.write_csv(300)
+    table_id = CSVImporter(self.client).importFile(path)
+    requests = self.server.requests
+    importer = CSVImporter(self.client, max_statements=100, retries=1, unique_keys=['numbers'])
+    try:
+      importer.importMoreRows(path, 9999)
+      self.fail('expected a FileImportError')
+    except FileImportError, e:
+      self.assertEqual(e.row_ids, [None] * 300)
+      self.assertEqual([(line, n) for line, n, error in e.failures],
+                       [(0, 100), (100, 100), (200, 100)])
+    # a rejected batch is not retried
+    self.assertEqual(self.server.requests - requests, 3)
+
+  def test_imports_share_the_rate_limit(self):
+    ratelimit.default_rate_limiter = TokenBucket(20, capacity=1)
+    path = self.write_csv(100)
+    table_id = self.create_table()
+    start = time.time()
+    CSVImporter(self.client, concurrency=4, max_statements=20).importMoreRows(path, table_id)
+    # five batches, the first token free and the rest 50ms apart
+    self.assertTrue(time.time() - start >= 4 / 20.0 - 0.01)
+
+  def test_benchmark_throughput(self):
+    path = os.path.join(self.directory, 'benchmark.csv')
+    with open(path, 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['numbers', 'letters'])
+      i = 0
+      while f.tell() < BENCHMARK_MB * 1024 * 1024:
+        writer.writerow([i, 'some letters for row %d' % i])
+        i += 1
+    table_id = int(self.client.query("CREATE TABLE 'benchmark' ('numbers': NUMBER, 'letters': STRING)").split()[1])
+
+    for concurrency in (1, 4):
+      start = time.time()
+      rows = 0
+      importer = CSVImporter(self.client, concurrency=concurrency)
+      for row_ids in importer.iterImportRows(path, table_id):
+        rows += len(row_ids)
+      elapsed = time.time() - start
+      print 'import of %dMB, concurrency %d: %.0f rows/sec, %.1fMB/sec' % (
+        BENCHMARK_MB, concurrency, rows / elapsed, BENCHMARK_MB / elapsed)
+      self.server.fusiontables.tables[table_id]['rows'].clear()
+
+  def tearDown(self):
+    fileimporter.RETRY_DELAY = self.retry_delay
+    shutil.rmtree(self.directory)
+    super(PYFTStreamingImport, self).tearDown()
+
+if __name__ == '__main__':
+  unittest.main()
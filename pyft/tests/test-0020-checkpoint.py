@@ -0,0 +1,183 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+from urllib2 import HTTPError
+
+from pyft import current_app
+from pyft.checkpoint import Checkpoint
+from pyft.client.fileimport import fileimporter
+from pyft.client.fileimport.fileimporter import CSVImporter
+from pyft.client.fileimport.fileimporter import FileImportError
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import Row
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTCheckpoint(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTCheckpoint, self).setUp()
+    self.retry_delay = fileimporter.RETRY_DELAY
+    fileimporter.RETRY_DELAY = 0
+    self.directory = tempfile.mkdtemp()
+    self.journal = os.path.join(self.directory, 'journal')
+
+  def write_csv(self, n):
+    path = os.path.join(self.directory, 'rows.csv')
+    with open(path, 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['numbers', 'letters'])
+      for i in xrange(n):
+        # a quoted newline makes lines and records differ
+        writer.writerow([i, "row\n%d" % i])
+    return path
+
+  def stored(self, table_id):
+    return self.server.fusiontables.tables[int(table_id)]['rows']
+
+  def test_journal(self):
+    checkpoint = Checkpoint(self.journal, 'job')
+    self.assertEqual((checkpoint.batches, checkpoint.position, checkpoint.row_ids), (0, None, []))
+    checkpoint.commit(['1', '2'], 2)
+    checkpoint.commit(['3'], [3, 100])
+    # a crash halfway through writing a batch
+    with open(self.journal, 'ab') as f:
+      f.write('{"position": 4, "row')
+
+    checkpoint = Checkpoint(self.journal, 'job')
+    self.assertEqual((checkpoint.batches, checkpoint.position, checkpoint.row_ids),
+                     (2, [3, 100], ['1', '2', '3']))
+    checkpoint.commit(['4'], 4)
+    self.assertEqual(Checkpoint(self.journal, 'job').row_ids, ['1', '2', '3', '4'])
+
+    # batches acknowledged out of order wait for the ones before them
+    checkpoint.commit(['7'], 7, 5)
+    checkpoint.commit(['5', '6'], 6, 4)
+    checkpoint = Checkpoint(self.journal, 'job')
+    self.assertEqual((checkpoint.batches, checkpoint.position, checkpoint.ahead),
+                     (3, 4, {4: (6, ['5', '6']), 5: (7, ['7'])}))
+    checkpoint.commit(['4b'], 4.5)
+    self.assertEqual((checkpoint.batches, checkpoint.position, checkpoint.ahead), (6, 7, {}))
+    self.assertEqual(Checkpoint(self.journal, 'job').row_ids, ['1', '2', '3', '4', '4b', '5', '6', '7'])
+
+    self.assertRaises(ValueError, Checkpoint, self.journal, 'another job')
+    checkpoint.clear()
+    self.assertEqual(Checkpoint(self.journal, 'another job').batches, 0)
+
+  def test_import_resumes(self):
+    path = self.write_csv(1000)
+    table_id = int(current_app.client.query(
+      "CREATE TABLE 'PYFTCheckpoint' ('numbers': NUMBER, 'letters': STRING)").split()[1])
+    importer = CSVImporter(current_app.client, max_statements=100)
+
+    # the fourth batch fails, after three made it
+    self.server.fail_after_execute = [200, 200, 200, 400]
+    try:
+      importer.importMoreRows(path, table_id, checkpoint=self.journal)
+      self.fail('expected a FileImportError')
+    except FileImportError, e:
+      self.assertEqual(len(e.row_ids), 300)
+      self.assertEqual(e.failures[0][:2], (300, 100))
+    self.assertEqual(len(self.stored(table_id)), 400)
+
+    requests = self.server.requests
+    row_ids = importer.importMoreRows(path, table_id, checkpoint=self.journal)
+    self.assertEqual(self.server.requests - requests, 7)
+    self.assertEqual(len(row_ids), 1000)
+    rows = self.stored(table_id)
+    # the failed batch was sent again
+    self.assertEqual(len(rows), 1100)
+    for i, row_id in enumerate(row_ids):
+      self.assertEqual(rows[int(row_id)], {'numbers': str(i), 'letters': 'row\n%d' % i})
+
+    # nothing left to send
+    requests = self.server.requests
+    self.assertEqual(importer.importMoreRows(path, table_id, checkpoint=self.journal), row_ids)
+    self.assertEqual(self.server.requests, requests)
+
+  def fail_first_insert(self):
+    """ Make the server reject, without storing, the first INSERT it
+    gets, while the ones sent with it are still in flight. """
+    self.server.latency = 0.05
+    fusiontables = self.server.fusiontables
+    execute = fusiontables.execute
+    failures = [ValueError('rejected')]
+    def fail_first(sql):
+      if sql.startswith('INSERT') and failures:
+        raise failures.pop()
+      return execute(sql)
+    fusiontables.execute = fail_first
+
+  def test_concurrent_import_resumes(self):
+    path = self.write_csv(1000)
+    table_id = int(current_app.client.query(
+      "CREATE TABLE 'PYFTCheckpoint' ('numbers': NUMBER, 'letters': STRING)").split()[1])
+    importer = CSVImporter(current_app.client, concurrency=4, max_statements=100)
+    self.fail_first_insert()
+    self.assertRaises(FileImportError, importer.importMoreRows, path, table_id, checkpoint=self.journal)
+
+    row_ids = importer.importMoreRows(path, table_id, checkpoint=self.journal)
+    rows = self.stored(table_id)
+    # the batches in flight with the one that failed were not sent again
+    self.assertEqual(len(rows), 1000)
+    self.assertEqual(sorted(int(row['numbers']) for row in rows.values()), range(1000))
+    for i, row_id in enumerate(row_ids):
+      self.assertEqual(rows[int(row_id)]['numbers'], str(i))
+
+  def test_concurrent_insert_resumes(self):
+    ft = FusionTable.create({'letters': StringField.column_type,
+                             'numbers': NumberField.column_type}, "PYFTCheckpoint")
+    rows = [Row(row_id=None, fields=[NumberField(i, column_name="numbers"),
+                                     StringField("row%d" % i, column_name="letters")])
+            for i in xrange(3000)]
+    self.fail_first_insert()
+    self.assertRaises(HTTPError, ft.insert, rows, concurrency=4, checkpoint=self.journal)
+
+    row_ids = ft.insert(rows, concurrency=4, checkpoint=self.journal)
+    stored = self.stored(ft.table_id)
+    self.assertEqual(len(stored), 3000)
+    for i, row_id in enumerate(row_ids):
+      self.assertEqual(stored[int(row_id)]['numbers'], str(i))
+
+  def test_insert_resumes(self):
+    ft = FusionTable.create({'letters': StringField.column_type,
+                             'numbers': NumberField.column_type}, "PYFTCheckpoint")
+    rows = [Row(row_id=None, fields=[NumberField(i, column_name="numbers"),
+                                     StringField("row%d" % i, column_name="letters")])
+            for i in xrange(1200)]
+    self.server.fail_after_execute = [200, 400]
+    self.assertRaises(HTTPError, ft.insert, rows, checkpoint=self.journal)
+
+    requests = self.server.requests
+    row_ids = ft.insert(rows, concurrency=2, checkpoint=self.journal)
+    self.assertEqual(self.server.requests - requests, 2)
+    self.assertEqual(row_ids[:500], [str(i) for i in xrange(1, 501)])
+    self.assertEqual(len(row_ids), 1200)
+    self.assertEqual(self.stored(ft.table_id)[int(row_ids[-1])]['numbers'], '1199')
+
+  def test_insert_checks_the_rows(self):
+    ft = FusionTable.create({'letters': StringField.column_type,
+                             'numbers': NumberField.column_type}, "PYFTCheckpoint")
+    def build_rows(n, letters='row'):
+      return [Row(row_id=None, fields=[NumberField(i, column_name="numbers"),
+                                       StringField("%s%d \xc3\xa9" % (letters, i), column_name="letters")])
+              for i in xrange(n)]
+    ft.insert(build_rows(600), checkpoint=self.journal)
+    # a different number of rows, or different rows, is another insert
+    for rows in (build_rows(700), build_rows(600, 'other'), build_rows(600)[:1] + build_rows(600, 'other')[1:]):
+      self.assertRaises(ValueError, ft.insert, rows, checkpoint=self.journal)
+      self.assertRaises(ValueError, ft.insert, rows, checkpoint=self.journal, processes=2)
+    requests = self.server.requests
+    self.assertEqual(len(ft.insert(build_rows(600), checkpoint=self.journal)), 600)
+    self.assertEqual(self.server.requests, requests)
+
+  def tearDown(self):
+    fileimporter.RETRY_DELAY = self.retry_delay
+    shutil.rmtree(self.directory)
+    super(PYFTCheckpoint, self).tearDown()
+
+if __name__ == '__main__':
+  unittest.main()
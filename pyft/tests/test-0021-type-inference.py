@@ -0,0 +1,133 @@
+import os
+import csv
+import time
+import random
+import shutil
+import tempfile
+import unittest
+
+from pyft.client.fileimport import typeinference
+from pyft.client.fileimport.fileimporter import CSVImporter
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTTypeInference(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTTypeInference, self).setUp()
+    self.directory = tempfile.mkdtemp()
+
+  def write_csv(self, rows, name='rows.csv'):
+    path = os.path.join(self.directory, name)
+    with open(path, 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(['number', 'when', 'where', 'name', 'empty'])
+      writer.writerows(rows)
+    return path
+
+  def test_values(self):
+    for value in ('1', '-2.5', '+.5', '1e10', '3.0E-2'):
+      self.assertTrue(typeinference.is_number(value), value)
+    for value in ('0', '0.5', '-0.25', '10', '100.0'):
+      self.assertTrue(typeinference.is_number(value), value)
+    # leading zeros would be dropped sending these as numbers
+    for value in ('02134', '007', '00.5', '-01', '0123456789'):
+      self.assertFalse(typeinference.is_number(value), value)
+    for value in ('1,000', 'nan', 'inf', '1.2.3', '0x10', ''):
+      self.assertFalse(typeinference.is_number(value), value)
+    for value in ('2012-01-31', '2012/1/31', '1/31/2012', '2012-01-31 12:30', '2012-01-31T12:30:00Z',
+                  '1/31/12 1:30 PM'):
+      self.assertTrue(typeinference.is_datetime(value), value)
+    for value in ('2012', 'January', '2012-01', '12:30'):
+      self.assertFalse(typeinference.is_datetime(value), value)
+    for value in ('37.42, -122.08', '-33.86 151.2', '<Point><coordinates>1,2</coordinates></Point>'):
+      self.assertTrue(typeinference.is_location(value), value)
+    for value in ('12,34', '95.0,10.0', 'Mountain View'):
+      self.assertFalse(typeinference.is_location(value), value)
+
+  def test_infer_types(self):
+    rows = [['1', '2012-01-31', '37.42,-122.08', 'a', ''],
+            ['', '2/1/2012', '', '2', ' '],
+            ['2.5', '', '-33.86 151.2', '3', '']]
+    self.assertEqual(typeinference.infer_types(rows, 5),
+                     ['NUMBER', 'DATETIME', 'LOCATION', 'STRING', 'STRING'])
+    # one value that doesn't fit is enough
+    rows.append(['n/a', '', '', '', ''])
+    self.assertEqual(typeinference.infer_types(rows, 5)[0], 'STRING')
+    self.assertEqual(typeinference.infer_types([], 2), ['STRING', 'STRING'])
+    # ZIP codes
+    self.assertEqual(typeinference.infer_types([['10001'], ['02134'], ['94043']], 1), ['STRING'])
+    self.assertEqual(typeinference.formatters(['NUMBER'])[0]('02134'), "'02134'")
+
+  def test_reservoir_sample(self):
+    self.assertEqual(typeinference.reservoir_sample(xrange(3), 5), [0, 1, 2])
+    sample = typeinference.reservoir_sample(xrange(10000), 100, random.Random(1))
+    self.assertEqual(len(set(sample)), 100)
+    self.assertTrue(max(sample) > 5000)
+
+  def test_import_file_infers_types(self):
+    rows = [[i, '2012-01-%02d' % (i % 28 + 1), '37.4%d,-122.0%d' % (i, i), "it's %d" % i, '']
+            for i in xrange(50)]
+    path = self.write_csv(rows)
+    importer = CSVImporter(self.client)
+    self.assertEqual(importer.inferTypes(path),
+                     [('number', 'NUMBER'), ('when', 'DATETIME'), ('where', 'LOCATION'),
+                      ('name', 'STRING'), ('empty', 'STRING')])
+
+    statements = []
+    query = self.client.query
+    def record(sql, *args, **kwargs):
+      statements.append(sql)
+      return query(sql, *args, **kwargs)
+    self.client.query = record
+    table_id = importer.importFile(path, 'PYFTTypeInference', sample_rows=10)
+
+    table = self.server.fusiontables.tables[table_id]
+    self.assertEqual(dict((c[1], c[2]) for c in table['columns']),
+                     {'number': 'number', 'when': 'datetime', 'where': 'location',
+                      'name': 'string', 'empty': 'string'})
+    self.assertEqual(len(table['rows']), 50)
+    # numbers go unquoted
+    self.assertTrue("VALUES (49,'2012-01-22'" in statements[-1])
+
+    # a value past the sample that isn't a number is still sent, quoted
+    path = self.write_csv(rows + [['n/a', '', '', '', '']], 'late.csv')
+    table_id = importer.importFile(path, sample_rows=10)
+    table = self.server.fusiontables.tables[table_id]
+    self.assertTrue(('number', 'number') in [c[1:] for c in table['columns']])
+    self.assertEqual(table['rows'][51]['number'], 'n/a')
+
+    # so do the numbers of a short record
+    path = self.write_csv(rows + [[60]], 'short.csv')
+    importer.importFile(path, sample_rows=10)
+    self.assertTrue("('number') VALUES (60)" in statements[-1])
+
+    # or no inference at all
+    table_id = importer.importFile(path, sample_rows=0)
+    self.assertEqual(set(c[2] for c in self.server.fusiontables.tables[table_id]['columns']),
+                     set(['string']))
+
+  def test_benchmark_inference(self):
+    n = 200000
+    path = self.write_csv([i, '2012-01-%02d 12:30' % (i % 28 + 1), '37.%d,-122.%d' % (i, i), 'row %d' % i, '']
+                          for i in xrange(n))
+    importer = CSVImporter(self.client)
+
+    start = time.time()
+    with open(path, 'rb') as f:
+      for row in csv.reader(f):
+        pass
+    print 'reading %d rows: %.3fs' % (n, time.time() - start)
+
+    for label, kwargs in (('the first 1000 rows', {}),
+                          ('a reservoir of 1000 rows', {'reservoir': True}),
+                          ('every row', {'sample_rows': n})):
+      start = time.time()
+      importer.inferTypes(path, **kwargs)
+      print 'inferring from %s: %.3fs' % (label, time.time() - start)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    super(PYFTTypeInference, self).tearDown()
+
+if __name__ == '__main__':
+  unittest.main()
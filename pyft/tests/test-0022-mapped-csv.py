@@ -0,0 +1,189 @@
+import os
+import csv
+import time
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+from multiprocessing import Pool
+
+from pyft import current_app
+from pyft.client.fileimport import csvsource
+from pyft.client.fileimport.csvsource import MappedCSV
+from pyft.client.fileimport.fileimporter import CSVImporter
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.tests.stubserver import StubServerTestCase
+
+VALUES = ['plain', 'with, comma', 'with "quotes"', 'multi\nline', 'crlf\r\nline', '', 'x' * 300]
+
+def count_records(args):
+  filename, start, end = args
+  with MappedCSV(filename) as source:
+    return sum(1 for values in source.values(start, end))
+
+class PYFTMappedCSV(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTMappedCSV, self).setUp()
+    self.block_size = csvsource.BLOCK_SIZE
+    self.directory = tempfile.mkdtemp()
+
+  def write_csv(self, rows, name='rows.csv', header=('numbers', 'letters')):
+    path = os.path.join(self.directory, name)
+    with open(path, 'wb') as f:
+      writer = csv.writer(f)
+      writer.writerow(header)
+      writer.writerows(rows)
+    return path
+
+  def random_rows(self, n):
+    rng = random.Random(n)
+    return [[str(i), rng.choice(VALUES)] for i in xrange(n)]
+
+  def test_records(self):
+    # blocks small enough for records to straddle them
+    csvsource.BLOCK_SIZE = 64
+    rows = self.random_rows(500)
+    path = self.write_csv(rows)
+    with MappedCSV(path) as source:
+      self.assertEqual(source.header, ['numbers', 'letters'])
+      self.assertEqual(list(source.values()), rows)
+      records = list(source.records())
+      self.assertEqual([values for values, offset in records], rows)
+      self.assertEqual(records[-1][1], source.size)
+      # resuming after any record
+      for i in (0, 99, 498):
+        self.assertEqual([values for values, offset in source.records(records[i][1])], rows[i + 1:])
+
+  def test_split(self):
+    csvsource.BLOCK_SIZE = 64
+    rows = self.random_rows(500)
+    path = self.write_csv(rows)
+    with MappedCSV(path) as source:
+      for parts in (1, 2, 3, 8, 1000):
+        ranges = source.split(parts)
+        self.assertTrue(len(ranges) <= parts)
+        self.assertEqual(ranges[0][0], source.data_start)
+        self.assertEqual(ranges[-1][1], source.size)
+        values = []
+        for start, end in ranges:
+          self.assertEqual([v for v, offset in source.records(start, end)],
+                           list(source.values(start, end)))
+          values += list(source.values(start, end))
+        self.assertEqual(values, rows)
+
+  def test_small_files(self):
+    path = os.path.join(self.directory, 'empty.csv')
+    open(path, 'wb').close()
+    with MappedCSV(path) as source:
+      self.assertEqual((source.header, list(source.records()), source.split(4)), ([], [], []))
+    path = self.write_csv([], 'header.csv')
+    with MappedCSV(path) as source:
+      self.assertEqual((source.header, list(source.records()), source.split(4)),
+                       (['numbers', 'letters'], [], []))
+    with open(path, 'ab') as f:
+      f.write('1,"no newline"')
+    with MappedCSV(path) as source:
+      self.assertEqual([v for v, offset in source.records()], [['1', 'no newline']])
+
+  def test_import_ranges_in_parallel(self):
+    rows = self.random_rows(2000)
+    path = self.write_csv(rows)
+    table_id = int(current_app.client.query(
+      "CREATE TABLE 'PYFTMappedCSV' ('numbers': NUMBER, 'letters': STRING)").split()[1])
+    importer = CSVImporter(current_app.client, max_statements=100)
+    ranges = importer.splitFile(path, 4)
+    row_ids = [None] * len(ranges)
+    def worker(i):
+      row_ids[i] = importer.importMoreRows(path, table_id, byte_range=ranges[i])
+    threads = [threading.Thread(target=worker, args=(i,)) for i in xrange(len(ranges))]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+    stored = self.server.fusiontables.tables[table_id]['rows']
+    row_ids = sum(row_ids, [])
+    self.assertEqual(len(row_ids), 2000)
+    for row, row_id in zip(rows, row_ids):
+      self.assertEqual(stored[int(row_id)], {'numbers': row[0], 'letters': row[1]})
+
+  def test_insert_csv(self):
+    ft = FusionTable.create({'letters': StringField.column_type,
+                             'numbers': NumberField.column_type}, "PYFTMappedCSV")
+    rows = self.random_rows(1200)
+    path = self.write_csv(rows)
+    statements = []
+    query = current_app.client.query
+    def record(sql, *args, **kwargs):
+      statements.append(sql)
+      return query(sql, *args, **kwargs)
+    current_app.client.query = record
+
+    row_ids = ft.insert_csv(path, concurrency=2)
+    self.assertEqual(len(row_ids), 1200)
+    stored = self.server.fusiontables.tables[int(ft.table_id)]['rows']
+    # the batches in flight may be stored in either order
+    for row, row_id in zip(rows, row_ids):
+      self.assertEqual(stored[int(row_id)], {'numbers': row[0], 'letters': row[1]})
+    self.assertTrue([sql for sql in statements if "VALUES (1199," in sql])
+
+    with MappedCSV(path) as source:
+      start, end = source.split(2)[1]
+    self.assertEqual(len(ft.insert_csv(path, byte_range=(start, end))), len(stored) - 1200)
+
+  def test_ragged_records(self):
+    ft = FusionTable.create({'letters': StringField.column_type,
+                             'numbers': NumberField.column_type}, "PYFTMappedCSV")
+    path = self.write_csv([['1', 'a'], ['2'], ['3', 'c', 'extra'], [], ['4', 'd']])
+    with open(path, 'ab') as f:
+      f.write('\n')
+    row_ids = ft.insert_csv(path)
+    stored = self.server.fusiontables.tables[int(ft.table_id)]['rows']
+    self.assertEqual([stored[int(row_id)] for row_id in row_ids],
+                     [{'numbers': '1', 'letters': 'a'}, {'numbers': '2'},
+                      {'numbers': '3', 'letters': 'c'}, {'numbers': '4', 'letters': 'd'}])
+
+    table_id = int(current_app.client.query(
+      "CREATE TABLE 'PYFTMappedCSV' ('numbers': NUMBER, 'letters': STRING)").split()[1])
+    row_ids = CSVImporter(current_app.client).importMoreRows(path, table_id)
+    self.assertEqual(len(row_ids), 4)
+
+  def test_benchmark_parsing(self):
+    n = 500000
+    path = self.write_csv(([i, 'some letters for row %d' % i] for i in xrange(n)), 'benchmark.csv')
+    size = os.path.getsize(path) / 1048576.0
+
+    start = time.time()
+    with open(path, 'rb') as f:
+      for values in csv.reader(f):
+        pass
+    elapsed = time.time() - start
+    print 'csv.reader: %.0f rows/sec, %.1fMB/sec' % (n / elapsed, size / elapsed)
+
+    for method in ('values', 'records'):
+      start = time.time()
+      with MappedCSV(path) as source:
+        for record in getattr(source, method)():
+          pass
+      elapsed = time.time() - start
+      print 'MappedCSV.%s: %.0f rows/sec, %.1fMB/sec' % (method, n / elapsed, size / elapsed)
+
+    for processes in (2, 4):
+      with MappedCSV(path) as source:
+        ranges = source.split(processes)
+      pool = Pool(processes)
+      start = time.time()
+      self.assertEqual(sum(pool.map(count_records, [(path, s, e) for s, e in ranges])), n)
+      elapsed = time.time() - start
+      pool.terminate()
+      print 'MappedCSV, %d processes: %.0f rows/sec, %.1fMB/sec' % (processes, n / elapsed, size / elapsed)
+
+  def tearDown(self):
+    csvsource.BLOCK_SIZE = self.block_size
+    shutil.rmtree(self.directory)
+    super(PYFTMappedCSV, self).tearDown()
+
+if __name__ == '__main__':
+  unittest.main()
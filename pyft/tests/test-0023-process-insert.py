@@ -0,0 +1,91 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from urllib2 import HTTPError
+from multiprocessing import Process
+
+from pyft.fusiontables import FusionTable
+from pyft.fields import NumberField
+from pyft.fields import StringField
+from pyft.fields import Row
+from pyft import ratelimit
+from pyft.ratelimit import SharedTokenBucket
+from pyft.tests.stubserver import StubServerTestCase
+
+class PYFTProcessInsert(StubServerTestCase):
+
+  def setUp(self):
+    super(PYFTProcessInsert, self).setUp()
+    self.directory = tempfile.mkdtemp()
+
+    self.schema = {'letters': StringField.column_type,
+                   'numbers':NumberField.column_type}
+    self.ft = FusionTable.create(self.schema, "PYFTProcessInsert")
+
+  def build_rows(self, n, start=0):
+    return [Row(row_id=None, fields=[NumberField(i, column_name="numbers"),
+                                     StringField("it's row %d" % i, column_name="letters")])
+            for i in xrange(start, start + n)]
+
+  def stored(self):
+    return self.server.fusiontables.tables[int(self.ft.table_id)]['rows']
+
+  def test_rows_ids_in_order(self):
+    rows = self.build_rows(5000)
+    row_ids = self.ft.insert(rows, processes=3, concurrency=2)
+    self.assertEqual(len(row_ids), 5000)
+    stored = self.stored()
+    for row, row_id in zip(rows, row_ids):
+      self.assertEqual(stored[int(row_id)]['numbers'], str(row[0].value))
+    # the parent and its workers share one rate limiter from now on
+    rate_limiter = FusionTable.rate_limiter
+    self.assertTrue(isinstance(rate_limiter, SharedTokenBucket))
+    self.assertTrue(ratelimit.default_rate_limiter is rate_limiter)
+    self.assertEqual(rate_limiter.rate, self.rate)
+    self.ft.insert(self.build_rows(10), processes=2)
+    self.assertTrue(FusionTable.rate_limiter is rate_limiter)
+
+  def test_errors_reach_the_parent(self):
+    self.server.fail_after_execute = [200, 400]
+    self.assertRaises(HTTPError, self.ft.insert, self.build_rows(3000), processes=2)
+
+  def test_checkpoint(self):
+    journal = os.path.join(self.directory, 'journal')
+    rows = self.build_rows(5000)
+    self.server.fail_after_execute = [200] * 6 + [400]
+    self.assertRaises(HTTPError, self.ft.insert, rows, checkpoint=journal, processes=2)
+
+    row_ids = self.ft.insert(rows, checkpoint=journal, processes=2)
+    self.assertEqual(len(row_ids), 5000)
+    stored = self.stored()
+    for row, row_id in zip(rows, row_ids):
+      self.assertEqual(stored[int(row_id)]['numbers'], str(row[0].value))
+
+  def test_shared_token_bucket(self):
+    bucket = SharedTokenBucket(50)
+    def worker():
+      for i in xrange(5):
+        bucket.acquire()
+    processes = [Process(target=worker) for i in xrange(4)]
+    start = time.time()
+    for p in processes: p.start()
+    for p in processes: p.join()
+    # the first token is free, the other 19 are spaced 20ms apart
+    self.assertTrue(time.time() - start >= 19 / 50.0 - 0.01)
+
+  def test_benchmark_workers(self):
+    rows = self.build_rows(20000)
+    for processes in (1, 2, 4, 8):
+      start = time.time()
+      self.ft.insert(rows, processes=processes)
+      print '%d processes: %.0f rows/sec' % (processes, len(rows) / (time.time() - start))
+      self.stored().clear()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+    super(PYFTProcessInsert, self).tearDown()
+
+if __name__ == '__main__':
+  unittest.main()
@@ -3,12 +3,9 @@ import sys
 
 import imp as _imp
 import importlib
+from collections import deque
 from contextlib import contextmanager
 
-from pyft.client.authorization.clientlogin import ClientLogin
-from pyft.client.ftclient import ClientLoginFTClient
-from pyft.client.sql.sqlbuilder import SQL
-
 
 @contextmanager
 def cwd_in_path():
@@ -78,17 +75,37 @@ def import_from_cwd(module, imp=None):
     with cwd_in_path():
         return imp(module)
 
-def ft_client_factory(username, password):
-
-  token = ClientLogin().authorize(username, password)
-  client = ClientLoginFTClient(token)
+def imap_bounded(func, iterable, workers, backlog=None):
+  """Like ThreadPool.imap, yielding results in input order, but only
+  pulls `backlog` items ahead of the consumer so a lazy iterable is never
+  read into memory all at once."""
+  from multiprocessing.pool import ThreadPool
+  if backlog is None:
+    backlog = workers * 2
+  pool = ThreadPool(workers)
+  pending = deque()
+  try:
+    for item in iterable:
+      pending.append(pool.apply_async(func, (item,)))
+      if len(pending) >= backlog:
+        yield pending.popleft().get()
+    while pending:
+      yield pending.popleft().get()
+  finally:
+    pool.terminate()
+
+def ft_client_factory(username, password, token_cache=None):
+  "a client that logs in on its first query, see ClientLoginFTClient"
+  from pyft.client.ftclient import ClientLoginFTClient
+
+  client = ClientLoginFTClient(username=username, password=password,
+                               token_cache=token_cache)
   return client
 
 
 # VALIDATION
 
 import re
-from urllib2 import HTTPError
 
 def validate_ft_input_string(input_str):
   """
@@ -118,6 +135,7 @@ def validate_ft_input_string(input_str):
 
 
 def validate_ft_id_list(input_ft_id_list):
+  from urllib2 import HTTPError
   ft = ft_client_factory()
   unauthorized_ids = []
   error_ids = []